@@ -0,0 +1,257 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+import random
+import logging
+import threading
+
+import boto.connection
+import boto.s3.connection
+import boto3
+
+import defaults
+import tracing
+
+"""
+Middleware applied to every AWS API call, made through either boto or boto3.
+Calls are rate limited by a token bucket, throttled calls are retried with
+jittered exponential backoff, and counts and latencies are recorded per operation
+"""
+
+# Error codes AWS uses when a request is throttled
+throttling_error_codes = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException',
+                          'RequestThrottled', 'SlowDown', 'TooManyRequestsException')
+
+_error_code_re = re.compile(r'<Code>([^<]+)</Code>')
+
+
+class TokenBucket(object):
+    """
+    Allows rate calls per second on average, and bursts of up to capacity calls
+    """
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting until one is available. Returns number of seconds waited
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative, reserving a place in the queue for this caller
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class CallStats(object):
+    """
+    Per-operation call counts and latency histograms. retries counts retries
+    of throttled calls
+    """
+    def __init__(self, buckets=defaults.aws_latency_buckets):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, operation, latency, error=None, retries=0, waited=0.0):
+        with self._lock:
+            if operation not in self._ops:
+                self._ops[operation] = {'calls': 0, 'errors': 0, 'retries': 0,
+                                        'total_time': 0.0, 'rate_limit_wait': 0.0,
+                                        'latency': [0] * (len(self._buckets) + 1)}
+            op = self._ops[operation]
+            op['calls'] += 1
+            op['errors'] += 1 if error else 0
+            op['retries'] += retries
+            op['total_time'] += latency
+            op['rate_limit_wait'] += waited
+            op['latency'][self._bucket_index(latency)] += 1
+
+    def _bucket_index(self, latency):
+        for i, bound in enumerate(self._buckets):
+            if latency <= bound:
+                return i
+        return len(self._buckets)
+
+    def as_dict(self):
+        """
+        Returns dictionary of operation name to stats, where latency is a
+        dictionary of bucket upper bound (in seconds) to number of calls
+        """
+        labels = [ '<={0}'.format(b) for b in self._buckets ] + [ '>{0}'.format(self._buckets[-1]) ]
+        with self._lock:
+            ops = {}
+            for name, op in self._ops.iteritems():
+                ops[name] = dict(op)
+                ops[name]['latency'] = dict(zip(labels, op['latency']))
+            return ops
+
+    def totals(self):
+        with self._lock:
+            return dict( (k, sum(op[k] for op in self._ops.values()))
+                         for k in ('calls', 'errors', 'retries') )
+
+
+class AWSMiddleware(object):
+    """
+    Rate limiting, retrying and accounting of AWS calls. boto calls go through
+    mexe, and boto3 calls through handlers added by register
+    """
+    def __init__(self, rate=defaults.aws_requests_per_second, burst=defaults.aws_request_burst,
+                 max_retries=defaults.aws_max_retries, base_delay=defaults.aws_retry_base_delay,
+                 max_delay=defaults.aws_retry_max_delay):
+        self._logger = logging.getLogger(__name__)
+        self.bucket = TokenBucket(rate, burst)
+        self.stats = CallStats()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, retry):
+        """
+        Seconds to wait before the given retry (counting from 0), with "full jitter"
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+    def _throttled_retry(self, operation, retry):
+        """
+        Returns seconds to wait before retrying a throttled call, or None if
+        out of retries
+        """
+        if retry >= self.max_retries:
+            self._logger.warning('AWS call {0} still throttled after {1} retries'.format(operation, retry))
+            return None
+        self.bucket.acquire()
+        delay = self.backoff(retry)
+        self._logger.debug('AWS call {0} throttled, retrying in {1:.1f} seconds'.format(operation, delay))
+        tracing.count('aws_retries')
+        return delay
+
+    def mexe(self, original, conn, request, sender=None, override_num_retries=None, retry_handler=None):
+        """
+        Runs boto's AWSAuthConnection._mexe (original), through which all boto requests go
+        """
+        if isinstance(conn, boto.s3.connection.S3Connection):
+            operation = 's3:{0}'.format(request.method)
+        else:
+            operation = 'ec2:{0}'.format(request.params.get('Action', request.method))
+        retries = [0]
+
+        def handle_response(response, i, next_sleep):
+            if callable(retry_handler):
+                status = retry_handler(response, i, next_sleep)
+                if status:
+                    return status
+            if response.status in (400, 503):
+                match = _error_code_re.search(response.read() or '')
+                if match and match.group(1) in throttling_error_codes:
+                    delay = self._throttled_retry(operation, retries[0])
+                    if delay is not None:
+                        retries[0] += 1
+                        # Throttling retries do not use up boto's own retries, for transient errors
+                        return ('Throttled', i, delay)
+            return None
+
+        waited = self.bucket.acquire()
+        tracing.count('aws')
+        start = time.time()
+        error = None
+        try:
+            response = original(conn, request, sender, override_num_retries, handle_response)
+            if response.status >= 400:
+                error = response.status
+            return response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.stats.record(operation, time.time() - start, error, retries[0], waited)
+
+    def register(self, events):
+        """
+        Registers handlers with a botocore event emitter, e.g. a boto3 Session's
+        """
+        events.register('before-call', self._before_call)
+        events.register('after-call', self._after_call)
+        events.register('needs-retry', self._needs_retry)
+
+    def _before_call(self, model, context, **kwargs):
+        context['clusterous_waited'] = self.bucket.acquire()
+        context['clusterous_start'] = time.time()
+        context['clusterous_retries'] = 0
+        tracing.count('aws')
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        operation = '{0}:{1}'.format(model.service_model.endpoint_prefix, model.name)
+        error = parsed.get('Error') if http_response.status_code >= 300 else None
+        self.stats.record(operation, time.time() - context.get('clusterous_start', time.time()),
+                          error, context.get('clusterous_retries', 0), context.get('clusterous_waited', 0.0))
+
+    def _needs_retry(self, response, operation, attempts, request_dict, **kwargs):
+        if response is None:
+            return None
+        error_code = response[1].get('Error', {}).get('Code')
+        if error_code not in throttling_error_codes:
+            # Left to botocore's own retry handler
+            return None
+        context = request_dict.get('context', {})
+        retry = context.get('clusterous_retries', 0)
+        delay = self._throttled_retry('{0}:{1}'.format(operation.service_model.endpoint_prefix, operation.name), retry)
+        if delay is None:
+            return None
+        context['clusterous_retries'] = retry + 1
+        return delay
+
+
+_middleware = None
+_middleware_lock = threading.Lock()
+
+def get_middleware():
+    """
+    Returns the AWSMiddleware shared by the whole process, installing it into
+    boto if necessary
+    """
+    global _middleware
+    with _middleware_lock:
+        if _middleware is None:
+            _middleware = AWSMiddleware()
+            _install(_middleware)
+    return _middleware
+
+def _install(middleware):
+    mexe = boto.connection.AWSAuthConnection._mexe
+    def metered_mexe(conn, request, sender=None, override_num_retries=None, retry_handler=None):
+        return middleware.mexe(mexe, conn, request, sender, override_num_retries, retry_handler)
+    boto.connection.AWSAuthConnection._mexe = metered_mexe
+
+    tracing.add_metrics('aws', middleware.stats.as_dict)
+
+def session(**kwargs):
+    """
+    Returns a boto3 Session (taking the same arguments) whose calls go through the middleware
+    """
+    s = boto3.session.Session(**kwargs)
+    get_middleware().register(s.events)
+    return s
@@ -0,0 +1,177 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import tty
+import fcntl
+import select
+import struct
+import termios
+import threading
+
+import paramiko
+
+import defaults
+import tracing
+
+"""
+SSH access to the controller and nodes, which are on a private subnet, through
+the cluster's NAT instance acting as a bastion host. A single SSH connection
+to the NAT is kept per cluster, and connections to other machines are made as
+direct-tcpip channels through it (the equivalent of "ssh -J")
+"""
+
+
+class Bastion(object):
+    """
+    Persistent SSH connection to a bastion host, (re)connected when needed
+    """
+    def __init__(self, host, key_file, username=defaults.nat_username):
+        self.host = host
+        self._key_file = os.path.expanduser(key_file)
+        self._username = username
+        self._lock = threading.Lock()
+        self._client = None
+
+    def _transport(self):
+        with self._lock:
+            transport = self._client.get_transport() if self._client else None
+            if transport is None or not transport.is_active():
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                tracing.count('ssh')
+                client.connect(hostname = self.host,
+                               username = self._username,
+                               key_filename = self._key_file)
+                transport = client.get_transport()
+                transport.set_keepalive(defaults.bastion_keepalive_interval)
+                self._client = client
+            return transport
+
+    def open_channel(self, host, port):
+        """
+        Returns a channel (a socket-like object) connected to port on host, as
+        reached from the bastion
+        """
+        return self._transport().open_channel('direct-tcpip', (host, port), ('127.0.0.1', 0))
+
+    def connect(self, host, username, port=22):
+        """
+        Returns paramiko.SSHClient connected to host through the bastion
+        """
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        tracing.count('ssh')
+        client.connect(hostname = host,
+                       port = port,
+                       username = username,
+                       key_filename = self._key_file,
+                       sock = self.open_channel(host, port))
+        return client
+
+    def shell(self, host, username, command):
+        """
+        Runs command on host in a pseudo-terminal attached to this process's
+        terminal, as "ssh -t" would. Returns the command's exit status
+        """
+        client = self.connect(host, username)
+        try:
+            channel = client.get_transport().open_session()
+            width, height = _terminal_size()
+            channel.get_pty(term=os.environ.get('TERM', 'vt100'), width=width, height=height)
+            channel.exec_command(command)
+            _forward_terminal(channel)
+            return channel.recv_exit_status()
+        finally:
+            client.close()
+
+    def proxy_command(self):
+        """
+        Returns ProxyCommand option for the ssh command (and therefore Ansible) to
+        connect to other hosts through the bastion
+        """
+        return 'ssh -i {0} -o StrictHostKeyChecking=no -W %h:%p {1}@{2}'.format(
+                self._key_file, self._username, self.host)
+
+    def close(self):
+        with self._lock:
+            if self._client:
+                self._client.close()
+                self._client = None
+
+
+def _terminal_size():
+    """
+    Returns (width, height) of the terminal, or a default when not on a terminal
+    """
+    try:
+        height, width = struct.unpack('hh', fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, '1234'))
+        return width, height
+    except (IOError, struct.error):
+        return 80, 24
+
+def _forward_terminal(channel):
+    """
+    Copies input from this terminal to channel and output from channel to
+    this terminal until the remote command exits. The terminal is put in raw
+    mode meanwhile, so that keys such as Ctrl-C reach the remote shell
+    """
+    stdin = sys.stdin.fileno()
+    stdout = sys.stdout.fileno()
+    old_attrs = termios.tcgetattr(stdin) if os.isatty(stdin) else None
+    try:
+        if old_attrs is not None:
+            tty.setraw(stdin)
+        inputs = [channel, stdin]
+        while True:
+            readable = select.select(inputs, [], [])[0]
+            if channel in readable:
+                data = channel.recv(4096)
+                if not data:
+                    break
+                os.write(stdout, data)
+            if stdin in readable:
+                data = os.read(stdin, 4096)
+                if data:
+                    channel.sendall(data)
+                else:
+                    channel.shutdown_write()
+                    inputs.remove(stdin)
+    finally:
+        if old_attrs is not None:
+            termios.tcsetattr(stdin, termios.TCSADRAIN, old_attrs)
+
+
+_bastions = {}
+_bastions_lock = threading.Lock()
+
+def get_bastion(host, key_file):
+    """
+    Returns the Bastion for host, shared by everything in this process that
+    connects through it
+    """
+    key = (host, os.path.expanduser(key_file))
+    with _bastions_lock:
+        if key not in _bastions:
+            _bastions[key] = Bastion(host, key_file)
+        return _bastions[key]
+
+def close(host):
+    """
+    Closes connections to bastion host, e.g. when its cluster is destroyed
+    """
+    with _bastions_lock:
+        for key in [ k for k in _bastions if k[0] == host ]:
+            _bastions.pop(key).close()
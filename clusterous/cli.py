@@ -14,7 +14,6 @@
 
 import sys
 import os
-import defaults
 import argparse
 import logging
 import textwrap
@@ -28,6 +27,7 @@ import clusterousconfig
 import cluster
 import terminalio
 import setupwizard
+import tracing
 from clusterous import __version__, __prog_name__
 
 class CLIParser(object):
@@ -83,6 +83,10 @@ class CLIParser(object):
         parser.add_argument('--verbose', '-v', dest='verbose', action='store_true',
             default=False, help='Print verbose debug output')
         parser.add_argument('--version', action='version', version='%(prog)s {0}'.format(__version__))
+        parser.add_argument('--cluster', '-c', dest='cluster_name', action='store', default=None,
+            help='Name of the cluster to operate on, instead of the working cluster')
+        parser.add_argument('--trace', dest='trace', action='store', default=None, choices=tracing.trace_formats,
+            help='Time each phase of the command, and save the trace in the given format')
 
     def _create_subparsers(self, parser):
         subparser = parser.add_subparsers(description='The following subcommands are available', dest='subcmd')
@@ -101,6 +105,8 @@ class CLIParser(object):
         # Status
         cluster_status = subparser.add_parser('status', help='Status of the cluster',
                                                 description='Show information on the state of the cluster and any running application')
+        cluster_status.add_argument('--all', dest='all', action='store_true', default=False,
+                            help='Show status of all clusters managed from this machine')
 
         # Destroy cluster
         destroy = subparser.add_parser('destroy', help='Destroy the working cluster',
@@ -111,6 +117,8 @@ class CLIParser(object):
             default=False, help='Do not delete the shared volume')
         destroy.add_argument('--force-delete-shared-volume', dest='force_delete_shared_volume', action='store_true',
             default=False, help='Force deletion of shared volume')
+        destroy.add_argument('--snapshot-shared-volume', dest='snapshot_shared_volume', action='store_true',
+            default=False, help='Take an EBS snapshot of the shared volume, which can be used to create a new cluster')
 
         # Run
         run = subparser.add_parser('run', help='Run an environment from an environment file',
@@ -229,7 +237,7 @@ class CLIParser(object):
             sys.exit(-1)
 
         
-        app = clusterousmain.Clusterous(config, config_type)
+        app = clusterousmain.Clusterous(config, config_type, args.cluster_name)
         return app
 
     def _workon(self, args):
@@ -255,7 +263,7 @@ class CLIParser(object):
                 return 1
 
         app = self._init_clusterous_object(args)
-        app.destroy_cluster(args.leave_shared_volume, args.force_delete_shared_volume)
+        app.destroy_cluster(args.leave_shared_volume, args.force_delete_shared_volume, args.snapshot_shared_volume)
         return 0
 
     def _launch_setup(self, args):
@@ -377,11 +385,36 @@ class CLIParser(object):
 
     def _cluster_status(self, args):
         app = self._init_clusterous_object(args)
+        if args.all:
+            return self._cluster_status_all(app)
+
         success, info = app.cluster_status()
         if not success:
             print info
             return 1
 
+        self._print_cluster_status(info)
+        return 0
+
+    def _cluster_status_all(self, app):
+        statuses = app.cluster_status_all()
+        if not statuses:
+            print 'No clusters found'
+            return 1
+
+        status = 0
+        for i, (cluster_name, success, info) in enumerate(statuses):
+            if i > 0:
+                print
+            if success:
+                self._print_cluster_status(info)
+            else:
+                print >> sys.stderr, '{0}: {1}'.format(terminalio.boldify(cluster_name), info)
+                status = 1
+
+        return status
+
+    def _print_cluster_status(self, info):
         # Format cluster info
         central_logging_frag = 'nat and controller' if not info['central_logging'] else 'nat, controller and central logging'
         instance_plural = '' if info['instance_count'] == 1 else 's'
@@ -399,7 +432,7 @@ class CLIParser(object):
         print 'Uptime:\t\t{0}'.format(uptime_str)
 
         print '\n', terminalio.boldify('Controller')
-        print 'IP: {0}  Port: {1}'.format(info['nat']['ip'], defaults.nat_ssh_port_forwarding)
+        print 'IP: {0}  (SSH via NAT at {1})'.format(info['controller']['ip'], info['nat']['ip'])
 
         # Prepare node information table
         nodes_headers = map(terminalio.boldify, ['Node Name', 'Instance Type', 'Count', 'Running Components'])
@@ -411,6 +444,9 @@ class CLIParser(object):
         if info['central_logging']:
             nodes_table.append(['[logging]', info['central_logging']['type'], 1, '--'])
 
+        if info.get('storage'):
+            nodes_table.append(['[storage]', info['storage']['type'], 1, '--'])
+
         if info['nat']:
             nodes_table.append(['[nat]', info['nat']['type'], 1, '--'])
 
@@ -436,8 +472,15 @@ class CLIParser(object):
             vinfo = info['shared_volume']
             print '{0} ({1}) used of {2}'.format(vinfo['used'], vinfo['used_percent'], vinfo['total'])
             print '{0} available'.format(vinfo['free'])
-
-        return 0
+            if vinfo.get('type'):
+                config = [vinfo['type']]
+                if vinfo.get('iops'):
+                    config.append('{0} IOPS'.format(vinfo['iops']))
+                if vinfo.get('throughput'):
+                    config.append('{0} MiB/s throughput'.format(vinfo['throughput']))
+                if vinfo.get('stripes', 1) > 1:
+                    config.append('striped across {0} volumes'.format(vinfo['stripes']))
+                print ', '.join(config)
 
     def _quit(self, args):
         # If the user specifies --tunnel-only, we don't prompt for confirmation
@@ -578,6 +621,9 @@ class CLIParser(object):
 
         self._read_config()
 
+        if args.trace:
+            tracing.enable()
+
         status = 0
         try:
             if args.subcmd == 'setup':
@@ -637,9 +683,25 @@ class CLIParser(object):
             print 'Use "destroy" to clean up'
         except cluster.ConnectionException as e:
             print >> sys.stderr, e
+        finally:
+            if args.trace:
+                self._save_trace(args.trace)
 
         return status
 
+    def _save_trace(self, trace_format):
+        tracer = tracing.get_tracer()
+        if not tracer.spans:
+            return
+        # Not using tabulate, as it strips the indentation of nested phases
+        row_format = '{0:<36} {1:>8} {2:>5}  {3}'
+        print ''
+        print row_format.format('Phase', 'Time', '', 'Calls')
+        for name, duration, percentage, counts in tracer.report():
+            calls = ', '.join([ '{0} {1}'.format(v, k) for k, v in sorted(counts.items()) ])
+            print row_format.format(name, '{0:.1f}s'.format(duration), '{0:.0f}%'.format(percentage), calls)
+        print 'Trace saved to {0}'.format(tracer.save(trace_format))
+
 def main(argv=None):
     cli = CLIParser()
     return cli.main(argv)
@@ -19,12 +19,14 @@ import sys
 import os
 import yaml
 import logging
-import time
 import glob
 import shutil
 import json
+import re
 import stat
+import pipes
 import errno
+import threading
 from datetime import datetime
 from collections import namedtuple
 
@@ -34,28 +36,51 @@ import boto.vpc
 import boto.s3.connection
 import paramiko
 
+import bastion
 import defaults
+import dockerignore
+import statestore
+import taskgraph
+import tracing
+import waiter
 from defaults import get_script
 from helpers import AnsibleHelper, SSHTunnel
 from netaddr import IPNetwork
 
-# TODO: Move to another module as appropriate, as this is very general purpose
-def retry_till_true(func, sleep_interval, timeout_secs=300):
-    """
-    Call func repeatedly, with an interval of sleep_interval, for up to
-    timeout_secs seconds, until func returns true.
+_ec2_connections = {}
+_ec2_connections_lock = threading.Lock()
+
 
-    Returns true if succesful, false if timeout occurs
+class CurrentEC2Connection(boto.ec2.connection.EC2Connection):
     """
-    success = True
-    start_time = time.time()
-    while not func():
-        if time.time() >= start_time + timeout_secs:
-            success = False
-            break
-        time.sleep(sleep_interval)
+    EC2 connection making requests with the current version of the EC2 API, rather
+    than the older one boto was written for, so that parameters added since (e.g.
+    the gp3 volume type and throughput) are accepted
+    """
+    APIVersion = '2016-11-15'
+
 
-    return success
+def get_ec2_connection(region, access_key_id, secret_access_key, current_api=False):
+    """
+    Returns an EC2 connection for region, shared by all Cluster objects in this
+    process so that concurrent operations on several clusters reuse pooled HTTP
+    connections. If current_api is True, a CurrentEC2Connection. Returns None if
+    the connection cannot be made
+    """
+    key = (region, access_key_id, current_api)
+    with _ec2_connections_lock:
+        if key not in _ec2_connections:
+            if current_api:
+                region_info = boto.ec2.get_region(region)
+                conn = CurrentEC2Connection(region=region_info, aws_access_key_id=access_key_id,
+                                            aws_secret_access_key=secret_access_key) if region_info else None
+            else:
+                conn = boto.ec2.connect_to_region(region, aws_access_key_id=access_key_id,
+                                                  aws_secret_access_key=secret_access_key)
+            if not conn:
+                return None
+            _ec2_connections[key] = conn
+        return _ec2_connections[key]
 
 def read_config(config):
     """
@@ -129,8 +154,7 @@ class Cluster(object):
         self._running = False
         self._logger = logging.getLogger(__name__)
         self._nat_ip = ''
-        cluster_info = self._get_cluster_info()
-        cluster_running = cluster_info.get('running', False)
+        self._endpoints = None
         if cluster_name_required and not cluster_name:
             name = self._get_working_cluster_name()
             if not name:
@@ -139,9 +163,12 @@ class Cluster(object):
         elif cluster_name:
             self.cluster_name = cluster_name
 
+        cluster_info = self._get_cluster_info()
+        cluster_running = cluster_info.get('running', False)
         if cluster_must_be_running and not cluster_running:
             # Error
-            raise ClusterException('Cluster "{0}" is not in fully running state'.format(self._get_working_cluster_name()))
+            raise ClusterException('Cluster "{0}" is not in fully running state'.format(
+                                   getattr(self, 'cluster_name', None) or self._get_working_cluster_name()))
 
 
     def _load_machine_images(self):
@@ -149,23 +176,36 @@ class Cluster(object):
         return yaml.load(f)
 
     def _get_cluster_info(self):
-        cluster_info_file = os.path.expanduser(defaults.cluster_info_file)
-        if not os.path.isfile(cluster_info_file):
+        """
+        Returns info about this cluster (or the working cluster if no cluster name
+        has been set) from the local state store
+        """
+        store = statestore.get_store()
+        cluster_name = getattr(self, 'cluster_name', None) or store.get_working_cluster()
+        if not cluster_name:
             return {}
-
-        f = open(os.path.expanduser(cluster_info_file), 'r')
-        cluster_info = yaml.load(f)
-        return cluster_info
+        return store.get_cluster_info(cluster_name)
 
     @staticmethod
     def validate_config(fields):
         pass
 
     def _get_working_cluster_name(self):
-        cluster_info = self._get_cluster_info()
-        if not cluster_info:
-            return None
-        return cluster_info.get('cluster_name')
+        return statestore.get_store().get_working_cluster()
+
+    def _local_path(self, *names):
+        """
+        Returns the full path of names within this cluster's local dir
+        """
+        cluster_dir = os.path.expanduser(defaults.local_cluster_dir_format.format(self.cluster_name))
+        return os.path.join(cluster_dir, *names)
+
+    def _cached_environment_files(self):
+        """
+        Returns local paths of the cached cluster spec and environment files
+        """
+        return [self._local_path(defaults.local_environment_dir, defaults.cached_cluster_file),
+                self._local_path(defaults.local_environment_dir, defaults.cached_environment_file)]
 
     def _get_logging_vars(self):
         info = self._get_cluster_info()
@@ -176,6 +216,26 @@ class Cluster(object):
 
         return logging_vars
 
+    def _get_nfs_vars(self, node_count):
+        """
+        Returns variables for the node playbooks: the NFS server of the shared
+        volume (the controller or the storage node), how nodes mount it under the
+        cluster's NFS profile, and the number of nfsd threads on the server for
+        node_count nodes (0 to leave the default)
+        """
+        info = self._get_cluster_info()
+        storage_ip = self._get_endpoints()['storage']
+        profile_name = info.get('shared_volume_nfs_profile', defaults.default_nfs_profile)
+        profile = defaults.nfs_profiles[profile_name]
+        nfsd_threads = 0
+        if profile['nfsd_threads_per_node']:
+            nfsd_threads = min(max(node_count * profile['nfsd_threads_per_node'], defaults.nfsd_min_threads),
+                               defaults.nfsd_max_threads)
+        return {'nfs_server': storage_ip or 'controller',
+                'nfs_mount_options': profile['mount_options'],
+                'nfs_nconnect': profile['nconnect'],
+                'nfsd_threads': nfsd_threads}
+
 
     def _get_nat_ip(self):
         if self._nat_ip:
@@ -211,7 +271,7 @@ class AWSCluster(Cluster):
     def validate_config(fields):
         mandatory_fields = ['access_key_id', 'secret_access_key', 'key_pair', 'key_file',
                             'clusterous_s3_bucket', 'region']
-        optional_fields = ['vpc_id']
+        optional_fields = ['vpc_id', 'registry_concurrency']
 
         # Check for unrecognised fields
         unrecog_fields = []
@@ -244,6 +304,10 @@ class AWSCluster(Cluster):
             message = 'Key file {0} must have permissions of 600 (not readable by others)'.format(fields['key_file'])
             return False, message
 
+        if 'registry_concurrency' in fields and not (isinstance(fields['registry_concurrency'], int) and
+                                                     fields['registry_concurrency'] > 0):
+            return False, '"registry_concurrency" must be a positive number'
+
         return True, ''
 
 
@@ -253,6 +317,11 @@ class AWSCluster(Cluster):
                 'AWS_SECRET': self._config['secret_access_key'],
                 'clusterous_s3_bucket': self._config['clusterous_s3_bucket'],
                 'registry_s3_path': defaults.registry_s3_path,
+                'registry_region': self._config['region'],
+                'registry_storage_port': defaults.registry_storage_port,
+                'registry_cache_dir': defaults.registry_cache_dir,
+                'registry_cache_size': defaults.registry_cache_size,
+                'registry_concurrency': self._config.get('registry_concurrency') or defaults.registry_concurrency,
                 'remote_scripts_dir': defaults.get_remote_dir(),
                 'remote_host_scripts_dir': defaults.remote_host_scripts_dir,
                 }
@@ -292,16 +361,15 @@ class AWSCluster(Cluster):
 
         AnsibleHelper.run_playbook(get_script('ansible/run_remote.yml'),
                       local_vars_file.name, self._config['key_file'],
-                      hosts_file=os.path.expanduser(defaults.current_nat_ip_file))
+                      hosts_file=self._controller_inventory())
 
         local_vars_file.close()
         remote_vars_file.close()
 
     def _get_instances(self, cluster_name, connection=None):
         if not connection:
-            conn = boto.ec2.connect_to_region(self._config['region'],
-                        aws_access_key_id=self._config['access_key_id'],
-                        aws_secret_access_key=self._config['secret_access_key'])
+            conn = get_ec2_connection(self._config['region'], self._config['access_key_id'],
+                                      self._config['secret_access_key'])
             if not conn:
                 raise ClusterException('Cannot connect to AWS')
         else:
@@ -315,6 +383,21 @@ class AWSCluster(Cluster):
         instance_list = conn.get_only_instances(filters=instance_filters)
         return instance_list
 
+    def _record_node_inventory(self, connection=None):
+        """
+        Saves the instances of this cluster as its node inventory in the local state
+        store, after its nodes have changed. Returns the inventory
+        """
+        nodes = [ {'instance_id': i.id,
+                   'node_name': i.tags.get(defaults.instance_node_type_tag_key, ''),
+                   'instance_type': i.instance_type,
+                   'private_ip': i.private_ip_address,
+                   'state': i.state,
+                   'warm_pool': defaults.warm_pool_tag_key in i.tags}
+                  for i in self._get_instances(self.cluster_name, connection) ]
+        statestore.get_store().set_nodes(self.cluster_name, nodes)
+        return nodes
+
     def _get_node_instances(self, conn, node_name):
         """
         Get only instances matching given node name (e.g. "worker")
@@ -339,16 +422,81 @@ class AWSCluster(Cluster):
             return True
         return False
 
+    def _bastion(self):
+        """
+        Returns the Bastion (the NAT instance) through which the controller and nodes are reached
+        """
+        return bastion.get_bastion(self._get_nat_ip(), self._config['key_file'])
+
+    def _get_endpoints(self, refresh=False):
+        """
+        Returns dictionary of the IPs at which the cluster's roles are reached:
+        'nat' (public), 'controller', 'registry' (on the controller),
+        'central_logging' and 'storage' (private, None if there is no logging
+        system or storage node).
+
+        The endpoints are kept in the local cluster info, and only looked up on
+        AWS, with a single describe call, if they are not known or refresh is
+        True (i.e. when the cluster's topology may have changed)
+        """
+        if self._endpoints and not refresh:
+            return self._endpoints
+
+        info = self._get_cluster_info()
+        if refresh or not all( k in info for k in ('nat_ip', 'controller_ip', 'central_logging_ip', 'storage_ip') ):
+            info = {'nat_ip': None, 'controller_ip': None, 'central_logging_ip': '', 'storage_ip': ''}
+            for instance in self._get_instances(self.cluster_name):
+                node_type = instance.tags.get(defaults.instance_node_type_tag_key)
+                if node_type == defaults.nat_name_tag_value:
+                    info['nat_ip'] = instance.ip_address
+                elif node_type == defaults.controller_name_tag_value:
+                    info['controller_ip'] = instance.private_ip_address
+                elif node_type == defaults.central_logging_name_tag_value:
+                    info['central_logging_ip'] = instance.private_ip_address
+                elif node_type == defaults.storage_name_tag_value:
+                    info['storage_ip'] = instance.private_ip_address
+            if info['nat_ip'] and info['controller_ip']:
+                self._set_cluster_info(info)
+
+        self._endpoints = {'nat': info['nat_ip'],
+                           'controller': info['controller_ip'],
+                           'registry': info['controller_ip'],
+                           'central_logging': info['central_logging_ip'] or None,
+                           'storage': info['storage_ip'] or None}
+        return self._endpoints
+
+    def _get_controller_ip(self):
+        """
+        Returns private IP of the controller, looking it up if it isn't known locally
+        """
+        return self._get_cluster_info().get('controller_ip') or self._get_endpoints()['controller']
+
+    def _write_controller_inventory(self, nat_ip, controller_ip):
+        """
+        Writes Ansible inventory of the controller, which Ansible reaches through the NAT
+        """
+        proxy = bastion.get_bastion(nat_ip, self._config['key_file']).proxy_command()
+        self._write_to_hosts_file(self._local_path(defaults.current_nat_ip_file), [controller_ip],
+                                  'controller', overwrite=True,
+                                  host_vars='ansible_ssh_common_args=\'-o ProxyCommand="{0}"\''.format(proxy))
+
+    def _controller_inventory(self):
+        """
+        Returns path of the Ansible inventory of the controller, writing it first if
+        missing, e.g. if the cluster was last used by a version keeping it elsewhere
+        """
+        inventory = self._local_path(defaults.current_nat_ip_file)
+        if not os.path.isfile(inventory):
+            endpoints = self._get_endpoints()
+            if endpoints['nat'] and endpoints['controller']:
+                self._create_config_dirs()
+                self._write_controller_inventory(endpoints['nat'], endpoints['controller'])
+        return inventory
+
     def _ssh_to_controller(self):
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            ssh.connect(hostname = self._get_nat_ip(),
-                        port = defaults.nat_ssh_port_forwarding,
-                        username = defaults.cluster_username,
-                        key_filename = os.path.expanduser(self._config['key_file']))
-        except (paramiko.ssh_exception.AuthenticationException,
+            ssh = self._bastion().connect(self._get_controller_ip(), defaults.cluster_username)
+        except (paramiko.ssh_exception.SSHException,
                 socket.error) as e:
             if self._cluster_is_up():
                 raise ClusterException('The cluster is running, but could not connect to controller: {0}'.format(e))
@@ -358,42 +506,29 @@ class AWSCluster(Cluster):
 
         return ssh
 
-    def _get_ssh(self, ip, username, key_filename, retries=20, delay=5):
+    def get_central_logging_ip(self):
+        return self._get_endpoints()['central_logging']
+
+    def get_node_counts(self, refresh=False):
         """
-        Given ip, username and key file, try to establish an SSH connection and
-        return SSH object if successful. Returns None if unable to connect.
-        retries is max number of retries before failing and
-        delay is number of seconds between retries
+        Returns dictionary of node name to number of running nodes, not counting
+        the NAT, controller, logging instance, storage node or warm pool. Counts
+        are taken from the node inventory in the local state store, unless refresh
+        is True (or there is no inventory), in which case it is updated from AWS first
         """
-        retry = 0
-        success = False
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        while not success and retry < retries:
-            try:
-                ssh.connect(hostname = ip,
-                            username = username,
-                            key_filename = os.path.expanduser(key_filename))
-                success = True
-            except paramiko.ssh_exception.NoValidConnectionsError as e:
-                self._logger.debug('Unable to establish ssh connection, trying again')
-                retry += 1
-                time.sleep(delay)
-
-        if not success:
-            return None
-
-        return ssh
-
-
-    def get_central_logging_ip(self):
-        instances = self._get_instances(self.cluster_name)
-        ip = None
-        for instance in instances:
-            if defaults.central_logging_name_format.format(self.cluster_name) in instance.tags['Name']:
-                ip = str(instance.private_ip_address)
-                break
-        return ip
+        nodes = None if refresh else statestore.get_store().get_nodes(self.cluster_name)
+        if not nodes:
+            nodes = self._record_node_inventory()
+
+        counts = {}
+        for node in nodes:
+            node_name = node['node_name']
+            if (node['state'] != 'running' or node['warm_pool'] or
+                node_name in (defaults.nat_name_tag_value, defaults.controller_name_tag_value,
+                              defaults.central_logging_name_tag_value, defaults.storage_name_tag_value)):
+                continue
+            counts[node_name] = counts.get(node_name, 0) + 1
+        return counts
 
     def store_file_on_controller(self, remote_file_path, source_file):
         ssh = self._ssh_to_controller()
@@ -408,9 +543,11 @@ class AWSCluster(Cluster):
         Returns helpers.SSHTunnel object connected to remote_port on controller
         """
         try:
-            tunnel = SSHTunnel(self._get_nat_ip(), defaults.cluster_username,
-                    os.path.expanduser(self._config['key_file']), remote_port)
-        except SSHTunnel.TunnelException as e:
+            controller_ip = self._get_controller_ip()
+            tunnel = SSHTunnel(controller_ip, defaults.cluster_username,
+                    os.path.expanduser(self._config['key_file']), remote_port,
+                    proxy=self._bastion().open_channel(controller_ip, 22))
+        except (SSHTunnel.TunnelException, paramiko.ssh_exception.SSHException, socket.error) as e:
             if self._cluster_is_up():
                 raise ConnectionException('Error connecting to cluster: {0}'.format(e))
             else:
@@ -458,28 +595,36 @@ class AWSCluster(Cluster):
         # Useful to isolate user created sockets from our own
         prefix_str = 'clusterous' if not prefix else prefix
 
-        # Temporary file containing ssh socket data
-        ssh_sock_file = '{0}/{1}_tunnel_%h_{2}.sock'.format(
+        # Temporary file containing ssh socket data. Named after the NAT, as
+        # controllers of different clusters may have the same private IP
+        ssh_sock_file = '{0}/{1}_tunnel_{2}_{3}.sock'.format(
                         os.path.expanduser(defaults.local_session_data_dir),
-                        prefix_str, local_port)
+                        prefix_str, self._get_nat_ip(), local_port)
+        controller_ip = self._get_controller_ip()
 
         # Ensure that any previously created tunnel is destroyed
         reset_cmd = ['ssh', '-S', ssh_sock_file, '-O', 'exit',
-                self._get_nat_ip()]
+                controller_ip]
 
-        # Normal tunnel command
-        connect_cmd = ['ssh', '-p', '{0}'.format(defaults.nat_ssh_port_forwarding), '-i', key_file, '-N', '-f', '-M',
+        # Normal tunnel command, through the NAT
+        connect_cmd = ['ssh', '-i', key_file, '-N', '-f', '-M',
                 '-S', ssh_sock_file, '-o', 'ExitOnForwardFailure=yes',
-                '{0}@{1}'.format(defaults.cluster_username, self._get_nat_ip()),
+                '-o', 'ProxyCommand={0}'.format(self._bastion().proxy_command()),
+                '{0}@{1}'.format(defaults.cluster_username, controller_ip),
                 '-L', '{0}:127.0.0.1:{1}'.format(local_port, remote_port)]
 
         # If socket file doesn't exist, it will return with an error. This is normal
         process = subprocess.Popen(reset_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=None)
         output, error = process.communicate()
 
+        tracing.count('ssh')
         return_code = subprocess.call(connect_cmd)
 
-        return True if return_code == 0 else False
+        if return_code != 0:
+            return False
+
+        statestore.get_store().add_tunnel(self.cluster_name, local_port, remote_port, ssh_sock_file)
+        return True
 
     def delete_all_permanent_tunnels(self, delete_logging_tunnel=False):
         """
@@ -487,16 +632,27 @@ class AWSCluster(Cluster):
         create_permanent_tunnel_to_controller()
         """
         key_file = os.path.expanduser(self._config['key_file'])
+        store = statestore.get_store()
 
-        sock_files = glob.glob('{0}/clusterous_tunnel_*.sock'.format(
-                        os.path.expanduser(defaults.local_session_data_dir)))
+        # Tunnels are recorded in the state store. Those opened by older versions are
+        # found by socket file name, which includes the NAT IP of the cluster. Tunnels
+        # with other prefixes (e.g. "marathon") are left open
+        tunnels = dict( (t['sock_file'], t['local_port']) for t in store.get_tunnels(self.cluster_name)
+                        if os.path.basename(t['sock_file']).startswith('clusterous_tunnel_') )
+        for sock in glob.glob('{0}/clusterous_tunnel_{1}_*.sock'.format(
+                              os.path.expanduser(defaults.local_session_data_dir), self._get_nat_ip())):
+            tunnels.setdefault(sock, os.path.basename(sock).rsplit('_', 1)[-1].split('.')[0])
 
         all_deleted = True
-        for sock in sock_files:
+        for sock, local_port in sorted(tunnels.items()):
             # Leave central logging tunnel
-            if '_{0}.sock'.format(defaults.central_logging_port) in sock:
-                if not delete_logging_tunnel:
-                    continue
+            if int(local_port) == defaults.central_logging_port and not delete_logging_tunnel:
+                continue
+
+            if not os.path.exists(sock):
+                # Tunnel has already gone
+                store.delete_tunnel(self.cluster_name, local_port)
+                continue
 
             reset_cmd = ['ssh', '-S', sock, '-O', 'exit',
                             self._get_nat_ip()]
@@ -506,10 +662,18 @@ class AWSCluster(Cluster):
             if process.returncode != 0:
                 self._logger.warning('Problem deleting SSH tunnel at {0}'.format(sock))
                 all_deleted = False
+            else:
+                store.delete_tunnel(self.cluster_name, local_port)
 
         return all_deleted
 
-    def _wait_and_tag_instance_reservations(self, tag_and_inst_list, sleep_interval=3):
+    def _wait_and_tag_instance_reservations(self, tag_and_inst_list, timeout=defaults.instance_start_timeout,
+                                            starting=False):
+        """
+        Waits for instances to run and tags them. If starting is True, the instances
+        were stopped and have just been started, so may still be reported as
+        stopped or stopping for a while
+        """
         launched = {}
         launched_ids = {}
         inst_list = []
@@ -520,8 +684,8 @@ class AWSCluster(Cluster):
             for i in insts:
                 inst_to_tag[i.id] = (label, tag)
 
-        while len(launched_ids) < len(inst_list):
-            time.sleep(sleep_interval)
+        def all_running():
+            pending = []
             for inst in inst_list:
                 if inst.state == 'running' and inst.id not in launched_ids:
                     if inst.private_ip_address:
@@ -534,31 +698,67 @@ class AWSCluster(Cluster):
                             launched[label] = LaunchInfo([])
                         launched[label].private_ips.append(inst.private_ip_address)
                         self._logger.debug('Running {0} {1} {2}'.format(inst.private_ip_address, tags, inst.id))
+                    else:
+                        pending.append(inst)
                 # There is no good reason for this to happen in practice
-                elif inst.state in ('terminated', 'stopped', 'stopping'):
+                elif inst.state == 'terminated' or (inst.state in ('stopped', 'stopping') and not starting):
                     raise ClusterException('Problem with instance {0}, now in "{1}" state'.format(inst.id, inst.state))
-                else:
-                    # Refresh instance data
-                    inst.update()
+                elif inst.id not in launched_ids:
+                    pending.append(inst)
+
+            if not pending:
+                return True
+
+            # Refresh data of all pending instances in a single call
+            try:
+                fresh = pending[0].connection.get_only_instances(instance_ids=[ i.id for i in pending ])
+            except boto.exception.EC2ResponseError as e:
+                # Newly launched instances may not be visible to the API yet
+                if e.error_code != 'InvalidInstanceID.NotFound':
+                    raise
+                return False
+            fresh = dict( (i.id, i) for i in fresh )
+            for inst in pending:
+                if inst.id in fresh:
+                    inst._update(fresh[inst.id])
+            return False
+
+        if inst_list and not waiter.wait_until('instances-running', all_running, timeout, initial=5):
+            raise ClusterException('Timed out waiting for instances to start')
 
         return launched
 
-    def _write_to_hosts_file(self, filename, ips, group_name='', overwrite=False):
+    def _write_to_hosts_file(self, filename, ips, group_name='', overwrite=False, host_vars='', ip_vars={}):
         """
         Given a destination absolute filename, a list of IPs, and a group name,
-        create an Ansible inventory file, returning True on success
+        create an Ansible inventory file, returning True on success.
+        host_vars is an optional string of variables added to each host, and
+        ip_vars an optional dictionary of IP to variables added to that host only
         """
         mode = 'w' if overwrite else 'a'
         with open(filename, mode) as f:
             if group_name:
                 f.write('[{0}]\n'.format(group_name.strip()))
             for ip in ips:
-                f.write('{0}\n'.format(ip.strip()))
+                line_vars = ' '.join([host_vars, ip_vars.get(ip, '')]).strip()
+                if line_vars:
+                    f.write('{0} {1}\n'.format(ip.strip(), line_vars))
+                else:
+                    f.write('{0}\n'.format(ip.strip()))
         return True
 
+    def _write_storage_inventory(self, filename):
+        """
+        Appends the storage node, if there is one, to Ansible inventory filename
+        in group "storage", so that node playbooks can tune its NFS server
+        """
+        storage_ip = self._get_endpoints()['storage']
+        if storage_ip:
+            self._write_to_hosts_file(filename, [storage_ip], 'storage', overwrite=False)
+
     def _create_config_dirs(self):
-        for directory in [defaults.local_config_dir, defaults.local_session_data_dir, defaults.local_environment_dir]:
-            d = os.path.expanduser(directory)
+        for d in [os.path.expanduser(defaults.local_config_dir), os.path.expanduser(defaults.local_session_data_dir),
+                  self._local_path(defaults.local_environment_dir)]:
             if not os.path.exists(d):
                 os.makedirs(d)
         return
@@ -570,8 +770,7 @@ class AWSCluster(Cluster):
         ssh = self._ssh_to_controller()
         sftp = ssh.open_sftp()
 
-        for f in [defaults.cached_cluster_file_path, defaults.cached_environment_file_path]:
-            full_path = os.path.expanduser(f)
+        for full_path in self._cached_environment_files():
             if os.path.exists(full_path):
                 try:
                     sftp.mkdir(defaults.remote_environment_dir)
@@ -589,8 +788,7 @@ class AWSCluster(Cluster):
         """
         ssh = self._ssh_to_controller()
         sftp = ssh.open_sftp()
-        for f in [defaults.cached_cluster_file_path, defaults.cached_environment_file_path]:
-            local_path = os.path.expanduser(f)
+        for local_path in self._cached_environment_files():
             try:
                 remote_path = defaults.remote_environment_dir + '/' + os.path.basename(local_path)
                 sftp.get(remote_path, local_path)
@@ -603,53 +801,15 @@ class AWSCluster(Cluster):
     def get_cluster_spec(self):
         # Sync from controller
         self._copy_environment_from_controller()
-        local_cluster_spec = os.path.expanduser(defaults.cached_cluster_file_path)
+        local_cluster_spec = self._cached_environment_files()[0]
         node_types = []
         stream = open(local_cluster_spec, 'r')
         spec = yaml.load(stream)
 
+        self._set_cluster_info({'cluster_spec': spec})
         return spec
 
 
-    def _set_nat_ssh_port_forwarding(self, nat_public_ip, controller_private_ip):
-        self._logger.debug('Forwarding port {0} on NAT ({1}) to Controller ({2}) port 22'.format(
-            defaults.nat_ssh_port_forwarding, nat_public_ip, controller_private_ip))
-
-        ssh = self._get_ssh(nat_public_ip, 'ec2-user', self._config['key_file'])
-        if not ssh:
-            self._logger.debug('NAT SSH connection timed out, unable to setup port forwarding')
-            raise ClusterException('Unable to establish SSH connection to NAT instance')
-
-
-        retry = 0
-        while True:
-            cmd = 'sudo iptables -t nat -A PREROUTING -p tcp --dport {0} -j DNAT --to-destination {1}:22'.format(
-                 defaults.nat_ssh_port_forwarding, controller_private_ip)
-            stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=True)
-            output = '\n'.join(stdout.readlines())
-            errors = '\n'.join(stderr.readlines())
-            if errors:
-                self._logger.error('NAT port forwarding error: {0}'.format(errors))
-                self._logger.error('NAT port forwarding ouput text: {0}'.format(output))
-                raise ClusterException('Error setting up port forwarding on NAT')
-    
-            # Checking if iptables rule was applied
-            cmd = 'sudo iptables --table nat --list | grep "^DNAT.*to:{0}:22"'.format(controller_private_ip)
-            stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=True)
-            output = '\n'.join(stdout.readlines())
-            if output:
-                break
-
-            retry += 1
-            if retry > 3:
-                raise ClusterException('Error setting up port forwarding on NAT')
-
-            time.sleep(5)
-
-        ssh.close()
-
-        return True
-
     def _clusterous_tag(self, resource_name = None):
         clusterous_tag = {defaults.instance_tag_key: self.cluster_name}
         if resource_name is not None:
@@ -731,7 +891,6 @@ class AWSCluster(Cluster):
             security_group = vpc_conn.create_security_group(self.cluster_name+"-{0}".format(sg_name), 'Public security group for ' + self.cluster_name, vpc.id)
             security_group.add_tags(self._clusterous_tag(sg_name))
             security_group.authorize(ip_protocol='tcp', from_port=22, to_port=22, cidr_ip='0.0.0.0/0')
-            security_group.authorize(ip_protocol='tcp', from_port=defaults.nat_ssh_port_forwarding, to_port=defaults.nat_ssh_port_forwarding, cidr_ip='0.0.0.0/0')
             security_group.authorize(ip_protocol='-1', from_port=0, to_port=65535, src_group=private_security_group)
         
         return security_group
@@ -795,13 +954,47 @@ class AWSCluster(Cluster):
     
         return route_table
 
+    def _create_volume(self, conn, size, zone, volume_type, iops=None, throughput=None, snapshot_id=None):
+        """
+        Creates an EBS volume, returns boto Volume object. Like conn.create_volume(),
+        but can also create gp3 volumes and set their throughput, which boto's version
+        of the EC2 API doesn't have. If created from snapshot_id, size may be None for
+        the size of the snapshot
+        """
+        conn = get_ec2_connection(conn.region.name, self._config['access_key_id'],
+                                  self._config['secret_access_key'], current_api=True)
+        params = {'AvailabilityZone': zone, 'VolumeType': volume_type}
+        if size:
+            params['Size'] = size
+        if snapshot_id:
+            params['SnapshotId'] = snapshot_id
+        if iops:
+            params['Iops'] = str(iops)
+        if throughput:
+            params['Throughput'] = str(throughput)
+        return conn.get_object('CreateVolume', params, boto.ec2.volume.Volume, verb='POST')
+
     def init_cluster(self, cluster_name, cluster_spec, nodes_info=[], logging_level=0,
-                     shared_volume_size=None, controller_instance_type=None, shared_volume_id=None):
+                     shared_volume_size=None, controller_instance_type=None, shared_volume_id=None,
+                     shared_volume_options=None):
         """
-        Initialise security group(s), cluster controller etc
+        Initialise security group(s), cluster controller etc. shared_volume_options
+        is a dictionary that may have the volume 'type', provisioned 'iops' and
+        'throughput' (in MiB/s) of the shared volume, the number of EBS volumes
+        ('stripes') it is striped across, the 'nfs_profile' it is shared with, the
+        'snapshot_id' to create it from and whether to 'prewarm' it (read every
+        block, so that data restored from a snapshot is loaded before it is used)
         """
         self.cluster_name = cluster_name
         self._shared_volume_size = defaults.shared_volume_size if not shared_volume_size else shared_volume_size
+        shared_volume_options = shared_volume_options or {}
+        volume_type = shared_volume_options.get('type') or defaults.shared_volume_type
+        volume_stripes = shared_volume_options.get('stripes') or 1
+        volume_devices = [ '/dev/xvd' + l for l in defaults.shared_volume_device_letters[:volume_stripes] ]
+        nfs_profile = shared_volume_options.get('nfs_profile') or defaults.default_nfs_profile
+        snapshot_id = shared_volume_options.get('snapshot_id')
+        storage_types = [ s['type'] for s in cluster_spec.values() if s.get('role') == defaults.storage_role ]
+        storage_instance_type = storage_types[0] if storage_types else None
         self._controller_instance_type = defaults.controller_instance_type if not controller_instance_type else controller_instance_type
 
         c = self._config
@@ -819,7 +1012,7 @@ class AWSCluster(Cluster):
         self._create_config_dirs()
 
         # Write cluster spec to local dir
-        cluster_spec_file_name = os.path.expanduser(defaults.cached_cluster_file_path)
+        cluster_spec_file_name = self._cached_environment_files()[0]
         with open(cluster_spec_file_name, 'w') as f:
             f.write(yaml.dump(cluster_spec))
 
@@ -835,124 +1028,156 @@ class AWSCluster(Cluster):
                 raise ClusterException('Cannot connect to AWS')
     
             # Check if cluster by this name is already running
-            if self._get_instances(cluster_name, connection=conn):
-                self._logger.error('A cluster by the name "{0}" is already running, cannot start'.format(cluster_name))
-                raise ClusterException('Another cluster by the same name is running')
+            with tracing.span('check-existing'):
+                if self._get_instances(cluster_name, connection=conn):
+                    self._logger.error('A cluster by the name "{0}" is already running, cannot start'.format(cluster_name))
+                    raise ClusterException('Another cluster by the same name is running')
     
             # Create registry bucket if it doesn't already exist
-            s3conn = boto.s3.connection.S3Connection(c['access_key_id'], c['secret_access_key'])
-            if not s3conn.lookup(c['clusterous_s3_bucket']):
-                try:
-                    self._logger.info('Creating S3 bucket')
-                    s3conn.create_bucket(c['clusterous_s3_bucket'], location=c['region'])
-                except boto.exception.S3CreateError as e:
-                    self._logger.error('Unable to create S3 bucket due to an AWS conflict. Try again later.')
-                    self._logger.error(e)
-                    raise ClusterException('Unrecoverable error while trying to start cluster')
+            with tracing.span('s3-bucket'):
+                s3conn = boto.s3.connection.S3Connection(c['access_key_id'], c['secret_access_key'])
+                if not s3conn.lookup(c['clusterous_s3_bucket']):
+                    try:
+                        self._logger.info('Creating S3 bucket')
+                        s3conn.create_bucket(c['clusterous_s3_bucket'], location=c['region'])
+                    except boto.exception.S3CreateError as e:
+                        self._logger.error('Unable to create S3 bucket due to an AWS conflict. Try again later.')
+                        self._logger.error(e)
+                        raise ClusterException('Unrecoverable error while trying to start cluster')
     
-            # Cluster info file: Having created the first cluster resource, set cluster name and flag
-            self._set_cluster_info({'cluster_name': cluster_name, 'running': False})
+            # Cluster info: Having created the first cluster resource, set cluster name and flag
+            self._set_cluster_info({'cluster_name': cluster_name, 'running': False, 'cluster_spec': cluster_spec,
+                                    'shared_volume_nfs_profile': nfs_profile})
+            statestore.get_store().set_working_cluster(cluster_name)
     
             # Configuring VPC
-            self._logger.info('Configuring VPC')
-            vpc = self._get_vpc(vpc_conn)
-            gateway = self._create_gateway(vpc_conn, vpc, 'gateway')
-            public_subnet = self._create_subnet(vpc_conn, vpc, 'public-subnet')
-            private_subnet = self._create_subnet(vpc_conn, vpc, 'private-subnet')
-            public_route_table = self._create_route_table(vpc_conn, vpc, 'public-route-table')
-            private_route_table = self._create_route_table(vpc_conn, vpc, 'private-route-table')
-            private_security_group = self._create_private_sg(vpc_conn, vpc, "private-sg")
-            public_security_group = self._create_public_sg(vpc_conn, vpc, "public-sg")
-    
-            # Shared volume
-            if shared_volume_id:
-                try:
-                    shared_volume = conn.get_all_volumes([shared_volume_id])[0]
-                    if shared_volume.status != 'available':
-                        raise ClusterException('Volume "{0}" is not available'.format(shared_volume_id))
-                    vpc_conn = boto.vpc.connect_to_region(c['region'], aws_access_key_id=c['access_key_id'],aws_secret_access_key=c['secret_access_key'])
-                    if private_subnet.availability_zone != shared_volume.zone:
-                        raise ClusterException('Conflict in availability zone. Subnet "{0}" in "{1}" and Volume "{2}" in "{3}"'.format(private_subnet.id,
-                                                private_subnet.availability_zone, shared_volume_id, shared_volume.zone))
-                except boto.exception.EC2ResponseError as e:
-                    raise ClusterException('Volume "{0}" does not exist'.format(shared_volume_id))
-    
-            # Connect public subnet to the gateway
-            vpc_conn.create_route(public_route_table.id, destination_cidr_block="0.0.0.0/0", gateway_id=gateway.id)
-            vpc_conn.associate_route_table(public_route_table.id, public_subnet.id)
-    
-            # Launch NAT instance
-            self._logger.info('Starting NAT')
-            nat_interface = boto.ec2.networkinterface.NetworkInterfaceSpecification(subnet_id=public_subnet.id,
-                                                                                    groups=[public_security_group.id, ],
-                                                                                    associate_public_ip_address=True)
-            nat_network_interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(nat_interface)
-            nat_res = conn.run_instances(ami_ids['nat'], 
-                                         min_count=1,
-                                         key_name=c['key_pair'], 
-                                         instance_type=defaults.nat_instance_type,
-                                         network_interfaces=nat_network_interfaces)
-            nat_instance = nat_res.instances[0]
-    
-            nat_tags = {'Name': defaults.nat_name_format.format(cluster_name),
-                                defaults.instance_node_type_tag_key: defaults.nat_name_tag_value}
-            nat_tags_and_res = [('nat', nat_tags, nat_res.instances)]
-    
-            
-            # Wait for NAT to launch
-            nat_not_used = self._wait_and_tag_instance_reservations(nat_tags_and_res)
-            nat_instance.modify_attribute('sourceDestCheck',False)  # Disable sourceDestCheck on NAT instance
-            
-            # Connect private subnet to the nat instance
-            vpc_conn.create_route(private_route_table.id, destination_cidr_block="0.0.0.0/0", instance_id=nat_instance.id)
-            vpc_conn.associate_route_table(private_route_table.id, private_subnet.id)
-    
-            # Launch controller
-            self._logger.info('Starting controller')
-            block_devices = boto.ec2.blockdevicemapping.BlockDeviceMapping(conn)
-            root_vol = boto.ec2.blockdevicemapping.BlockDeviceType(connection=conn, delete_on_termination=True, volume_type='gp2')
-            root_vol.size = defaults.controller_root_volume_size
-    
-            block_devices['/dev/sda1'] = root_vol
+            with tracing.span('vpc'):
+                self._logger.info('Configuring VPC')
+                vpc = self._get_vpc(vpc_conn)
+                gateway = self._create_gateway(vpc_conn, vpc, 'gateway')
+                public_subnet = self._create_subnet(vpc_conn, vpc, 'public-subnet')
+                private_subnet = self._create_subnet(vpc_conn, vpc, 'private-subnet')
+                public_route_table = self._create_route_table(vpc_conn, vpc, 'public-route-table')
+                private_route_table = self._create_route_table(vpc_conn, vpc, 'private-route-table')
+                private_security_group = self._create_private_sg(vpc_conn, vpc, "private-sg")
+                public_security_group = self._create_public_sg(vpc_conn, vpc, "public-sg")
     
-            controller_res = conn.run_instances(ami_ids['controller'], 
-                                                min_count=1,
-                                                key_name=c['key_pair'], 
-                                                instance_type=self._controller_instance_type,
-                                                block_device_map=block_devices, 
-                                                subnet_id=private_subnet.id, 
-                                                security_group_ids=[private_security_group.id])
-            controller_instance = controller_res.instances[0]
+                # Shared volume
+                if shared_volume_id:
+                    try:
+                        shared_volume = conn.get_all_volumes([shared_volume_id])[0]
+                        if shared_volume.status != 'available':
+                            raise ClusterException('Volume "{0}" is not available'.format(shared_volume_id))
+                        vpc_conn = boto.vpc.connect_to_region(c['region'], aws_access_key_id=c['access_key_id'],aws_secret_access_key=c['secret_access_key'])
+                        if private_subnet.availability_zone != shared_volume.zone:
+                            raise ClusterException('Conflict in availability zone. Subnet "{0}" in "{1}" and Volume "{2}" in "{3}"'.format(private_subnet.id,
+                                                    private_subnet.availability_zone, shared_volume_id, shared_volume.zone))
+                    except boto.exception.EC2ResponseError as e:
+                        raise ClusterException('Volume "{0}" does not exist'.format(shared_volume_id))
+                elif snapshot_id:
+                    try:
+                        snapshot = conn.get_all_snapshots([snapshot_id])[0]
+                    except boto.exception.EC2ResponseError as e:
+                        raise ClusterException('Snapshot "{0}" does not exist'.format(snapshot_id))
+                    if snapshot.status != 'completed':
+                        raise ClusterException('Snapshot "{0}" is not completed'.format(snapshot_id))
+                    if shared_volume_size and shared_volume_size < snapshot.volume_size:
+                        raise ClusterException('Shared volume size cannot be less than the {0} GB of snapshot "{1}"'.format(
+                                                snapshot.volume_size, snapshot_id))
     
-            controller_tags = {'Name': defaults.controller_name_format.format(cluster_name),
-                                defaults.instance_node_type_tag_key: defaults.controller_name_tag_value}
-            controller_tags_and_res = [('controller', controller_tags, controller_res.instances)]
+                # Connect public subnet to the gateway
+                vpc_conn.create_route(public_route_table.id, destination_cidr_block="0.0.0.0/0", gateway_id=gateway.id)
+                vpc_conn.associate_route_table(public_route_table.id, public_subnet.id)
     
-            # Loop through node groups and launch all
-            self._logger.info('Starting all nodes')
-            node_tags_and_res = []
-            for num_nodes, instance_type, node_tag in nodes_info:
-                node_block_devices = boto.ec2.blockdevicemapping.BlockDeviceMapping(conn)
-                node_root_vol = boto.ec2.blockdevicemapping.BlockDeviceType(connection=conn, delete_on_termination=True, volume_type='gp2')
-                node_block_devices['/dev/sda1'] = node_root_vol
-    
-                res = conn.run_instances(ami_ids['node'], 
-                                         min_count=num_nodes, 
-                                         max_count=num_nodes,
-                                         key_name=c['key_pair'], 
-                                         instance_type=instance_type,
-                                         block_device_map=node_block_devices, 
-                                         subnet_id=private_subnet.id, 
-                                         security_group_ids=[private_security_group.id])
-                node_tags = {'Name': defaults.node_name_format.format(cluster_name, node_tag),
-                            defaults.instance_node_type_tag_key: node_tag}
-                node_tags_and_res.append((node_tag, node_tags, res.instances))
+            # Launch all instances, then wait for them, overlapping independent steps
+            graph = taskgraph.TaskGraph()
+
+            def launch_nat():
+                self._logger.info('Starting NAT')
+                nat_interface = boto.ec2.networkinterface.NetworkInterfaceSpecification(subnet_id=public_subnet.id,
+                                                                                        groups=[public_security_group.id, ],
+                                                                                        associate_public_ip_address=True)
+                nat_network_interfaces = boto.ec2.networkinterface.NetworkInterfaceCollection(nat_interface)
+                return conn.run_instances(ami_ids['nat'], 
+                                          min_count=1,
+                                          key_name=c['key_pair'], 
+                                          instance_type=defaults.nat_instance_type,
+                                          network_interfaces=nat_network_interfaces)
+
+            def wait_nat():
+                nat_res = graph.result('launch-nat')
+                nat_instance = nat_res.instances[0]
+                nat_tags = {'Name': defaults.nat_name_format.format(cluster_name),
+                                    defaults.instance_node_type_tag_key: defaults.nat_name_tag_value}
+                self._wait_and_tag_instance_reservations([('nat', nat_tags, nat_res.instances)])
+                nat_instance.modify_attribute('sourceDestCheck',False)  # Disable sourceDestCheck on NAT instance
+
+                # Connect private subnet to the nat instance
+                vpc_conn.create_route(private_route_table.id, destination_cidr_block="0.0.0.0/0", instance_id=nat_instance.id)
+                vpc_conn.associate_route_table(private_route_table.id, private_subnet.id)
+                return nat_instance
+
+            def launch_controller():
+                self._logger.info('Starting controller')
+                block_devices = boto.ec2.blockdevicemapping.BlockDeviceMapping(conn)
+                root_vol = boto.ec2.blockdevicemapping.BlockDeviceType(connection=conn, delete_on_termination=True, volume_type='gp2')
+                root_vol.size = defaults.controller_root_volume_size
+                block_devices['/dev/sda1'] = root_vol
+
+                return conn.run_instances(ami_ids['controller'], 
+                                          min_count=1,
+                                          key_name=c['key_pair'], 
+                                          instance_type=self._controller_instance_type,
+                                          block_device_map=block_devices, 
+                                          subnet_id=private_subnet.id, 
+                                          security_group_ids=[private_security_group.id])
+
+            # Launch all node groups
+            def launch_nodes():
+                self._logger.info('Starting all nodes')
+                node_tags_and_res = []
+                warm_tags_and_res = []
+                for num_nodes, instance_type, node_tag in nodes_info:
+                    launch_options = self._node_launch_options(conn, node_tag, cluster_spec.get(node_tag, {}))
     
+                    res = conn.run_instances(ami_ids['node'], 
+                                             min_count=num_nodes, 
+                                             max_count=num_nodes,
+                                             key_name=c['key_pair'], 
+                                             instance_type=instance_type,
+                                             subnet_id=private_subnet.id, 
+                                             security_group_ids=[private_security_group.id],
+                                             **launch_options)
+                    node_tags = {'Name': defaults.node_name_format.format(cluster_name, node_tag),
+                                defaults.instance_node_type_tag_key: node_tag}
+                    node_tags_and_res.append((node_tag, node_tags, res.instances))
+
+                    # Warm pool nodes are launched and configured along with the rest, then stopped
+                    warm_pool_size = cluster_spec.get(node_tag, {}).get('warm_pool', 0)
+                    if warm_pool_size > 0:
+                        warm_res = conn.run_instances(ami_ids['node'],
+                                                      min_count=warm_pool_size,
+                                                      max_count=warm_pool_size,
+                                                      key_name=c['key_pair'],
+                                                      instance_type=instance_type,
+                                                      subnet_id=private_subnet.id,
+                                                      security_group_ids=[private_security_group.id],
+                                                      **launch_options)
+                        warm_tags = node_tags.copy()
+                        warm_tags[defaults.warm_pool_tag_key] = node_tag
+                        warm_tags_and_res.append((node_tag, warm_tags, warm_res.instances))
+                return node_tags_and_res, warm_tags_and_res
+
             # Launch logging instance if necessary
-            logging_tags_and_res = []
-            if logging_level > 0:
+            def launch_central_logging():
+                if logging_level <= 0:
+                    return []
                 self._logger.info('Starting central logging instance')
-    
+                block_devices = boto.ec2.blockdevicemapping.BlockDeviceMapping(conn)
+                root_vol = boto.ec2.blockdevicemapping.BlockDeviceType(connection=conn, delete_on_termination=True, volume_type='gp2')
+                root_vol.size = defaults.controller_root_volume_size
+                block_devices['/dev/sda1'] = root_vol
+
                 logging_res = conn.run_instances(ami_ids['logging'], 
                                                  min_count=1,
                                                  key_name=c['key_pair'], 
@@ -962,54 +1187,148 @@ class AWSCluster(Cluster):
                                                  security_group_ids=[private_security_group.id])
                 logging_tags = {'Name': defaults.central_logging_name_format.format(cluster_name),
                                 defaults.instance_node_type_tag_key: defaults.central_logging_name_tag_value}
-                logging_tags_and_res = [('central-logging', logging_tags, logging_res.instances)]
-    
-    
+                return [('central-logging', logging_tags, logging_res.instances)]
+
+            # Launch storage node, if the shared volume is to be on a dedicated instance
+            def launch_storage():
+                if not storage_instance_type:
+                    return None
+                self._logger.info('Starting storage node')
+                block_devices = boto.ec2.blockdevicemapping.BlockDeviceMapping(conn)
+                block_devices['/dev/sda1'] = boto.ec2.blockdevicemapping.BlockDeviceType(connection=conn,
+                                                            delete_on_termination=True, volume_type='gp2')
+                return conn.run_instances(ami_ids['node'],
+                                          min_count=1,
+                                          key_name=c['key_pair'],
+                                          instance_type=storage_instance_type,
+                                          block_device_map=block_devices,
+                                          subnet_id=private_subnet.id,
+                                          security_group_ids=[private_security_group.id])
+
+            def wait_storage():
+                storage_res = graph.result('launch-storage')
+                if not storage_res:
+                    self._set_cluster_info({'storage_ip': ''})
+                    return None
+                storage_tags = {'Name': defaults.storage_name_format.format(cluster_name),
+                                defaults.instance_node_type_tag_key: defaults.storage_name_tag_value}
+                self._wait_and_tag_instance_reservations([('storage', storage_tags, storage_res.instances)])
+                storage_instance = storage_res.instances[0]
+                self._set_cluster_info({'storage_ip': storage_instance.private_ip_address})
+                return storage_instance
+
             # Wait for controller to launch
-            controller = self._wait_and_tag_instance_reservations(controller_tags_and_res)
-    
-            # Add controller IP to cluster info file
-            self._set_cluster_info({'nat_ip': nat_instance.ip_address, 'cluster_name': cluster_name})
-            controller_inventory = os.path.expanduser(defaults.current_nat_ip_file)
-    
-            self._write_to_hosts_file(controller_inventory, 
-                                      ['{0}:{1}'.format(nat_instance.ip_address, defaults.nat_ssh_port_forwarding)], 
-                                      'controller', overwrite=True)
-    
-            # Shared volume
-            if shared_volume_id:
-                # Attach shared volume
-                self._logger.info('Attaching EBS volume "{0}"'.format(shared_volume_id))
-                conn.attach_volume(shared_volume_id, controller_res.instances[0].id, "/dev/sdf")
-                while conn.get_all_volumes([shared_volume_id])[0].status != 'in-use':
-                    time.sleep(2)
-                conn.create_tags([shared_volume_id], {'Attached': cluster_name})
-            else:
-                # Create and attach shared volume
-                self._logger.info('Creating shared volume')
-                shared_vol = conn.create_volume(self._shared_volume_size, zone=controller_res.instances[0].placement)
-                while shared_vol.status != 'available':
-                    time.sleep(2)
-                    shared_vol.update()
-                self._logger.debug('Shared volume {0} created'.format(shared_vol.id))
-                conn.create_tags([shared_vol.id], {'Name': defaults.controller_name_format.format(cluster_name),
-                                                   defaults.instance_tag_key: cluster_name})
-    
-                attach = shared_vol.attach(controller_res.instances[0].id, '/dev/sdf')
-                while shared_vol.attachment_state() != 'attached':
-                    time.sleep(2)
-                    shared_vol.update()
-    
-            # Tag central logging
-            central_logging = {}
-            if logging_tags_and_res:
-                self._logger.debug('Tagging central logging...')
-                central_logging = self._wait_and_tag_instance_reservations(logging_tags_and_res)
-    
-            # Tag all nodes
-            nodes = {}
-            if node_tags_and_res:
-                nodes = self._wait_and_tag_instance_reservations(node_tags_and_res)
+            def wait_controller():
+                controller_res = graph.result('launch-controller')
+                controller_tags = {'Name': defaults.controller_name_format.format(cluster_name),
+                                    defaults.instance_node_type_tag_key: defaults.controller_name_tag_value}
+                self._wait_and_tag_instance_reservations([('controller', controller_tags, controller_res.instances)])
+
+                # Add NAT and controller IPs to cluster info file
+                nat_instance = graph.result('wait-nat')
+                controller_instance = controller_res.instances[0]
+                self._set_cluster_info({'nat_ip': nat_instance.ip_address, 'cluster_name': cluster_name,
+                                        'controller_ip': controller_instance.private_ip_address})
+                self._write_controller_inventory(nat_instance.ip_address, controller_instance.private_ip_address)
+                return controller_instance
+
+            # Shared volume, created while the controller starts up. Size, IOPS and throughput
+            # are for the whole shared volume, and are divided evenly among its stripes
+            def create_volume():
+                if shared_volume_id:
+                    self._set_cluster_info({'shared_volume_type': shared_volume.type,
+                                            'shared_volume_iops': shared_volume.iops,
+                                            'shared_volume_throughput': None,
+                                            'shared_volume_stripes': 1})
+                    return []
+                # On the storage node if there is one, otherwise on the controller
+                volume_res = graph.result('launch-storage') or graph.result('launch-controller')
+                if snapshot_id:
+                    # Unless a size is given, the size of the snapshot
+                    self._logger.info('Creating shared volume from snapshot "{0}"'.format(snapshot_id))
+                    shared_vols = [ self._create_volume(conn, shared_volume_size, volume_res.instances[0].placement,
+                                                        volume_type, shared_volume_options.get('iops'),
+                                                        shared_volume_options.get('throughput'), snapshot_id) ]
+                else:
+                    self._logger.info('Creating shared volume')
+                    per_stripe = lambda total: -(-total // volume_stripes) if total else None
+                    shared_vols = [ self._create_volume(conn, per_stripe(self._shared_volume_size),
+                                                        volume_res.instances[0].placement, volume_type,
+                                                        per_stripe(shared_volume_options.get('iops')),
+                                                        per_stripe(shared_volume_options.get('throughput')))
+                                    for _ in range(volume_stripes) ]
+                def available():
+                    return all([ v.update() == 'available' for v in shared_vols ])
+                if not waiter.wait_until('volume-available', available, defaults.volume_wait_timeout):
+                    raise ClusterException('Timed out creating shared volume')
+                volume_ids = [ v.id for v in shared_vols ]
+                self._logger.debug('Shared volume {0} created'.format(', '.join(volume_ids)))
+                conn.create_tags(volume_ids, {'Name': defaults.controller_name_format.format(cluster_name),
+                                              defaults.instance_tag_key: cluster_name})
+                self._set_cluster_info({'shared_volume_type': volume_type,
+                                        'shared_volume_iops': shared_volume_options.get('iops') or None,
+                                        'shared_volume_throughput': shared_volume_options.get('throughput') or None,
+                                        'shared_volume_stripes': volume_stripes,
+                                        'shared_volume_snapshot_id': snapshot_id or None})
+                return shared_vols
+
+            def attach_volume():
+                volume_instance = graph.result('wait-storage') or graph.result('wait-controller')
+                if shared_volume_id:
+                    # Attach shared volume
+                    self._logger.info('Attaching EBS volume "{0}"'.format(shared_volume_id))
+                    conn.attach_volume(shared_volume_id, volume_instance.id, "/dev/sdf")
+                    if not waiter.wait_until('volume-attached',
+                                             lambda: conn.get_all_volumes([shared_volume_id])[0].status == 'in-use',
+                                             defaults.volume_wait_timeout):
+                        raise ClusterException('Timed out attaching EBS volume "{0}"'.format(shared_volume_id))
+                    conn.create_tags([shared_volume_id], {'Attached': cluster_name})
+                else:
+                    shared_vols = graph.result('create-volume')
+                    for v, letter in zip(shared_vols, defaults.shared_volume_device_letters):
+                        v.attach(volume_instance.id, '/dev/sd' + letter)
+                    def attached():
+                        for v in shared_vols:
+                            v.update()
+                        return all([ v.attachment_state() == 'attached' for v in shared_vols ])
+                    if not waiter.wait_until('volume-attached', attached, defaults.volume_wait_timeout):
+                        raise ClusterException('Timed out attaching shared volume')
+
+            # Wait for and tag central logging and all nodes
+            def wait_nodes():
+                logging_tags_and_res = graph.result('launch-central-logging')
+                node_tags_and_res, warm_tags_and_res = graph.result('launch-nodes')
+                central_logging = {}
+                if logging_tags_and_res:
+                    self._logger.debug('Tagging central logging...')
+                    central_logging = self._wait_and_tag_instance_reservations(logging_tags_and_res)
+                nodes = {}
+                if node_tags_and_res:
+                    nodes = self._wait_and_tag_instance_reservations(node_tags_and_res)
+                warm_nodes = {}
+                if warm_tags_and_res:
+                    warm_nodes = self._wait_and_tag_instance_reservations(warm_tags_and_res)
+                return central_logging, nodes, warm_nodes
+
+            graph.add('launch-nat', launch_nat)
+            graph.add('wait-nat', wait_nat, requires=['launch-nat'])
+            graph.add('launch-controller', launch_controller)
+            graph.add('launch-nodes', launch_nodes)
+            graph.add('launch-central-logging', launch_central_logging)
+            graph.add('launch-storage', launch_storage)
+            graph.add('wait-controller', wait_controller, requires=['launch-controller', 'wait-nat'])
+            graph.add('wait-storage', wait_storage, requires=['launch-storage'])
+            graph.add('create-volume', create_volume, requires=['launch-controller', 'launch-storage'])
+            graph.add('attach-volume', attach_volume, requires=['create-volume', 'wait-controller', 'wait-storage'])
+            graph.add('wait-nodes', wait_nodes, requires=['launch-nodes', 'launch-central-logging'])
+            results = graph.run()
+
+            nat_instance = results['wait-nat']
+            controller_instance = results['wait-controller']
+            storage_instance = results['wait-storage']
+            controller_inventory = self._local_path(defaults.current_nat_ip_file)
+            warm_tags_and_res = results['launch-nodes'][1]
+            central_logging, nodes, warm_nodes = results['wait-nodes']
 
             # Any errors that occur up until this point cannot cleanly be recovered from by destroy
         except KeyboardInterrupt as e:
@@ -1023,47 +1342,89 @@ class AWSCluster(Cluster):
             # If an error occurs from this point on, the destroy command should cleanly destroy the cluster
             #
 
-            # Setup ssh port forwarding on NAT instance
-            self._logger.info('Configuring NAT')
-            self._set_nat_ssh_port_forwarding(nat_instance.ip_address, controller_instance.private_ip_address)
+            # Wait for SSH to come up on the controller, reached through the NAT
+            with tracing.span('wait-controller-ssh'):
+                self._logger.info('Connecting to controller')
+                nat_bastion = bastion.get_bastion(nat_instance.ip_address, self._config['key_file'])
+                def controller_ssh():
+                    try:
+                        nat_bastion.connect(controller_instance.private_ip_address, defaults.cluster_username).close()
+                        return True
+                    except (paramiko.ssh_exception.SSHException, socket.error) as e:
+                        self._logger.debug('Unable to establish ssh connection, trying again')
+                        return False
+                if not waiter.wait_until('controller-ssh', controller_ssh, defaults.ssh_connect_timeout, initial=5):
+                    raise ClusterException('Unable to establish SSH connection to controller')
 
             # Extra variables used by ansible scripts
             extra_vars = {'central_logging_level': logging_level,
                           'central_logging_ip': '',
-                          'byo_volume': 1 if shared_volume_id else 0,
-                          'nat_ssh_port_forwarding': defaults.nat_ssh_port_forwarding
+                          # An existing volume, or one restored from a snapshot, already has a filesystem
+                          'byo_volume': 1 if shared_volume_id or snapshot_id else 0,
+                          'grow_filesystem': 1 if snapshot_id and shared_volume_size else 0,
+                          'prewarm_volume': 1 if shared_volume_options.get('prewarm') else 0,
+                          'prewarm_parallelism': defaults.shared_volume_prewarm_parallelism,
+                          'shared_volume_devices': volume_devices,
+                          'shared_volume_device': volume_devices[0] if len(volume_devices) == 1 else defaults.shared_volume_raid_device,
+                          'nfs_export_options': defaults.nfs_profiles[nfs_profile]['export_options'],
+                          'nfs_server': storage_instance.private_ip_address if storage_instance else 'controller'
                           }
     
             # Configure controller
-            controller_vars_dict = self._controller_vars_dict()
-            controller_vars_dict.update(extra_vars)
-            controller_vars_file = self._make_vars_file(controller_vars_dict)
+            with tracing.span('configure-controller'):
+                controller_vars_dict = self._controller_vars_dict()
+                controller_vars_dict.update(extra_vars)
+                controller_vars_file = self._make_vars_file(controller_vars_dict)
     
-            self._logger.info('Configuring controller instance...')
-            AnsibleHelper.run_playbook(defaults.get_script('ansible/01_configure_controller.yml'),
-                                       controller_vars_file.name, self._config['key_file'],
-                                       hosts_file=controller_inventory)
+                self._logger.info('Configuring controller instance...')
+                AnsibleHelper.run_playbook(defaults.get_script('ansible/01_configure_controller.yml'),
+                                           controller_vars_file.name, self._config['key_file'],
+                                           hosts_file=controller_inventory)
     
-            controller_vars_file.close()
+                controller_vars_file.close()
     
-            self._copy_environment_to_controller()
+                self._copy_environment_to_controller()
     
     
             # Wait for logging instance to launch and configure
-            if central_logging:
-                extra_vars['central_logging_ip'] = central_logging.values()[0].private_ips[0]     # private ip
-                logging_inventory = tempfile.NamedTemporaryFile()
-                self._write_to_hosts_file(logging_inventory.name, [central_logging.values()[0].private_ips[0]], 'central-logging', overwrite=True)
-                logging_inventory.flush()
-                self._run_on_controller('configure_central_logging.yml', logging_inventory.name)
-                logging_inventory.close()
-            # Write logging vars to cluster info file
-            self._set_cluster_info(extra_vars)
+            with tracing.span('configure-central-logging'):
+                if central_logging:
+                    extra_vars['central_logging_ip'] = central_logging.values()[0].private_ips[0]     # private ip
+                    logging_inventory = tempfile.NamedTemporaryFile()
+                    self._write_to_hosts_file(logging_inventory.name, [central_logging.values()[0].private_ips[0]], 'central-logging', overwrite=True)
+                    logging_inventory.flush()
+                    self._run_on_controller('configure_central_logging.yml', logging_inventory.name)
+                    logging_inventory.close()
+                # Write logging vars to cluster info file
+                self._set_cluster_info(extra_vars)
     
     
+            # Set up the shared volume on the storage node, and mount it on the controller
+            with tracing.span('configure-storage'):
+                if storage_instance:
+                    self._logger.info('Configuring storage node...')
+                    storage_inventory = tempfile.NamedTemporaryFile()
+                    self._write_to_hosts_file(storage_inventory.name, [storage_instance.private_ip_address],
+                                              'storage', overwrite=True)
+                    storage_inventory.flush()
+                    node_count = sum([ count for count, instance_type, node_tag in nodes_info ])
+                    self._run_on_controller('configure_storage.yml', storage_inventory.name,
+                                            dict(extra_vars, **self._get_nfs_vars(node_count)))
+                    storage_inventory.close()
+
             # Configure nodes
-            if nodes:
-                self._configure_nodes(nodes_info, nodes, nat_instance.ip_address, extra_vars)
+            with tracing.span('configure-nodes'):
+                if nodes:
+                    node_count = sum([ len(n.private_ips) for n in nodes.values() + warm_nodes.values() ])
+                    self._configure_nodes(nodes_info, nodes, nat_instance.ip_address, extra_vars, warm_nodes,
+                                          node_count)
+
+            # Configured warm pool nodes are kept stopped until needed
+            with tracing.span('stop-warm-pool'):
+                if warm_tags_and_res:
+                    warm_ids = [ i.id for (label, tags, insts) in warm_tags_and_res for i in insts ]
+                    self._logger.info('Stopping {0} warm pool nodes'.format(len(warm_ids)))
+                    conn.stop_instances(instance_ids=warm_ids)
 
         except (boto.exception.BotoClientError, boto.exception.BotoServerError) as e:
             self._logger.critical('An error occurred accessing AWS and the cluster could not be launched. Use "destroy" to destroy the cluster')
@@ -1077,51 +1438,188 @@ class AWSCluster(Cluster):
 
         # Set "running" flag in cluster info file
         self._set_cluster_info({'running': True})
+        self._record_node_inventory()
 
         # TODO: this is useful for debugging, but remove at a later stage
-        self.create_permanent_tunnel_to_controller(8080, 8080, prefix='marathon')
-        self.create_permanent_tunnel_to_controller(5050, 5050, prefix='mesos')
+        with tracing.span('permanent-tunnels'):
+            self.create_permanent_tunnel_to_controller(8080, 8080, prefix='marathon')
+            self.create_permanent_tunnel_to_controller(5050, 5050, prefix='mesos')
 
 
-    def _configure_nodes(self, nodes_info, nodes, nat_ip, extra_vars={}):
+    def _configure_nodes(self, nodes_info, nodes, nat_ip, extra_vars={}, warm_nodes={}, node_count=0):
+        """
+        Runs node configuration on all nodes. Any nodes in warm_nodes are configured
+        without joining Mesos, so that they can later be stopped into the warm pool.
+        node_count is the number of nodes in the cluster once these are added
+        """
+        cluster_spec = self._get_cluster_info().get('cluster_spec') or {}
+        ips = [ ip for n in nodes.values() for ip in n.private_ips ]
+        warm_ips = [ ip for n in warm_nodes.values() for ip in n.private_ips ]
+        registry_vars = self._assign_registry_mirrors(ips, warm_ips, node_count)
         nodes_inventory = tempfile.NamedTemporaryFile()
         for num_nodes, instance_type, node_tag in nodes_info:
-            self._write_to_hosts_file(nodes_inventory.name, nodes[node_tag].private_ips, node_tag, overwrite=False)
+            host_vars = 'nfs_cache=1' if cluster_spec.get(node_tag, {}).get('nfs_cache') else ''
+            ips = nodes[node_tag].private_ips if node_tag in nodes else []
+            self._write_to_hosts_file(nodes_inventory.name, ips, node_tag, overwrite=False, host_vars=host_vars,
+                                      ip_vars=registry_vars)
+            if node_tag in warm_nodes:
+                self._write_to_hosts_file(nodes_inventory.name, warm_nodes[node_tag].private_ips,
+                                          overwrite=False, host_vars=' '.join(['warm_pool=1', host_vars]).strip(),
+                                          ip_vars=registry_vars)
+        self._write_storage_inventory(nodes_inventory.name)
         nodes_inventory.flush()
         self._logger.info('Configuring nodes...')
-        self._run_on_controller('configure_nodes.yml', nodes_inventory.name, extra_vars)
+        self._run_on_controller('configure_nodes.yml', nodes_inventory.name,
+                                dict(extra_vars, **self._get_nfs_vars(node_count)))
         nodes_inventory.close()
         return True
 
+    def _assign_registry_mirrors(self, ips, warm_ips, node_count):
+        """
+        Chooses the registry that each of the nodes being configured pulls images
+        from (warm_ips being stopped warm pool nodes), for a cluster of node_count
+        nodes. Once there are more than defaults.registry_mirror_fanout nodes, some
+        running nodes are made registry mirrors (pull-through caches of the
+        controller's registry), and every other node pulls from one of them, so
+        that the controller sends each layer once per mirror rather than once per
+        node. Returns dictionary of IP to Ansible host variables
+        """
+        mirrors = self.get_registry_mirrors()
+        needed = 0
+        if node_count > defaults.registry_mirror_fanout:
+            needed = -(-node_count // defaults.registry_mirror_fanout)
+        new_mirrors = [ ip for ip in ips if ip not in mirrors ][:max(needed - len(mirrors), 0)]
+        if new_mirrors:
+            mirrors.extend(new_mirrors)
+            self._set_cluster_info({'registry_mirrors': mirrors})
+
+        host_vars = dict( (ip, 'registry_mirror=1') for ip in new_mirrors )
+        if mirrors:
+            peers = [ ip for ip in ips + warm_ips if ip not in mirrors ]
+            for n, ip in enumerate(peers):
+                host_vars[ip] = 'registry_host={0}'.format(mirrors[n % len(mirrors)])
+        return host_vars
+
+    def _get_registry_vars(self):
+        """
+        Returns variables for registry_host.yml
+        """
+        return {'registry_mirrors': self.get_registry_mirrors(),
+                'controller_ip': self._get_controller_ip()}
+
     def _set_cluster_info(self, info):
         """
-        Writes information to cluster info file. info is a flat dictionary.
-        Existing values are not removed; this method only add/updates values
+        Writes information about this cluster to the local state store. info is a flat
+        dictionary. Existing values are not removed; this method only add/updates values
         Returns True if everything goes well
         """
-        cluster_info_file = os.path.expanduser(defaults.cluster_info_file)
+        statestore.get_store().update_cluster_info(self.cluster_name, info)
+        return True
 
 
-        existing = {}
-        if os.path.exists(cluster_info_file):
-            stream = open(cluster_info_file, 'r')
-            existing = yaml.load(stream)
+    def _node_launch_options(self, conn, node_name, node_spec):
+        """
+        Given the cluster spec entry for a node group, returns extra arguments to
+        run_instances, creating the node group's placement group if requested
+        """
+        block_devices = boto.ec2.blockdevicemapping.BlockDeviceMapping(conn)
+        block_devices['/dev/sda1'] = boto.ec2.blockdevicemapping.BlockDeviceType(connection=conn, delete_on_termination=True,
+                                                                                 volume_type='gp2')
+        if node_spec.get('nfs_cache'):
+            # Instance store (if the instance type has one) for the shared volume cache
+            block_devices[defaults.nfs_cache_instance_store_device] = boto.ec2.blockdevicemapping.BlockDeviceType(
+                                                                        connection=conn, ephemeral_name='ephemeral0')
+        options = {'block_device_map': block_devices}
+        if node_spec.get('placement_group'):
+            options['placement_group'] = self._create_placement_group(conn, node_name)
+        if node_spec.get('ebs_optimized'):
+            options['ebs_optimized'] = True
+        return options
+
+    def _create_placement_group(self, conn, node_name):
+        """
+        Creates a cluster placement group for node_name if it doesn't already exist,
+        returns its name
+        """
+        pg_name = defaults.placement_group_name_format.format(self.cluster_name, node_name)
+        if not conn.get_all_placement_groups(filters={'group-name': pg_name}):
+            self._logger.debug('Creating placement group {0}'.format(pg_name))
+            conn.create_placement_group(pg_name, strategy=defaults.placement_group_strategy)
+        return pg_name
 
-        existing.update(info)
+    def _delete_placement_groups(self, conn):
+        """
+        Deletes any placement groups created for node groups in the locally
+        stored cluster spec. Instances must already be terminated
+        """
+        spec = self._get_cluster_info().get('cluster_spec', {})
 
-        stream = open(cluster_info_file, 'w')
-        stream.write(yaml.dump(existing, default_flow_style=False))
+        pg_names = [ defaults.placement_group_name_format.format(self.cluster_name, n)
+                     for n, params in spec.iteritems() if params.get('placement_group') ]
+        if not pg_names:
+            return True
 
-        return True
+        all_deleted = True
+        for pg in conn.get_all_placement_groups(filters={'group-name': pg_names}):
+            if not pg.delete():
+                self._logger.error('Unable to delete placement group {0}'.format(pg.name))
+                all_deleted = False
+            else:
+                self._logger.debug('Deleted placement group {0}'.format(pg.name))
+
+        return all_deleted
+
+    def _get_warm_pool_instances(self, conn, node_name=None):
+        """
+        Get stopped warm pool instances, optionally only those of a given node name
+        """
+        instance_filters = { 'tag:{0}'.format(defaults.instance_tag_key): [self.cluster_name],
+                        'tag-key': [defaults.warm_pool_tag_key],
+                        'instance-state-name': ['stopped', 'stopping']
+                        }
+        if node_name:
+            instance_filters['tag:{0}'.format(defaults.warm_pool_tag_key)] = [node_name]
+        return conn.get_only_instances(filters=instance_filters)
+
+    def _start_warm_pool_nodes(self, conn, num_nodes, node_name, node_spec=None):
+        """
+        Starts up to num_nodes stopped nodes from the warm pool of node_name (with
+        cluster spec entry node_spec) and reattaches them to the cluster. Returns
+        number of nodes started
+        """
+        node_spec = node_spec or {}
+        warm = [ i for i in self._get_warm_pool_instances(conn, node_name) if i.state == 'stopped' ][:num_nodes]
+        if not warm:
+            return 0
+
+        self._logger.info('Starting {0} "{1}" nodes from warm pool'.format(len(warm), node_name))
+        warm_ids = [ i.id for i in warm ]
+        conn.start_instances(instance_ids=warm_ids)
+        conn.delete_tags(warm_ids, [defaults.warm_pool_tag_key])
+
+        # Describe results lag behind start_instances, so the instances may still appear stopped
+        started = self._wait_and_tag_instance_reservations([(node_name, {}, warm)], starting=True)
+
+        # Nodes are already configured, only need to remount and rejoin Mesos
+        host_vars = 'nfs_cache=1' if node_spec.get('nfs_cache') else ''
+        nodes_inventory = tempfile.NamedTemporaryFile()
+        self._write_to_hosts_file(nodes_inventory.name, started[node_name].private_ips, node_name, overwrite=True,
+                                  host_vars=host_vars)
+        self._write_storage_inventory(nodes_inventory.name)
+        nodes_inventory.flush()
+        resume_vars = self._get_nfs_vars(sum(self.get_node_counts(refresh=True).values()))
+        resume_vars.update(self._get_registry_vars())
+        self._run_on_controller('resume_nodes.yml', nodes_inventory.name, resume_vars)
+        nodes_inventory.close()
 
+        return len(warm)
 
-    def add_nodes(self, num_nodes, instance_type, node_name):
+    def add_nodes(self, num_nodes, instance_type, node_name, node_spec=None):
+        node_spec = node_spec or {}
         success = False
-        self._logger.info('Creating {0} "{1}" nodes'.format(num_nodes, node_name))
 
         c = self._config
         ami_ids = self._machine_images['aws'][c['region']]
-        nodes_info = [(num_nodes, instance_type, node_name)]
         nat_ip = self._get_nat_ip()
         logging_vars = self._get_logging_vars()
 
@@ -1132,24 +1630,35 @@ class AWSCluster(Cluster):
         if not (conn or vpc_conn):
             raise ClusterException('Cannot connect to AWS')
 
+        if node_spec.get('warm_pool'):
+            num_nodes -= self._start_warm_pool_nodes(conn, num_nodes, node_name, node_spec)
+            if num_nodes <= 0:
+                return True
+
+        self._logger.info('Creating {0} "{1}" nodes'.format(num_nodes, node_name))
+        nodes_info = [(num_nodes, instance_type, node_name)]
         vpc = self._get_vpc(vpc_conn)
         private_subnet = self._create_subnet(vpc_conn, vpc, 'private-subnet')
         private_security_group = self._create_private_sg(vpc_conn, vpc, "private-sg")
+        launch_options = self._node_launch_options(conn, node_name, node_spec)
         res = conn.run_instances(ami_ids['node'], 
                                  min_count=num_nodes, 
                                  max_count=num_nodes,
                                  key_name=c['key_pair'], 
                                  instance_type=instance_type,
                                  subnet_id=private_subnet.id, 
-                                 security_group_ids=[private_security_group.id])
+                                 security_group_ids=[private_security_group.id],
+                                 **launch_options)
         node_tags = {'Name': defaults.node_name_format.format(self.cluster_name, node_name),
                     defaults.instance_node_type_tag_key: node_name}
         node_tags_and_res = [(node_name, node_tags, res.instances)]
         nodes = self._wait_and_tag_instance_reservations(node_tags_and_res)
         self._logger.info('Waiting for nodes to start...')
-        return self._configure_nodes(nodes_info, nodes, nat_ip, logging_vars)
+        return self._configure_nodes(nodes_info, nodes, nat_ip, logging_vars,
+                                     node_count=sum(self.get_node_counts(refresh=True).values()))
 
-    def rm_nodes(self, num_nodes, node_name):
+    def rm_nodes(self, num_nodes, node_name, node_spec=None):
+        node_spec = node_spec or {}
         c = self._config
         conn = boto.ec2.connect_to_region(c['region'], aws_access_key_id=c['access_key_id'],
                                             aws_secret_access_key=c['secret_access_key'])
@@ -1157,13 +1666,22 @@ class AWSCluster(Cluster):
             raise ClusterException('Cannot connect to AWS')
 
 
-        instance_list = self._get_node_instances(conn, node_name)
+        # Registry mirrors are removed last, as other nodes pull images from them
+        mirrors = self.get_registry_mirrors()
+        instance_list = sorted([ i for i in self._get_node_instances(conn, node_name)
+                                 if defaults.warm_pool_tag_key not in i.tags ],
+                               key=lambda i: i.private_ip_address in mirrors)
 
         ids_to_remove = []
+        ips_to_remove = []
+        removed_mirrors = []
 
         for i in instance_list:
             if len(ids_to_remove) < num_nodes:
                 ids_to_remove.append(i.id)
+                ips_to_remove.append(i.private_ip_address)
+                if i.private_ip_address in mirrors:
+                    removed_mirrors.append(i.private_ip_address)
             else:
                 break
 
@@ -1177,7 +1695,24 @@ class AWSCluster(Cluster):
 
         self._logger.info('Removing {0} nodes of type "{1}"...'.format(actual_num_to_remove, node_name))
 
-        success = self._terminate_instances_and_wait(conn, ids_to_remove)
+        if removed_mirrors:
+            self._remove_registry_mirrors(conn, removed_mirrors)
+
+        self._drain_nodes(ips_to_remove)
+
+        # Refill the warm pool before terminating any nodes
+        num_to_pool = node_spec.get('warm_pool', 0) - len(self._get_warm_pool_instances(conn, node_name))
+        if num_to_pool > 0:
+            pool_ids = ids_to_remove[:num_to_pool]
+            ids_to_remove = ids_to_remove[num_to_pool:]
+            self._logger.debug('Returning {0} nodes to warm pool'.format(len(pool_ids)))
+            conn.create_tags(pool_ids, {defaults.warm_pool_tag_key: node_name})
+            conn.stop_instances(instance_ids=pool_ids)
+
+        success = True
+        if ids_to_remove:
+            success = self._terminate_instances_and_wait(conn, ids_to_remove)
+        self._record_node_inventory(conn)
 
         if success:
             return actual_num_to_remove
@@ -1185,19 +1720,56 @@ class AWSCluster(Cluster):
             return -1
 
 
+    def _drain_nodes(self, ips):
+        """
+        Stops the Mesos agent on the nodes with IPs in ips, so that they leave Mesos
+        cleanly and their tasks are rescheduled before they are stopped or terminated
+        """
+        nodes_inventory = tempfile.NamedTemporaryFile()
+        self._write_to_hosts_file(nodes_inventory.name, ips, 'nodes', overwrite=True)
+        nodes_inventory.flush()
+        self._run_on_controller('drain_nodes.yml', nodes_inventory.name,
+                                {'drain_timeout': defaults.node_drain_timeout})
+        nodes_inventory.close()
+
+    def _remove_registry_mirrors(self, conn, removed_mirrors):
+        """
+        Points the nodes pulling images from the registry mirrors with IPs in
+        removed_mirrors back to the controller's registry, before the mirrors are
+        removed
+        """
+        mirrors = [ ip for ip in self._get_cluster_info().get('registry_mirrors') or []
+                    if ip not in removed_mirrors ]
+        self._set_cluster_info({'registry_mirrors': mirrors})
+
+        node_prefix = defaults.node_name_format.format(self.cluster_name, '')
+        remaining = [ i.private_ip_address for i in self._get_instances(self.cluster_name, conn)
+                      if i.tags.get('Name', '').startswith(node_prefix) and i.state == 'running'
+                      and i.private_ip_address not in removed_mirrors ]
+        if not remaining:
+            return
+
+        self._logger.debug('Removing {0} registry mirrors'.format(len(removed_mirrors)))
+        nodes_inventory = tempfile.NamedTemporaryFile()
+        self._write_to_hosts_file(nodes_inventory.name, remaining, 'nodes', overwrite=True)
+        nodes_inventory.flush()
+        self._run_on_controller('repoint_registry.yml', nodes_inventory.name, self._get_registry_vars())
+        nodes_inventory.close()
+
+
     def _delete_cluster_info(self):
-        files = [defaults.cluster_info_file, defaults.current_nat_ip_file,
-                 defaults.cached_cluster_file_path, defaults.cached_environment_file_path]
-        for f in files:
-            full = os.path.expanduser(f)
-            if os.path.isfile(full):
-                os.remove(full)
-
-        dirs = [defaults.local_session_data_dir, defaults.local_environment_dir]
-        for d in dirs:
-            full = os.path.expanduser(d)
-            if os.path.exists(full):
-                shutil.rmtree(full)
+        # Other clusters' tunnels share the session dir, so only remove this cluster's sockets
+        nat_ip = self._get_nat_ip()
+        statestore.get_store().delete_cluster(self.cluster_name)
+        if nat_ip:
+            bastion.close(nat_ip)
+            for sock in glob.glob('{0}/*_tunnel_{1}_*.sock'.format(
+                                  os.path.expanduser(defaults.local_session_data_dir), nat_ip)):
+                os.remove(sock)
+
+        cluster_dir = self._local_path()
+        if os.path.exists(cluster_dir):
+            shutil.rmtree(cluster_dir)
 
         return True
 
@@ -1209,7 +1781,8 @@ class AWSCluster(Cluster):
             num_terminated = len(conn.get_only_instances(instance_ids=instance_ids, filters=term_filter))
             return num_terminated == num_instances
 
-        success = retry_till_true(instances_terminated, 2)
+        success = waiter.wait_until('instances-terminated', instances_terminated,
+                                    defaults.instance_terminate_timeout, initial=2)
         if not success:
             self._logger.error('Timeout while trying to terminate instances in {0}'.format(self.cluster_name))
             return False
@@ -1218,7 +1791,7 @@ class AWSCluster(Cluster):
 
         return True
 
-    def terminate_cluster(self, leave_shared_volume, force_delete_shared_volume):
+    def terminate_cluster(self, leave_shared_volume, force_delete_shared_volume, snapshot_shared_volume=False):
         # Connect to EC2 services
         conn = boto.ec2.connect_to_region(self._config['region'],
                     aws_access_key_id=self._config['access_key_id'],
@@ -1232,128 +1805,153 @@ class AWSCluster(Cluster):
         if not (conn or vpc_conn):
             raise ClusterException('Cannot connect to AWS')
         
-        resource_terminated = False
         instance_list = self._get_instances(self.cluster_name, connection=conn)
         
-        # Get shared volume ID
-        shared_volume = None
+        # Get shared volume(s), more than one if striped
+        shared_volumes = []
         byo_volume = False
         for i in instance_list:
-            if i.tags.get(defaults.instance_node_type_tag_key) == defaults.controller_name_tag_value:
+            # The shared volume is on the storage node if there is one, otherwise on the controller
+            if i.tags.get(defaults.instance_node_type_tag_key) in (defaults.controller_name_tag_value,
+                                                                  defaults.storage_name_tag_value):
                 volumes = conn.get_all_volumes(filters={'attachment.instance-id': [i.id]})
                 for v in volumes:
                     if v.tags.get('Attached'):
-                        shared_volume = v
+                        shared_volumes = [v]
                         byo_volume = True
-                    elif v.tags.get(defaults.instance_tag_key):
-                        shared_volume = v
-
-        # Delete instances
-        num_instances = len(instance_list)
-        instances = [ i.id for i in instance_list ]
-        if instances:
-            resource_terminated = True
-            self._logger.info('Terminating {0} instances'.format(num_instances))
+                    elif v.tags.get(defaults.instance_tag_key) and not byo_volume:
+                        shared_volumes.append(v)
+        if snapshot_shared_volume and len(shared_volumes) > 1:
+            raise ClusterException('The shared volume is striped across {0} volumes and cannot be snapshotted'.format(
+                                    len(shared_volumes)))
+
+        # Delete instances, including any stopped warm pool nodes
+        instance_list.extend(self._get_warm_pool_instances(conn))
+        cluster_filter = {'tag:{0}'.format(defaults.instance_tag_key): self.cluster_name}
+        vpcs = vpc_conn.get_all_vpcs(filters=cluster_filter)
+
+        def terminate_instances():
+            instances = [ i.id for i in instance_list ]
+            if not instances:
+                return False
+            self._logger.info('Terminating {0} instances'.format(len(instances)))
             self._terminate_instances_and_wait(conn, instances)
+            return True
 
         # Delete shared volume
-        if shared_volume:
-            if byo_volume:
-                if force_delete_shared_volume:
-                    if shared_volume.delete():
-                        self._logger.info('Shared volume "{0}" has been deleted'.format(shared_volume.id))
+        def delete_shared_volume():
+            # Snapshot once the instances are terminated, so that the filesystem is consistent.
+            # The volume can be deleted as soon as the snapshot has started
+            if snapshot_shared_volume and shared_volumes:
+                snapshot = shared_volumes[0].create_snapshot('Clusterous shared volume of {0}'.format(self.cluster_name))
+                conn.create_tags([snapshot.id], {'Name': defaults.shared_volume_snapshot_name_format.format(self.cluster_name),
+                                                 defaults.instance_tag_key: self.cluster_name})
+                self._logger.info('Shared volume snapshot "{0}" has been started'.format(snapshot.id))
+            if leave_shared_volume and len(shared_volumes) > 1:
+                self._logger.warning('The shared volume is striped across {0} volumes, '
+                                     'which cannot be reused with "shared_volume_id"'.format(len(shared_volumes)))
+            for shared_volume in shared_volumes:
+                if byo_volume:
+                    if force_delete_shared_volume:
+                        if shared_volume.delete():
+                            self._logger.info('Shared volume "{0}" has been deleted'.format(shared_volume.id))
+                        else:
+                            self._logger.error('Unable to delete volume in {0}: {1}'.format(self.cluster_name, shared_volume.id))
                     else:
-                        self._logger.error('Unable to delete volume in {0}: {1}'.format(self.cluster_name, shared_volume.id))
-                else:
-                    shared_volume.remove_tags({'Attached': self.cluster_name})
-                    self._logger.info('Leaving shared volume "{0}"'.format(shared_volume.id))
-            else:
-                if leave_shared_volume:
-                    self._logger.info('Leaving shared volume "{0}"'.format(shared_volume.id))
+                        shared_volume.remove_tags({'Attached': self.cluster_name})
+                        self._logger.info('Leaving shared volume "{0}"'.format(shared_volume.id))
                 else:
-                    if shared_volume.delete():
-                        self._logger.debug('Shared volume "{0}" has been deleted'.format(shared_volume.id))
+                    if leave_shared_volume:
+                        self._logger.info('Leaving shared volume "{0}"'.format(shared_volume.id))
                     else:
-                        self._logger.error('Unable to delete volume in {0}: {1}'.format(self.cluster_name, shared_volume.id))
+                        if shared_volume.delete():
+                            self._logger.debug('Shared volume "{0}" has been deleted'.format(shared_volume.id))
+                        else:
+                            self._logger.error('Unable to delete volume in {0}: {1}'.format(self.cluster_name, shared_volume.id))
+            return False
+
+        # Delete placement groups
+        def delete_placement_groups():
+            self._delete_placement_groups(conn)
+            return False
 
         # Delete security group
-        sg = conn.get_all_security_groups(filters={'tag:Name':'{0}-public-sg'.format(self.cluster_name),
-                                                   'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name})
-        private_sg = conn.get_all_security_groups(filters={
-                                                           'tag:Name':'{0}-private-sg'.format(self.cluster_name),
-                                                           'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name})
-        for g in private_sg:
-            sg.append(g)
-
-        sg_deleted = [ g.delete() for g in sg ]
-        if False in sg_deleted:
-            self._logger.error('Unable to delete security group for {0}'.format(self.cluster_name))
-        else:
-            self._logger.debug('Deleted security group')
+        def delete_security_groups():
+            sg = conn.get_all_security_groups(filters={'tag:Name':'{0}-public-sg'.format(self.cluster_name),
+                                                       'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name})
+            private_sg = conn.get_all_security_groups(filters={
+                                                               'tag:Name':'{0}-private-sg'.format(self.cluster_name),
+                                                               'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name})
+            for g in private_sg:
+                sg.append(g)
+
+            sg_deleted = [ g.delete() for g in sg ]
+            if False in sg_deleted:
+                self._logger.error('Unable to delete security group for {0}'.format(self.cluster_name))
+            else:
+                self._logger.debug('Deleted security group')
+            return False
 
         # Delete subnets
-        subnet_deleted = True
-        for i in vpc_conn.get_all_subnets(filters={'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name}):
-            if not vpc_conn.delete_subnet(i.id):
-                subnet_deleted = False
-                break
-        if not subnet_deleted:
-            self._logger.error('Unable to delete subnets for {0}'.format(self.cluster_name))
-        else:
-            resource_terminated = True
+        def delete_subnets():
+            for i in vpc_conn.get_all_subnets(filters=cluster_filter):
+                if not vpc_conn.delete_subnet(i.id):
+                    self._logger.error('Unable to delete subnets for {0}'.format(self.cluster_name))
+                    return False
             self._logger.debug('Deleted subnets')
+            return True
 
         # Delete route tables
-        rt_deleted = True
-        for i in vpc_conn.get_all_route_tables(filters={'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name}):
-            if not vpc_conn.delete_route_table(i.id):
-                rt_deleted = False
-                break
-        if not rt_deleted:
-            self._logger.error('Unable to delete Route Tables for {0}'.format(self.cluster_name))
-        else:
-            resource_terminated = True
+        def delete_route_tables():
+            for i in vpc_conn.get_all_route_tables(filters=cluster_filter):
+                if not vpc_conn.delete_route_table(i.id):
+                    self._logger.error('Unable to delete Route Tables for {0}'.format(self.cluster_name))
+                    return False
             self._logger.debug('Deleted Route Tables')
+            return True
 
-        # If VPC was created
-        vpcs = vpc_conn.get_all_vpcs(filters={'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name})
-        if vpcs:
-            vpc = vpcs[0]
-            gw_deleted = True
-            for i in vpc_conn.get_all_internet_gateways(filters={'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name}):
-                vpc_conn.detach_internet_gateway(internet_gateway_id = i.id, vpc_id = vpc.id) 
+        def delete_gateways():
+            for i in vpc_conn.get_all_internet_gateways(filters=cluster_filter):
+                vpc_conn.detach_internet_gateway(internet_gateway_id = i.id, vpc_id = vpcs[0].id) 
                 if not vpc_conn.delete_internet_gateway(i.id):
-                    gw_deleted = False
-                    break
-            if not gw_deleted:
-                self._logger.error('Unable to delete Gateway for {0}'.format(self.cluster_name))
-            else:
-                resource_terminated = True
-                self._logger.debug('Deleted Gateway')
+                    self._logger.error('Unable to delete Gateway for {0}'.format(self.cluster_name))
+                    return False
+            self._logger.debug('Deleted Gateway')
+            return True
 
-            # Delete ACL
-            acl_deleted = True
-            for i in vpc_conn.get_all_network_acls(filters={'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name}):
+        # Delete ACL
+        def delete_acls():
+            for i in vpc_conn.get_all_network_acls(filters=cluster_filter):
                 if not vpc_conn.delete_network_acl(i.id):
-                    acl_deleted = False
-                    break
-            if not acl_deleted:
-                self._logger.error('Unable to delete ACL for {0}'.format(self.cluster_name))
-            else:
-                resource_terminated = True
-                self._logger.debug('Deleted ACL')
+                    self._logger.error('Unable to delete ACL for {0}'.format(self.cluster_name))
+                    return False
+            self._logger.debug('Deleted ACL')
+            return True
 
-            # Delete VPC
-            vpc_deleted = True
-            for i in vpc_conn.get_all_vpcs(filters={'tag:{0}'.format(defaults.instance_tag_key):self.cluster_name}):
+        # Delete VPC
+        def delete_vpcs():
+            for i in vpc_conn.get_all_vpcs(filters=cluster_filter):
                 if not vpc_conn.delete_vpc(i.id):
-                    vpc_deleted = False
-                    break
-            if not vpc_deleted:
-                self._logger.error('Unable to delete VPC for {0}'.format(self.cluster_name))
-            else:
-                resource_terminated = True
-                self._logger.debug('Deleted VPC')
+                    self._logger.error('Unable to delete VPC for {0}'.format(self.cluster_name))
+                    return False
+            self._logger.debug('Deleted VPC')
+            return True
+
+        # Resources are deleted as soon as whatever depends on them is gone
+        graph = taskgraph.TaskGraph()
+        graph.add('terminate-instances', terminate_instances)
+        graph.add('delete-shared-volume', delete_shared_volume, requires=['terminate-instances'])
+        graph.add('delete-placement-groups', delete_placement_groups, requires=['terminate-instances'])
+        graph.add('delete-security-groups', delete_security_groups, requires=['terminate-instances'])
+        graph.add('delete-subnets', delete_subnets, requires=['terminate-instances'])
+        graph.add('delete-route-tables', delete_route_tables, requires=['delete-subnets'])
+        # If VPC was created
+        if vpcs:
+            graph.add('delete-gateways', delete_gateways, requires=['terminate-instances'])
+            graph.add('delete-acls', delete_acls, requires=['delete-subnets'])
+            graph.add('delete-vpc', delete_vpcs, requires=['delete-security-groups', 'delete-route-tables',
+                                                           'delete-gateways', 'delete-acls'])
+        resource_terminated = any(graph.run().values())
 
         # Delete cluster info
         if not resource_terminated:
@@ -1364,9 +1962,11 @@ class AWSCluster(Cluster):
         return True
 
 
-    def docker_build_image(self, full_path, image_name):
+    def docker_build_image(self, full_path, image_name, build_id=None):
         """
-        Create a new docker image
+        Create a new docker image on the controller. If build_id is given, only
+        copies the build context and build script to the shared volume, for
+        building on a node with build_image.sh (see docker_build_command)
         """
 
         vars_dict = {
@@ -1374,6 +1974,10 @@ class AWSCluster(Cluster):
                 'dockerfile_path': os.path.dirname(full_path),
                 'dockerfile_folder': os.path.basename(full_path),
                 'image_name': image_name,
+                'build_on_controller': build_id is None,
+                'build_id': build_id or '',
+                'build_output_dir': defaults.build_output_dir,
+                'build_script': get_script('build_image.sh')
                 }
 
         if not os.path.isdir(full_path):
@@ -1384,20 +1988,78 @@ class AWSCluster(Cluster):
             self._logger.error("Folder '{0}' does not have a Dockerfile".format(full_path))
             return False
 
+        # Copy only what .dockerignore leaves of the build context
+        context_filter = tempfile.NamedTemporaryFile()
+        num_paths = dockerignore.write_rsync_filter(full_path, context_filter)
+        self._logger.debug('Build context of {0} has {1} files and directories'.format(image_name, num_paths))
+        vars_dict['context_filter_file'] = context_filter.name
+        vars_dict['cache_image'] = self._build_cache_image(image_name)
+
         vars_file = self._make_vars_file(vars_dict)
-        self._logger.info('Started building docker image {0}'.format(image_name))
+        if build_id is None:
+            self._logger.info('Started building docker image {0}'.format(image_name))
         AnsibleHelper.run_playbook(defaults.get_script('ansible/docker_01_build_image.yml'),
                                    vars_file.name,
                                    self._config['key_file'],
                                    env=self._ansible_env_credentials(),
-                                   hosts_file=os.path.expanduser(defaults.current_nat_ip_file))
+                                   hosts_file=self._controller_inventory())
         vars_file.close()
-        self._logger.info('Finished building docker image')
+        context_filter.close()
+        if build_id is None:
+            self._logger.info('Finished building docker image')
         return True
 
+    def _build_cache_image(self, image_name):
+        return defaults.build_cache_image_format.format(image_name.split(':', 1)[0])
+
+    def docker_build_command(self, full_path, image_name, build_id):
+        """
+        Returns shell command building image_name on a node from the build context
+        copied by docker_build_image(full_path, image_name, build_id)
+        """
+        return 'sh {0}/build_image.sh {1} {2} {3} {4}'.format(
+                    defaults.build_output_dir,
+                    pipes.quote('{0}/{1}'.format(defaults.build_context_dir, os.path.basename(full_path))),
+                    pipes.quote('registry:5000/{0}'.format(image_name)),
+                    pipes.quote(self._build_cache_image(image_name)),
+                    pipes.quote('{0}/{1}'.format(defaults.build_output_dir, build_id)))
+
+    def docker_build_status(self, build_id):
+        """
+        Returns exit status (as a string) of the build on a node with build_id, or
+        None if it has not finished
+        """
+        ssh = self._ssh_to_controller()
+        try:
+            stdin, stdout, stderr = ssh.exec_command('cat {0}/{1}.status 2> /dev/null'.format(
+                                                     defaults.build_output_dir, build_id))
+            status = stdout.read().strip()
+        finally:
+            ssh.close()
+        return status or None
+
+    def docker_build_log(self, build_id, lines=defaults.build_log_lines):
+        """
+        Returns the last lines of the output of the build on a node with build_id
+        """
+        ssh = self._ssh_to_controller()
+        try:
+            stdin, stdout, stderr = ssh.exec_command('tail -n {0} {1}/{2}.log 2> /dev/null'.format(
+                                                     lines, defaults.build_output_dir, build_id))
+            return stdout.read()
+        finally:
+            ssh.close()
+
+    def get_registry_mirrors(self):
+        """
+        Returns list of IPs of the nodes running registry mirrors
+        """
+        return list(self._get_cluster_info().get('registry_mirrors') or [])
+
     def docker_image_info(self, image_name_str):
         """
-        Gets information of a Docker image
+        Gets information of a Docker image in the private registry, from its manifest
+        and image configuration (v2 registry API)
         """
         if ':' in image_name_str:
             image_name, tag_name = image_name_str.split(':', 1)
@@ -1405,29 +2067,116 @@ class AWSCluster(Cluster):
             image_name = image_name_str
             tag_name = 'latest'
 
-        image_info = {}
         # TODO: rewrite to use make HTTP calls directly
         ssh = self._ssh_to_controller()
+        try:
+            cmd = "curl -s -H 'Accept: {0}' registry:5000/v2/{1}/manifests/{2}".format(
+                    defaults.docker_manifest_type, image_name, tag_name)
+            stdin, stdout, stderr = ssh.exec_command(cmd)
+            try:
+                manifest = json.loads(stdout.read())
+            except ValueError:
+                return None
+            if manifest.get('errors'):
+                # e.g. MANIFEST_UNKNOWN or NAME_UNKNOWN
+                return None
+
+            if manifest.get('schemaVersion') == 1:
+                # Pushed by an older Docker, image configuration is in the manifest
+                config = json.loads(manifest['history'][0]['v1Compatibility'])
+                image_id = config.get('id', '')
+            else:
+                image_id = manifest['config']['digest']
+                cmd = 'curl -s registry:5000/v2/{0}/blobs/{1}'.format(image_name, image_id)
+                stdin, stdout, stderr = ssh.exec_command(cmd)
+                config = json.loads(stdout.read())
+        finally:
+            ssh.close()
 
-        # get image_id
-        cmd = 'curl registry:5000/v1/repositories/library/{0}/tags/{1}'.format(image_name, tag_name)
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        image_id = stdout.read().replace('"','')
-        if 'Tag not found' in image_id:
-            return None
-
-        # get image_info
-        cmd = 'curl registry:5000/v1/images/{0}/json'.format(image_id)
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        json_results = json.loads(stdout.read())
         image_info = { 'image_name': image_name,
                        'tag_name': tag_name,
                        'image_id': image_id,
-                       'author': json_results.get('author',''),
-                       'created': json_results.get('created','')
+                       'author': config.get('author',''),
+                       'created': config.get('created','')
                        }
         return image_info
 
+    def _registry_head(self, ssh, url, headers={}):
+        """
+        Makes a HEAD request to url from the controller, returns status code and
+        dictionary of response headers (with lowercase names)
+        """
+        cmd = 'curl -sI --max-time {0} {1} {2}'.format(defaults.http_request_timeout,
+                ' '.join( '-H {0}'.format(pipes.quote('{0}: {1}'.format(k, v))) for k, v in headers.iteritems() ),
+                pipes.quote(url))
+        stdin, stdout, stderr = ssh.exec_command(cmd)
+        status = 0
+        response_headers = {}
+        for line in stdout.read().splitlines():
+            if line.startswith('HTTP/'):
+                status = int(line.split()[1])
+                response_headers = {}
+            elif ':' in line:
+                name, value = line.split(':', 1)
+                response_headers[name.strip().lower()] = value.strip()
+        return status, response_headers
+
+    def docker_image_digest(self, image):
+        """
+        Resolves the tag of image (a name as given to "docker run") to the digest of
+        its manifest, using the v2 registry API from the controller, which can reach
+        the private registry. Returns the image referenced by digest, e.g.
+        registry:5000/name@sha256:..., or None if the registry does not provide a
+        digest (e.g. it only supports the v1 API)
+        """
+        if '@' in image:
+            return image
+        name, tag = image, 'latest'
+        if ':' in image.rsplit('/', 1)[-1]:
+            name, tag = image.rsplit(':', 1)
+
+        parts = name.split('/', 1)
+        if len(parts) == 2 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+            registry, repository = parts
+        else:
+            registry, repository = None, name
+        if registry == defaults.private_registry:
+            base_url = 'http://{0}'.format(registry)
+        elif registry in (None, 'docker.io', 'index.docker.io'):
+            base_url = defaults.docker_hub_registry_url
+            if '/' not in repository:
+                repository = 'library/{0}'.format(repository)
+        else:
+            base_url = 'https://{0}'.format(registry)
+
+        url = '{0}/v2/{1}/manifests/{2}'.format(base_url, repository, tag)
+        headers = {'Accept': defaults.docker_manifest_type}
+        ssh = self._ssh_to_controller()
+        try:
+            status, response_headers = self._registry_head(ssh, url, headers)
+            challenge = response_headers.get('www-authenticate', '')
+            if status == 401 and challenge.startswith('Bearer '):
+                # Anonymous token for pulling, e.g. from Docker Hub
+                params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+                token_url = '{0}?service={1}&scope={2}'.format(params.get('realm', ''), params.get('service', ''),
+                                                               params.get('scope', ''))
+                stdin, stdout, stderr = ssh.exec_command('curl -s --max-time {0} {1}'.format(
+                                                         defaults.http_request_timeout, pipes.quote(token_url)))
+                try:
+                    token_info = json.loads(stdout.read())
+                except ValueError:
+                    return None
+                headers['Authorization'] = 'Bearer {0}'.format(token_info.get('token') or
+                                                               token_info.get('access_token', ''))
+                status, response_headers = self._registry_head(ssh, url, headers)
+        finally:
+            ssh.close()
+
+        digest = response_headers.get('docker-content-digest')
+        if status != 200 or not digest:
+            return None
+        return '{0}@{1}'.format(name, digest)
+
     def sync_put(self, local_path, remote_path):
         """
         Sync local folder to the cluster
@@ -1449,7 +2198,7 @@ class AWSCluster(Cluster):
                                    vars_file.name,
                                    self._config['key_file'],
                                    env=self._ansible_env_credentials(),
-                                   hosts_file=os.path.expanduser(defaults.current_nat_ip_file))
+                                   hosts_file=self._controller_inventory())
         vars_file.close()
         self._logger.debug('Finished sync folder')
         return (True, '')
@@ -1489,7 +2238,7 @@ class AWSCluster(Cluster):
                                    vars_file.name,
                                    self._config['key_file'],
                                    env=self._ansible_env_credentials(),
-                                   hosts_file=os.path.expanduser(defaults.current_nat_ip_file))
+                                   hosts_file=self._controller_inventory())
         vars_file.close()
         self._logger.debug('Finished sync folder')
         return (True, '')
@@ -1537,27 +2286,26 @@ class AWSCluster(Cluster):
         return (True, '')
 
 
-    def workon(self):
+    def workon(self, make_working=True):
         """
-        Sets a working cluster
+        Fetches local info about this cluster and, if make_working is True, sets it
+        as the working cluster
         """
         # Getting cluster info
-        instances = self._get_instances(self.cluster_name)
-        nat_ip = None
-        cluster_name = None
-        for instance in instances:
-            if defaults.nat_name_format.format(self.cluster_name) in instance.tags['Name']:
-                nat_ip = instance.ip_address
-                cluster_name = self.cluster_name
-
-        if not nat_ip:
+        endpoints = self._get_endpoints(refresh=True)
+        nat_ip = endpoints['nat']
+        controller_ip = endpoints['controller']
+        cluster_name = self.cluster_name
+        if not nat_ip or not controller_ip:
             return False
 
         self._create_config_dirs()
-        # Write nat_ip
-        self._set_cluster_info({'nat_ip': nat_ip, 'cluster_name': cluster_name, 'running': True})
-        ip_file = os.path.expanduser(defaults.current_nat_ip_file)
-        self._write_to_hosts_file(ip_file, ['{0}:{1}'.format(nat_ip, defaults.nat_ssh_port_forwarding)], 'controller', overwrite=True)
+        # Write nat_ip and controller_ip
+        self._set_cluster_info({'nat_ip': nat_ip, 'controller_ip': controller_ip,
+                                'cluster_name': cluster_name, 'running': True})
+        if make_working:
+            statestore.get_store().set_working_cluster(cluster_name)
+        self._write_controller_inventory(nat_ip, controller_ip)
 
         # Sync from controller
         self._copy_environment_from_controller()
@@ -1573,9 +2321,12 @@ class AWSCluster(Cluster):
         nodes_info = {}
         controller_info = {}
         central_logging_info = {}
+        storage_info = {}
         nat_info = {}
         instances = self._get_instances(self.cluster_name)
 
+        instances = [ i for i in instances if defaults.warm_pool_tag_key not in i.tags ]
+
         for instance in instances:
             node_name = instance.tags[defaults.instance_node_type_tag_key]
             if node_name == defaults.controller_name_tag_value:
@@ -1587,7 +2338,8 @@ class AWSCluster(Cluster):
                 uptime = (datetime.now(launch_time.tzinfo) - launch_time).total_seconds()
                 controller_info = {
                                     'type': instance.instance_type,
-                                    'uptime': int(uptime)
+                                    'uptime': int(uptime),
+                                    'ip': instance.private_ip_address
                 }
             elif node_name == defaults.central_logging_name_tag_value:
                 if central_logging_info:     # Shouldn't happen
@@ -1596,6 +2348,11 @@ class AWSCluster(Cluster):
                 central_logging_info = {
                                     'type': instance.instance_type
                 }
+            elif node_name == defaults.storage_name_tag_value:
+                storage_info = {
+                                'type': instance.instance_type,
+                                'ip': instance.private_ip_address
+                }
             elif node_name == defaults.nat_name_tag_value:
                 nat_info = {
                             'ip': str(instance.ip_address),
@@ -1616,6 +2373,7 @@ class AWSCluster(Cluster):
                 'nodes': nodes_info,
                 'controller': controller_info,
                 'central_logging': central_logging_info,
+                'storage': storage_info,
                 'nat': nat_info
         }
 
@@ -1639,80 +2397,36 @@ class AWSCluster(Cluster):
                       'used_percent': volume_info[4],
                       'free': volume_info[3]
                     }
+            # Configuration of the volume, as recorded at cluster creation
+            cluster_info = self._get_cluster_info()
+            for key in ['type', 'iops', 'throughput', 'stripes']:
+                info[key] = cluster_info.get('shared_volume_' + key)
         return info
 
 
-    def connect_to_container(self, component_name):
+    def connect_to_container(self, component_name, host, task_id):
         '''
-        Connects to a docker container and gets an interactive shell
+        Connects to the docker container running Mesos task task_id on host (as
+        reported by Marathon) and gets an interactive shell
         '''
-        key_file_local = os.path.expanduser(self._config['key_file'])
-        key_file_remote = '{0}/{1}/{2}'.format(defaults.cluster_user_home_dir,
-                                        defaults.remote_host_scripts_dir, defaults.remote_host_key_file)
-        container_id_script_local = defaults.get_script(defaults.container_id_script_file)
-        container_id_script_remote = '{0}/{1}/{2}'.format(defaults.cluster_user_home_dir, defaults.remote_host_scripts_dir,defaults.container_id_script_file)
-        container_id_script_node = '/tmp/{0}'.format(defaults.container_id_script_file)
-        node = '{0}.marathon.mesos'.format(component_name)
-
-        # SSH controller
-        with self._ssh_to_controller() as ssh:
-            self._logger.info("Connecting to '{0}' component".format(component_name))
-            # Copy files to controller
-            sftp = ssh.open_sftp()
-            sftp.put(key_file_local, key_file_remote)
-            sftp.put(container_id_script_local, container_id_script_remote)
-            sftp.chmod(key_file_remote, stat.S_IRUSR | stat.S_IWUSR)
-            sftp.close()
-
-            def _retry(cmd):
-                retry = 0
-                while retry < 3:
-                    stdin, stdout, stderr = ssh.exec_command(cmd)
-                    if not stderr.readlines():
-                        break
-                    retry += 1
-                    self._logger.debug('Retry: {0}'.format(retry))
-                    time.sleep(3)
-                return (retry < 3 ), stdout
-
-            # Copy script to node
-            cmd='scp -i {0} -oStrictHostKeyChecking=no {1} {2}:{3}'.format(key_file_remote,
-                                                                           container_id_script_remote, node, container_id_script_node)
-            success, stdout = _retry(cmd)
-            if not success:
-                self._logger.debug("Failed to copy scripts to controller")
-                message = "Failed to connect to '{0}' component, try later".format(component_name)
-                return (False, message)
-
-            # Get container id
-            cmd='ssh -i {0} -oStrictHostKeyChecking=no {1} source {2} {3}'.format(key_file_remote,
-                                                                                  node, container_id_script_node, component_name)
-
-            success, stdout = _retry(cmd)
-            if not success:
-                self._logger.debug("Failed to get container id for '{0}' component".format(component_name))
-                message = "Failed to connect to '{0}' component, try later".format(component_name)
-                return (False, message)
-
-            container_id = stdout.readline().replace('\n','')
-
-        # Shell
-        node = '{0}.marathon.mesos'.format(component_name)
-
-        cmd='ssh -i {0} -p {1} -oStrictHostKeyChecking=no -A -t {2}@{3} \
-             ssh -i {4} -oStrictHostKeyChecking=no -A -t {5} \
-             sudo docker exec -ti {6} bash'.format(key_file_local, defaults.nat_ssh_port_forwarding,
-                         defaults.cluster_username, self._get_nat_ip(), key_file_remote, node, container_id)
-        os.system(cmd)
-
-        # Remove keys
-        with self._ssh_to_controller() as ssh:
-            cmd='rm -fr {0}'.format(key_file_remote)
-            success, stdout = _retry(cmd)
-            if not success:
-                message = 'Failed to remove keys from controller'
-                self._logger.debug(message)
-                return (False, message)
+        # Exit status of the remote command if the container is not (yet) running
+        not_found_status = 100
+        # Marathon sets MESOS_TASK_ID in the environment of each container it launches
+        task_env = pipes.quote(' MESOS_TASK_ID={0} '.format(task_id))
+        cmd = ("id=$(sudo docker inspect --format '{{{{.Id}}}} {{{{range .Config.Env}}}}{{{{.}}}} {{{{end}}}}' "
+               "$(sudo docker ps -q) 2>/dev/null | grep -F {0} | cut -d ' ' -f 1) && [ -n \"$id\" ] && "
+               "exec sudo docker exec -ti $id bash; exit {1}").format(task_env, not_found_status)
+
+        self._logger.info("Connecting to '{0}' component".format(component_name))
+        try:
+            status = self._bastion().shell(host, defaults.cluster_username, cmd)
+        except (paramiko.SSHException, socket.error) as e:
+            self._logger.debug('Failed to connect to {0}: {1}'.format(host, e))
+            status = not_found_status
+
+        if status == not_found_status:
+            message = "Failed to connect to '{0}' component, try later".format(component_name)
+            return (False, message)
 
         return (True, '')
 
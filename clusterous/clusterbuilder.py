@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import cluster
+import defaults
 import logging
 import tempfile
 import yaml
@@ -30,18 +31,22 @@ class ClusterBuilder(object):
 
 
     def create_cluster(self, cluster_name, cluster_spec, logging_system_level=0,
-                        shared_volume_size=None, controller_instance_type=None, shared_volume_id=None):
+                        shared_volume_size=None, controller_instance_type=None, shared_volume_id=None,
+                        shared_volume_options=None):
         if self._started:
             return False
 
         self._logger.debug('Cluster params={0}'.format(cluster_spec))
         nodes_info = []
         for name, params in cluster_spec.iteritems():
-            nodes_info.append((params['count'], params['type'], name))
+            # The storage node is launched separately, and is not a Mesos node
+            if params.get('role') != defaults.storage_role:
+                nodes_info.append((params['count'], params['type'], name))
 
         try:
             self._cluster.init_cluster(cluster_name, cluster_spec, nodes_info, logging_system_level,
-                                        shared_volume_size, controller_instance_type, shared_volume_id)
+                                        shared_volume_size, controller_instance_type, shared_volume_id,
+                                        shared_volume_options)
             self._started = True
         except cluster.ClusterException as e:
             self._logger.error(e)
@@ -94,7 +99,7 @@ class ClusterBuilder(object):
         except KeyError as e:
             raise ValueError('Cannot find instance type for "{0}" in cluster spec'.format(actual_node_name))
 
-        success = self._cluster.add_nodes(num_nodes, instance_type, actual_node_name)
+        success = self._cluster.add_nodes(num_nodes, instance_type, actual_node_name, spec[actual_node_name])
 
         if success:
             self._logger.info('{0} nodes of type "{1}" added'.format(num_nodes, actual_node_name))
@@ -115,7 +120,7 @@ class ClusterBuilder(object):
         except KeyError as e:
             raise ValueError('Cannot find instance type for "{0}" in cluster spec'.format(actual_node_name))
 
-        num_removed = self._cluster.rm_nodes(num_nodes, actual_node_name)
+        num_removed = self._cluster.rm_nodes(num_nodes, actual_node_name, spec[actual_node_name])
 
         if num_removed < 0:
             message = 'An error occured when removing nodes'
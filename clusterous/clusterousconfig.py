@@ -20,6 +20,10 @@ import time
 import yaml
 import re
 
+import awsmiddleware
+import defaults
+import waiter
+
 default_config_file = '~/.clusterous.yml'
 
 class ConfigError(Exception):
@@ -202,7 +206,7 @@ class AWSConfig(ClusterousConfig):
     @staticmethod
     def validate_access_keys(access_key_id, secret_access_key):
         # Perform a test connection with ec2 in ap-southeast-2 to check if keys are valid
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
                                         region_name='ap-southeast-2')
 
         client = session.client('ec2')
@@ -221,7 +225,7 @@ class AWSConfig(ClusterousConfig):
 
     @staticmethod
     def get_available_vpcs(access_key_id, secret_access_key, region):
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
                                         region_name=region)
         client = session.client('ec2')
 
@@ -246,7 +250,7 @@ class AWSConfig(ClusterousConfig):
 
     @staticmethod
     def create_new_vpc(access_key_id, secret_access_key, region, vpc_name):
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
                                         region_name=region)
         client = session.client('ec2')
 
@@ -256,15 +260,9 @@ class AWSConfig(ClusterousConfig):
             # Create VPC and wait till available
             res = client.create_vpc(CidrBlock='10.144.0.0/16')
             vpc_id = res['Vpc']['VpcId']
-            max_tries = 10
-            count = 0
-            available = False
-            while not available and count < max_tries:
-                count +=1
-                state = client.describe_vpcs(VpcIds=[vpc_id])
-                available = True if state['Vpcs'][0]['State'] == 'available' else False
-                if not available:
-                    time.sleep(2)
+            waiter.wait_until('vpc-available',
+                              lambda: client.describe_vpcs(VpcIds=[vpc_id])['Vpcs'][0]['State'] == 'available',
+                              defaults.vpc_available_timeout)
             # VPC should now be available, tag it
             client.create_tags(Resources=[vpc_id], Tags=tags)
             # Set EnableDnsHostnames to true (default is false)
@@ -286,7 +284,7 @@ class AWSConfig(ClusterousConfig):
 
     @staticmethod
     def validate_vpc_attribute(access_key_id, secret_access_key, region, vpc_id):
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
                                         region_name=region)
         ec2 = session.resource('ec2')
 
@@ -305,7 +303,7 @@ class AWSConfig(ClusterousConfig):
 
     @staticmethod
     def get_all_key_pairs(access_key_id, secret_access_key, region):
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
                                         region_name=region)
         client = session.client('ec2')
 
@@ -347,7 +345,7 @@ class AWSConfig(ClusterousConfig):
         if key_pair_name in existing:
             return False, 'A Key Pair with name "{0}" already exists'.format(key_pair_name), None
 
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key,
                                         region_name=region)
         client = session.client('ec2')        
 
@@ -388,7 +386,7 @@ class AWSConfig(ClusterousConfig):
 
     @staticmethod
     def get_all_buckets(access_key_id, secret_access_key):
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
 
         client = session.client('s3')
 
@@ -436,7 +434,7 @@ class AWSConfig(ClusterousConfig):
         if not success:
             return False, message
 
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
         client = session.client('s3')
 
         try:
@@ -454,7 +452,7 @@ class AWSConfig(ClusterousConfig):
         """
         Check if bucket exists and user has adequate permissions to use bucket
         """
-        session = boto3.session.Session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+        session = awsmiddleware.session(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
         client = session.client('s3')
         try:
             client.head_bucket(Bucket=bucket_name)
@@ -18,6 +18,7 @@ import sys
 import logging
 import logging.config
 import re
+from concurrent import futures
 
 import boto
 
@@ -30,6 +31,10 @@ import clusterousconfig
 
 import environment
 import helpers
+import statestore
+import taskgraph
+import tracing
+import awsmiddleware
 from helpers import SchemaEntry
 
 
@@ -58,16 +63,23 @@ class Clusterous(object):
     Clusterous application
     """
 
-    def __init__(self, config, config_type):
+    def __init__(self, config, config_type, cluster_name=None):
+        """
+        If cluster_name is given, commands operate on that cluster instead of the working cluster
+        """
         self.clusters = []
         self._config = {}
         self._cluster_class = None
+        self._cluster_name = cluster_name
 
         self._logger = logging.getLogger(__name__)
 
         self._config = config
         self._cluster_class = cluster.get_cluster_class(config_type)
 
+        # Rate limit, retry and account for all AWS calls
+        awsmiddleware.get_middleware()
+
         conf_dir = os.path.expanduser(defaults.local_config_dir)
         if not os.path.exists(conf_dir):
             os.makedirs(conf_dir)
@@ -94,6 +106,13 @@ class Clusterous(object):
             'central_logging_level': SchemaEntry(False, 0, int, None),
             'environment_file': SchemaEntry(False, '', str, None),
             'shared_volume_id': SchemaEntry(False, '', str, None),
+            'shared_volume_type': SchemaEntry(False, '', str, None),
+            'shared_volume_iops': SchemaEntry(False, 0, int, None),
+            'shared_volume_throughput': SchemaEntry(False, 0, int, None),
+            'shared_volume_stripes': SchemaEntry(False, 1, int, None),
+            'shared_volume_nfs_profile': SchemaEntry(False, '', str, None),
+            'shared_volume_snapshot_id': SchemaEntry(False, '', str, None),
+            'shared_volume_prewarm': SchemaEntry(False, False, bool, None),
             'parameters': SchemaEntry(True, {}, dict, None)
         }
 
@@ -115,6 +134,30 @@ class Clusterous(object):
         if validated['shared_volume_size'] < 0:
             raise ProfileError('"shared_volume_size" cannot be negative')
 
+        volume_type = validated['shared_volume_type'] or defaults.shared_volume_type
+        if volume_type not in defaults.shared_volume_types:
+            raise ProfileError('"shared_volume_type" must be one of {0}'.format(', '.join(defaults.shared_volume_types)))
+        if validated['shared_volume_iops'] < 0 or validated['shared_volume_throughput'] < 0:
+            raise ProfileError('"shared_volume_iops" and "shared_volume_throughput" cannot be negative')
+        if validated['shared_volume_iops'] and volume_type not in defaults.shared_volume_iops_types:
+            raise ProfileError('"shared_volume_iops" can only be used with volume types {0}'.format(
+                                ', '.join(defaults.shared_volume_iops_types)))
+        if validated['shared_volume_throughput'] and volume_type not in defaults.shared_volume_throughput_types:
+            raise ProfileError('"shared_volume_throughput" can only be used with volume types {0}'.format(
+                                ', '.join(defaults.shared_volume_throughput_types)))
+        if not 1 <= validated['shared_volume_stripes'] <= defaults.shared_volume_max_stripes:
+            raise ProfileError('"shared_volume_stripes" must be between 1 and {0}'.format(defaults.shared_volume_max_stripes))
+        if validated['shared_volume_nfs_profile'] and validated['shared_volume_nfs_profile'] not in defaults.nfs_profiles:
+            raise ProfileError('"shared_volume_nfs_profile" must be one of {0}'.format(', '.join(sorted(defaults.nfs_profiles))))
+        if validated['shared_volume_snapshot_id'] and (validated['shared_volume_id'] or validated['shared_volume_stripes'] > 1):
+            raise ProfileError('"shared_volume_snapshot_id" cannot be used with "shared_volume_id" or "shared_volume_stripes"')
+        if validated['shared_volume_prewarm'] and not (validated['shared_volume_snapshot_id'] or validated['shared_volume_id']):
+            raise ProfileError('"shared_volume_prewarm" can only be used with "shared_volume_snapshot_id" or "shared_volume_id"')
+        if validated['shared_volume_id'] and (validated['shared_volume_type'] or validated['shared_volume_iops'] or
+                                              validated['shared_volume_throughput'] or validated['shared_volume_stripes'] > 1):
+            raise ProfileError('"shared_volume_id" cannot be used with "shared_volume_type", "shared_volume_iops", '
+                               '"shared_volume_throughput" or "shared_volume_stripes"')
+
         return validated
 
     def make_cluster_object(self, cluster_name=None, cluster_name_required=True, cluster_must_be_running=True):
@@ -124,6 +167,9 @@ class Clusterous(object):
             success, message = self._cluster_class.validate_config(self._config)
             if not success:
                 raise ConfigError('Error in configuration: ' + message)
+            if cluster_name_required and not cluster_name and self._cluster_name:
+                cluster_name = self._cluster_name
+                self._fetch_cluster_info(cluster_name)
             try:
                 return self._cluster_class(self._config, cluster_name, cluster_name_required, cluster_must_be_running)
             except cluster.ClusterException as e:
@@ -132,11 +178,45 @@ class Clusterous(object):
                 raise NoWorkingClusterError(e)
 
 
+    def _fetch_cluster_info(self, cluster_name):
+        """
+        If there is no local info about cluster_name, fetches it (as "workon" does)
+        without changing the working cluster
+        """
+        if statestore.get_store().get_cluster_info(cluster_name):
+            return
+        try:
+            cl = self._cluster_class(self._config, cluster_name, cluster_must_be_running=False)
+        except cluster.ClusterException as e:
+            raise ClusterError(e)
+        if not cl.workon(make_working=False):
+            raise NoWorkingClusterError('Cluster "{0}" could not be found'.format(cluster_name))
+
+    def _record_operation(self, cluster_name, operation, func, *args):
+        """
+        Calls func with args, recording the operation and its outcome in the
+        local state store. func may return either a bool or a (success, ...) tuple
+        """
+        store = statestore.get_store()
+        operation_id = store.start_operation(cluster_name, operation)
+        success = False
+        try:
+            with tracing.span(operation, cluster=cluster_name):
+                result = func(*args)
+            success = result[0] if isinstance(result, tuple) else result is not False
+            return result
+        finally:
+            store.finish_operation(operation_id, success)
+
     def create_cluster(self, profile_file, launch_env=True):
         """
         Create a new cluster from profile file
         """
         profile = self._read_profile(profile_file)
+        return self._record_operation(profile['cluster_name'], 'create',
+                                      self._create_cluster, profile, profile_file)
+
+    def _create_cluster(self, profile, profile_file):
         env_file = None
         cluster_spec = None
         try:
@@ -171,8 +251,16 @@ class Clusterous(object):
 
         builder = clusterbuilder.ClusterBuilder(cl)
         self._logger.info('Creating cluster...')
+        shared_volume_options = {'type': profile['shared_volume_type'],
+                                 'iops': profile['shared_volume_iops'],
+                                 'throughput': profile['shared_volume_throughput'],
+                                 'stripes': profile['shared_volume_stripes'],
+                                 'nfs_profile': profile['shared_volume_nfs_profile'],
+                                 'snapshot_id': profile['shared_volume_snapshot_id'],
+                                 'prewarm': profile['shared_volume_prewarm']}
         created = builder.create_cluster(profile['cluster_name'], cluster_spec, profile['central_logging_level'],
-                                        profile['shared_volume_size'], profile['controller_instance_type'], profile['shared_volume_id'])
+                                        profile['shared_volume_size'], profile['controller_instance_type'], profile['shared_volume_id'],
+                                        shared_volume_options)
 
         if not created:
             return False, ''
@@ -184,8 +272,8 @@ class Clusterous(object):
             self._logger.info('Running environment...')
             try:
                 env = environment.Environment(cl)
-                # Run environment (but wait 10 seconds for Mesos to init)
-                success, message = env.launch_from_spec(env_file, 10)
+                # Run environment, once Mesos reports the new nodes
+                success, message = env.launch_from_spec(env_file, defaults.mesos_nodes_ready_timeout)
                 self._logger.info('Environment is running')
             except environment.Environment.LaunchError as e:
                 self._logger.error(e)
@@ -196,7 +284,9 @@ class Clusterous(object):
 
     def run_environment(self, environment_file):
         cl = self.make_cluster_object()
+        return self._record_operation(cl.cluster_name, 'run', self._run_environment, cl, environment_file)
 
+    def _run_environment(self, cl, environment_file):
         try:
             env_file = EnvironmentFile(environment_file)
             env = environment.Environment(cl)
@@ -226,6 +316,10 @@ class Clusterous(object):
 
     def scale_nodes(self, action, num_nodes, node_name):
         cl = self.make_cluster_object()
+        return self._record_operation(cl.cluster_name, 'scale {0}'.format(action),
+                                      self._scale_nodes, cl, action, num_nodes, node_name)
+
+    def _scale_nodes(self, cl, action, num_nodes, node_name):
         builder = clusterbuilder.ClusterBuilder(cl)
         delta = num_nodes
         actual_node_name = node_name
@@ -240,7 +334,7 @@ class Clusterous(object):
         env = environment.Environment(cl)
         if success and env.get_running_component_info():
             self._logger.info('Scaling running environment')
-            success, message = env.scale_app(actual_node_name, delta, wait_time=60)
+            success, message = env.scale_app(actual_node_name, delta, defaults.mesos_nodes_ready_timeout)
 
         return success, message
 
@@ -301,27 +395,31 @@ class Clusterous(object):
         # Check if component_name exists
         cl = self.make_cluster_object()
         env = environment.Environment(cl)
-        running_apps = env.get_running_component_info()
-        app = running_apps.get(component_name)
-        if app is None:
+        tasks = env.get_component_tasks(component_name)
+        if not tasks:
             message = "Component '{0}' does not exist".format(component_name)
             return (False, message)
 
-        if app > 1:
+        if len(tasks) > 1:
             message = "Cannot connect to '{0}' because there is more than one instance running on the cluster".format(component_name)
             return (False, message)
 
-        return cl.connect_to_container(component_name)
+        host, task_id = tasks[0]
+        return cl.connect_to_container(component_name, host, task_id)
 
     def central_logging(self):
         cl = self.make_cluster_object()
         return cl.connect_to_central_logging()
 
-    def cluster_status(self):
-        cl = self.make_cluster_object()
+    @tracing.traced('status')
+    def cluster_status(self, cluster_name=None):
+        cl = self.make_cluster_object(cluster_name)
         env = environment.Environment(cl)
-        info = cl.get_cluster_info()
-        component_info =  env.get_running_components_by_node()
+        results = taskgraph.run_all([('cluster-info', cl.get_cluster_info),
+                                     ('running-components', env.get_running_components_by_node),
+                                     ('shared-volume-usage', cl.get_shared_volume_usage_info)])
+        info = results['cluster-info']
+        component_info = results['running-components']
 
         # Fill in information about running components
         for node in info.get('nodes', {}):
@@ -333,12 +431,37 @@ class Clusterous(object):
                 components.append(component)
             info['nodes'][node]['components'] = components
 
-
-        # Add information about shared volume usage
-        info['shared_volume'] = cl.get_shared_volume_usage_info()
+        info['shared_volume'] = results['shared-volume-usage']
 
         return True, info
 
+    def cluster_status_all(self):
+        """
+        Gets status of all clusters known on this machine, querying them concurrently.
+        Returns a list of (cluster_name, success, info) tuples, where info is an
+        error message if success is False
+        """
+        cluster_names = statestore.get_store().get_cluster_names()
+        if not cluster_names:
+            return []
+
+        def get_status(cluster_name):
+            try:
+                success, info = self.cluster_status(cluster_name)
+            except (ClusterError, NoWorkingClusterError, cluster.ClusterException,
+                    cluster.ConnectionException) as e:
+                success, info = False, str(e)
+            except Exception as e:
+                # e.g. SSH or HTTP errors from an unreachable cluster, which must
+                # not stop the status of the others from being reported
+                self._logger.debug('Could not get status of cluster {0}'.format(cluster_name), exc_info=True)
+                success, info = False, str(e) or type(e).__name__
+            return cluster_name, success, info
+
+        num_workers = min(len(cluster_names), defaults.status_all_max_workers)
+        with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            return list(executor.map(get_status, cluster_names))
+
     def workon(self, cluster_name):
         """
         Sets a working cluster
@@ -351,10 +474,14 @@ class Clusterous(object):
             message = 'Could not switch to cluster {0}'.format(cluster_name)
         return success, message
 
-    def destroy_cluster(self, leave_shared_volume, force_delete_shared_volume):
+    def destroy_cluster(self, leave_shared_volume, force_delete_shared_volume, snapshot_shared_volume=False):
         cl = self.make_cluster_object(cluster_must_be_running=False)
         self._logger.info('Destroying cluster {0}'.format(cl.cluster_name))
-        cl.terminate_cluster(leave_shared_volume, force_delete_shared_volume)
+        try:
+            self._record_operation(cl.cluster_name, 'destroy', cl.terminate_cluster,
+                                   leave_shared_volume, force_delete_shared_volume, snapshot_shared_volume)
+        except cluster.ClusterException as e:
+            raise ClusterError(e)
 
     def ls_volumes(self):
         """
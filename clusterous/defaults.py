@@ -20,17 +20,21 @@ Module for storing default and static values
 """
 
 local_config_dir = '~/.clusterous'
-local_session_data_dir = local_config_dir + '/' + 'session'
-local_environment_dir = local_config_dir + '/' + 'environment'
+local_session_data_dir = local_config_dir + '/' + 'session'     # Shared by all clusters, kept short for ssh sockets
+
+# Each cluster has its own local dir, containing its controller inventory and environment cache
+local_cluster_dir_format = local_config_dir + '/' + 'clusters/{0}'    # cluster name
+local_environment_dir = 'environment'
 cached_cluster_file = 'cluster_spec.yml'
 cached_environment_file = 'environment.yml'
-cached_cluster_file_path = local_environment_dir + '/' + cached_cluster_file
-cached_environment_file_path = local_environment_dir + '/' + cached_environment_file
+current_nat_ip_file = 'current_controller'
 
 remote_environment_dir = '/home/ubuntu/environment'
 
-current_nat_ip_file = local_config_dir + '/' + 'current_controller'
-cluster_info_file = local_config_dir + '/' + 'cluster_info.yml'
+cluster_info_file = local_config_dir + '/' + 'cluster_info.yml'    # used by older versions, imported into state_db_file
+state_db_file = local_config_dir + '/' + 'state.db'
+environment_cache_dir = local_config_dir + '/' + 'cache/environments'    # parsed environment files
+environment_cache_size = 50
 
 
 taggable_name_re = re.compile('^[\w-]+$')       # For user supplied strings such as cluster name
@@ -45,20 +49,86 @@ controller_instance_type = 't2.small'
 node_name_format = '{0}-node-{1}'
 instance_tag_key = '@clusterous'
 instance_node_type_tag_key = 'NodeType'
+warm_pool_tag_key = 'WarmPool'
 registry_s3_path = '/docker-registry'
+registry_storage_port = 5001         # on the controller, behind the cache on port 5000
+registry_cache_dir = '/var/cache/registry'
+registry_cache_size = '10g'
+registry_concurrency = 1024          # connections handled by the registry cache
 central_logging_name_format = '{0}-central-logging'
 central_logging_name_tag_value = 'central-logging'
 central_logging_instance_type = 't2.small'
+storage_name_format = '{0}-storage'
+storage_name_tag_value = 'storage'
+storage_role = 'storage'        # "role" of the node group that holds the shared volume, if any
+placement_group_name_format = '{0}-pg-{1}'    # cluster name, node name
+placement_group_strategy = 'cluster'
 
 default_zone = 'a'
 
 controller_root_volume_size = 50    # GB
 
 cluster_username = 'ubuntu'
+nat_username = 'ec2-user'        # The NAT is the SSH bastion for the controller and nodes
+bastion_keepalive_interval = 30
 cluster_user_home_dir = '/home/ubuntu'
 
 shared_volume_path = '/home/data/'
 shared_volume_size = 20     # GB
+shared_volume_type = 'gp3'
+# EBS volume types, and those for which IOPS and throughput can be provisioned
+shared_volume_types = ['gp3', 'gp2', 'io1', 'io2', 'st1', 'sc1', 'standard']
+shared_volume_iops_types = ['gp3', 'io1', 'io2']
+shared_volume_throughput_types = ['gp3']
+# Striped shared volumes are attached at /dev/sdf, /dev/sdg etc. and appear on the controller as /dev/xvdf etc.
+shared_volume_max_stripes = 8
+shared_volume_device_letters = 'fghijklm'
+shared_volume_raid_device = '/dev/md0'
+shared_volume_snapshot_name_format = '{0}-shared-volume'
+shared_volume_prewarm_parallelism = 16     # Concurrent reads when prewarming a volume restored from a snapshot
+
+# NFS profiles for the shared volume: export options on the controller, mount options and
+# connections (nconnect, only on kernels that support it) on nodes, and nfsd threads per node
+# on the controller (0 leaves the default)
+nfs_profiles = {
+    'safe': {'export_options': 'rw,sync,no_root_squash,no_all_squash',
+             'mount_options': 'defaults',
+             'nconnect': 0,
+             'nfsd_threads_per_node': 0},
+    'throughput': {'export_options': 'rw,async,no_subtree_check,no_root_squash,no_all_squash',
+                   'mount_options': 'rw,hard,noatime,nodiratime,rsize=1048576,wsize=1048576',
+                   'nconnect': 8,
+                   'nfsd_threads_per_node': 4}
+}
+default_nfs_profile = 'safe'
+nfsd_min_threads = 8
+nfsd_max_threads = 256
+
+# Node groups with nfs_cache cache the shared volume locally with FS-Cache, on the instance
+# store if the instance type has one (mounted at /mnt by the node image), otherwise on the root volume
+nfs_cache_instance_store_device = '/dev/sdb'
+
+# Nodes per registry mirror; clusters with more nodes pull images through mirrors on nodes
+registry_mirror_fanout = 16
+
+# Component image pull policies: pull on every task start, pull only if not on the node,
+# or resolve the tag to a digest at launch and pull that only if not on the node
+pull_policies = ('always', 'if-not-present', 'digest-pinned')
+default_pull_policy = 'always'
+private_registry = 'registry:5000'
+docker_hub_registry_url = 'https://registry-1.docker.io'
+docker_manifest_type = 'application/vnd.docker.distribution.manifest.v2+json'
+# Image whose layers are reused by builds of an image (by repository name), as a build cache
+build_cache_image_format = 'registry:5000/{0}:build-cache'
+
+# Image builds on nodes, run as Marathon applications
+build_context_dir = '/home/data/docker_images'          # on the shared volume
+build_output_dir = '/home/data/docker_images/.builds'
+build_app_prefix = 'clusterous-build-'
+build_cpus = 1
+build_mem = 1024            # MB
+build_timeout = 3600        # seconds
+build_log_lines = 20        # lines of output shown when a build fails
 
 remote_scripts_dir = 'ansible/remote'
 
@@ -67,12 +137,34 @@ default_cluster_def_filename = 'default_cluster.yml'
 remote_host_scripts_dir = 'clusterous'
 remote_host_key_file = 'key.pem'
 remote_host_vars_file = 'vars.yml'
-container_id_script_file = 'container_id.sh'
 
 mesos_port = 5050
 marathon_port = 8080
 central_logging_port = 8081
-nat_ssh_port_forwarding = 22000
+
+status_all_max_workers = 8     # Clusters queried concurrently by "status --all"
+task_graph_max_workers = 8     # Steps of an operation run concurrently
+
+# AWS API calls are rate limited by a token bucket, and throttled calls retried with backoff
+aws_requests_per_second = 20
+aws_request_burst = 100
+aws_max_retries = 8
+aws_retry_base_delay = 0.5      # seconds, doubled on each retry
+aws_retry_max_delay = 20
+aws_latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)    # seconds, for call latency histograms
+
+# Polling waits (see waiter.py) back off from the initial interval, in seconds
+wait_initial_interval = 1
+wait_max_interval = 15
+wait_backoff_multiplier = 2
+wait_jitter = 0.25              # fraction by which each interval may be shortened
+wait_cancel_check_interval = 1
+instance_start_timeout = 900
+instance_terminate_timeout = 300
+node_drain_timeout = 120        # seconds for a node's Mesos agent to kill its tasks and leave
+volume_wait_timeout = 300
+ssh_connect_timeout = 300
+vpc_available_timeout = 60
 
 # How many seconds to wait for all Marathon applications to reach "started" state
 # Currently 30 minutes
@@ -80,6 +172,12 @@ app_launch_start_timeout = 1800
 
 app_destroy_timeout = 60
 
+# Mesos master API responses are reused for this many seconds (see mesosclient.py)
+mesos_cache_ttl = 5
+http_request_timeout = 60      # seconds, for Mesos and Marathon API requests
+# How many seconds to wait for Mesos to report all nodes, after nodes are created or removed
+mesos_nodes_ready_timeout = 180
+
 def get_script(filename):
     """
     Takes script relative filename, returns absolute path
@@ -0,0 +1,166 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+
+"""
+Filtering of Docker build contexts by .dockerignore, with the same rules as the
+Docker client: patterns are relative to the root of the context, the last
+matching pattern wins, "!" re-includes, "**" matches any number of directories,
+and a pattern matching a directory excludes everything in it. The Dockerfile and
+.dockerignore are always kept. The filtered context is turned into an rsync
+filter, so that only it is copied to the cluster
+"""
+
+always_included = ('Dockerfile', '.dockerignore')
+
+
+def _pattern_regex(pattern):
+    """
+    Translates a .dockerignore pattern (without "!") to a compiled regex
+    """
+    regex = '^'
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '*':
+            if pattern[i+1:i+2] == '*':
+                i += 1
+                if pattern[i+1:i+2] == '/':
+                    # "**/" matches any number of directories, including none
+                    i += 1
+                    regex += '(.*/)?'
+                else:
+                    regex += '.*'
+            else:
+                regex += '[^/]*'
+        elif ch == '?':
+            regex += '[^/]'
+        elif ch == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(ch)
+            else:
+                body = pattern[i+1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                i = end
+        elif ch == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(ch)
+        i += 1
+    return re.compile(regex + '$')
+
+
+def read_patterns(context_dir):
+    """
+    Reads .dockerignore of context_dir, returns list of (regex, number of path
+    components, whether it re-includes)
+    """
+    path = os.path.join(context_dir, '.dockerignore')
+    if not os.path.isfile(path):
+        return []
+
+    patterns = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            include = line.startswith('!')
+            if include:
+                line = line[1:].strip()
+            line = os.path.normpath(line).lstrip('/')
+            if not line or line == '.':
+                continue
+            patterns.append((_pattern_regex(line), len(line.split('/')), include))
+    return patterns
+
+
+def is_excluded(path, patterns):
+    """
+    Returns True if path (relative to the context, "/" separated) is excluded by patterns
+    """
+    excluded = False
+    parts = path.split('/')
+    for regex, depth, include in patterns:
+        match = regex.match(path)
+        if not match and depth < len(parts):
+            # The pattern may match a parent directory
+            match = regex.match('/'.join(parts[:depth]))
+        if match:
+            excluded = not include
+    return excluded
+
+
+def context_paths(context_dir):
+    """
+    Returns sorted list of the directories and files (relative to context_dir,
+    "/" separated) in the build context, after applying .dockerignore
+    """
+    patterns = read_patterns(context_dir)
+    can_reinclude = any( include for _, _, include in patterns )
+    paths = []
+    for root, dirs, files in os.walk(context_dir):
+        rel_root = os.path.relpath(root, context_dir)
+        rel_root = '' if rel_root == '.' else rel_root.replace(os.sep, '/') + '/'
+        for d in list(dirs):
+            if is_excluded(rel_root + d, patterns):
+                if not can_reinclude:
+                    # Nothing inside can be included again, no need to look
+                    dirs.remove(d)
+                continue
+            paths.append(rel_root + d)
+        for name in files:
+            path = rel_root + name
+            if path in always_included or not is_excluded(path, patterns):
+                paths.append(path)
+
+    # Directories holding re-included files must be included too
+    included = set(paths)
+    for path in list(paths):
+        parts = path.split('/')
+        for i in range(1, len(parts)):
+            parent = '/'.join(parts[:i])
+            if parent not in included:
+                included.add(parent)
+                paths.append(parent)
+    return sorted(paths)
+
+
+def _rsync_escape(path):
+    return re.sub(r'([\\*?\[])', r'\\\1', path)
+
+
+def write_rsync_filter(context_dir, filter_file):
+    """
+    Writes to filter_file (a file object) rsync filter rules for copying context_dir
+    (the folder itself, as with a source path without trailing slash), so that
+    only the filtered build context is copied. Returns number of paths included
+    """
+    name = os.path.basename(os.path.normpath(context_dir))
+    paths = context_paths(context_dir)
+    filter_file.write('+ /{0}/\n'.format(_rsync_escape(name)))
+    for path in paths:
+        full = '/{0}/{1}'.format(name, path)
+        if os.path.isdir(os.path.join(context_dir, path)) and not os.path.islink(os.path.join(context_dir, path)):
+            full += '/'
+        filter_file.write('+ {0}\n'.format(_rsync_escape(full)))
+    filter_file.write('- *\n')
+    filter_file.flush()
+    return len(paths)
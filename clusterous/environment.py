@@ -12,9 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 import logging
 import os.path
-import time
 from urlparse import urlparse
 
 import requests
@@ -26,6 +26,11 @@ from marathon.models.constraint import MarathonConstraint
 import helpers
 import environmentfile
 import defaults
+import jsonstream
+import mesosclient
+import taskgraph
+import tracing
+import waiter
 
 
 class Environment(object):
@@ -40,64 +45,55 @@ class Environment(object):
             raise ValueError('Environment must be initialised with a Cluster object')
         self._cluster = cluster
         self._logger = logging.getLogger(__name__)
+        self._mesos = mesosclient.MesosClient(cluster)
 
-    def launch_from_spec(self, env_file, mesos_wait_time=0):
+    def launch_from_spec(self, env_file, nodes_wait_timeout=0):
         """
         Launches an environment based on environment file
-        mesos_wait_time is the number of seconds to wait for Mesos to make cluster data
-        available immediately after cluster creation
+        nodes_wait_timeout is the maximum number of seconds to wait for Mesos to
+        report all nodes, e.g. immediately after cluster creation
         """
 
-        # Get cluster info and validate resources
+        # Get cluster info while connecting to Marathon
         self._logger.debug('Preparing to launch...')
-        mesos_data = self._get_mesos_data(mesos_wait_time)
-        cluster_info = self._process_mesos_data(mesos_data)
-
-        component_resources = self._calculate_resources(env_file.spec, cluster_info)
-
         marathon_tunnel = self._cluster.make_controller_tunnel(defaults.marathon_port)
-        marathon_tunnel.connect()
-
-        running_components = self._check_for_running_components(component_resources.keys(), marathon_tunnel)
-
-        # If there are no components currently running, proceed
-        if not running_components:
-            success = False
-            # Build image(s) if necessary
-            images = env_file.spec['environment']['image']
-            build_list = []
-            self._logger.info('Checking for Docker images...')
-            for image in images:
-                info = self._cluster.docker_image_info(image['image_name'])
-                if not info:
-                    dockerfile_folder = env_file.get_full_path(image['dockerfile'])
-                    if not os.path.isfile(os.path.join(dockerfile_folder, 'Dockerfile')):
-                        raise self.LaunchError('Could not find a Dockerfile in {0}'.format(image['dockerfile']))
-
-                    build_list.append((dockerfile_folder, image['image_name']))
-                else:
-                    self._logger.debug('Image "{0}" already exists, no need to build'.format(image['image_name']))
-
-            for item in build_list:
-                success = self._cluster.docker_build_image(item[0], item[1])
-                if not success:
-                    raise self.LaunchError('Problem building image from {0}'.format(item[0]))
-
-            # Copy files
-            self._logger.info('Copying files...')
-            for item in env_file.spec['environment']['copy']:
-                full_local_path = env_file.get_full_path(item)
-                status, message = self._cluster.sync_put(full_local_path, '')
-                if not status:
-                    raise self.LaunchError(message)
-
-            # Do the final checks and perform actual launch
-            success = self._launch_components(env_file.spec, component_resources, marathon_tunnel)
-        else:
-            self._logger.info('Environment already running, not launching anything')
-            success = True
+        try:
+            mesos_data = taskgraph.run_all([('mesos-data', lambda: self._get_mesos_data(nodes_wait_timeout)),
+                                            ('marathon-tunnel', marathon_tunnel.connect)])['mesos-data']
+
+            # Validate resources
+            cluster_info = self._process_mesos_data(mesos_data)
+
+            component_resources = self._calculate_resources(env_file.spec, cluster_info)
+
+            running_components = self._check_for_running_components(component_resources.keys(), marathon_tunnel)
+
+            # If there are no components currently running, proceed
+            if not running_components:
+                success = False
+                # Build any missing images, and copy files, concurrently
+                self._logger.info('Checking for Docker images...')
+                self._logger.info('Copying files...')
+                build_hosts = []
+                if env_file.spec['environment']['image']:
+                    build_hosts = self._build_hosts(mesos_data, env_file.spec['environment'].get('build_machine', ''))
+                tasks = [ ('image {0}'.format(image['image_name']),
+                           self._image_builder(env_file, image, build_hosts, marathon_tunnel))
+                          for image in env_file.spec['environment']['image'] ]
+                tasks.extend( ('copy {0}'.format(item), self._file_copier(env_file, item))
+                              for item in env_file.spec['environment']['copy'] )
+                taskgraph.run_all(tasks)
+
+                image_digests = self._resolve_image_digests(env_file.spec)
+
+                # Do the final checks and perform actual launch
+                success = self._launch_components(env_file.spec, component_resources, marathon_tunnel, image_digests)
+            else:
+                self._logger.info('Environment already running, not launching anything')
+                success = True
+        finally:
+            marathon_tunnel.close()
 
-        marathon_tunnel.close()
         # Launch wasn't (completely) succesful
         if not success:
             return False, ''
@@ -109,6 +105,107 @@ class Environment(object):
 
         return True, message
 
+    def _build_hosts(self, mesos_data, build_machine):
+        """
+        Returns hostnames of the nodes that images can be built on (only those named
+        build_machine, if given), or an empty list to build on the controller. Nodes
+        push images to "registry", which is the controller's registry except on nodes
+        pulling through a registry mirror, so if there are mirrors only the nodes
+        running them can build
+        """
+        if build_machine == 'controller':
+            return []
+        # Slaves are matched by IP, as they may register under any hostname
+        mirrors = set(self._cluster.get_registry_mirrors())
+        hosts = [ s.hostname for s in mesos_data
+                  if s.active and s.cpus >= defaults.build_cpus and s.mem >= defaults.build_mem and
+                  (not build_machine or s.name == build_machine) and
+                  (not mirrors or s.ip in mirrors) ]
+        if build_machine and not hosts:
+            self._logger.warning('No "{0}" nodes can build images, building on the controller'.format(build_machine))
+        return hosts
+
+    def _image_builder(self, env_file, image, build_hosts, tunnel):
+        """
+        Returns function building image (an entry in the environment file) unless it
+        already exists, on one of build_hosts, or on the controller if there are none
+        """
+        def build():
+            info = self._cluster.docker_image_info(image['image_name'])
+            if info:
+                self._logger.debug('Image "{0}" already exists, no need to build'.format(image['image_name']))
+                return
+            dockerfile_folder = env_file.get_full_path(image['dockerfile'])
+            if not os.path.isfile(os.path.join(dockerfile_folder, 'Dockerfile')):
+                raise self.LaunchError('Could not find a Dockerfile in {0}'.format(image['dockerfile']))
+            if build_hosts:
+                self._build_on_node(dockerfile_folder, image['image_name'], build_hosts, tunnel)
+            elif not self._cluster.docker_build_image(dockerfile_folder, image['image_name']):
+                raise self.LaunchError('Problem building image from {0}'.format(dockerfile_folder))
+        return build
+
+    @tracing.traced('build-on-node')
+    def _build_on_node(self, dockerfile_folder, image_name, build_hosts, tunnel):
+        """
+        Builds image_name as a Marathon application, with a single task placed on one
+        of build_hosts, and removes the application once the build has finished
+        """
+        build_id = re.sub('[^a-z0-9]+', '-', image_name.lower()).strip('-')
+        if not self._cluster.docker_build_image(dockerfile_folder, image_name, build_id):
+            raise self.LaunchError('Problem building image from {0}'.format(dockerfile_folder))
+
+        app_id = defaults.build_app_prefix + build_id
+        constraint = MarathonConstraint(field='hostname', operator='LIKE',
+                                        value='|'.join( re.escape(h) for h in build_hosts ))
+        client = marathon.MarathonClient(servers='http://localhost:{0}'.format(tunnel.local_port), timeout=600)
+        self._logger.info('Started building docker image {0} on a node'.format(image_name))
+        client.create_app(app_id, marathon.models.MarathonApp(
+                                        cmd=self._cluster.docker_build_command(dockerfile_folder, image_name, build_id),
+                                        cpus=defaults.build_cpus, mem=defaults.build_mem, instances=1,
+                                        constraints=[constraint]))
+        try:
+            status = waiter.wait_until('image-build', lambda: self._cluster.docker_build_status(build_id),
+                                       defaults.build_timeout, initial=5)
+        finally:
+            client.delete_app(app_id, force=True)
+
+        if status is None:
+            raise self.LaunchError('Timed out building image {0}'.format(image_name))
+        if status != '0':
+            raise self.LaunchError('Problem building image {0}:\n{1}'.format(image_name,
+                                   self._cluster.docker_build_log(build_id)))
+        self._logger.info('Finished building docker image {0}'.format(image_name))
+
+    @tracing.traced('resolve-image-digests')
+    def _resolve_image_digests(self, spec):
+        """
+        Resolves the images of components with the "digest-pinned" pull policy to
+        digests, concurrently. Returns dictionary of image to image referenced by
+        digest, or None if the registry could not provide a digest
+        """
+        images = set( c['image'] for c in spec['environment']['components'].itervalues()
+                      if c['pull_policy'] == 'digest-pinned' )
+        digests = taskgraph.run_all([ (image, lambda image=image: self._cluster.docker_image_digest(image))
+                                      for image in images ])
+        for image, digest in digests.iteritems():
+            if digest:
+                self._logger.debug('Image "{0}" resolved to "{1}"'.format(image, digest))
+            else:
+                self._logger.warning('Could not resolve image "{0}" to a digest, it will be pulled '
+                                     'on every start'.format(image))
+        return digests
+
+    def _file_copier(self, env_file, item):
+        """
+        Returns function copying item (a path in the environment file) to the cluster
+        """
+        def copy():
+            status, message = self._cluster.sync_put(env_file.get_full_path(item), '')
+            if not status:
+                raise self.LaunchError(message)
+        return copy
+
+    @tracing.traced('destroy-environment')
     def destroy(self):
         """
         Destroy any running Marathon applications
@@ -117,7 +214,7 @@ class Environment(object):
         tunnel.connect()
         marathon_url = 'http://localhost:{0}'.format(tunnel.local_port)
         client = marathon.MarathonClient(servers=marathon_url, timeout=600)
-        app_list = client.list_apps()
+        app_list = self._list_apps(tunnel)
 
         if not app_list:
             self._logger.info('No application to destroy')
@@ -131,18 +228,8 @@ class Environment(object):
 
         self._logger.debug('Sent delete requests, will wait until all destroyed')
 
-        start_time = time.time()
-        elapsed_time = 0
-        all_destroyed = False
-
-        while elapsed_time < defaults.app_destroy_timeout:
-            app_list = client.list_apps()
-            if not app_list:
-                all_destroyed = True
-                self._logger.debug('All apps destroyed')
-                break
-            time.sleep(2)
-            elapsed_time = time.time() - start_time
+        all_destroyed = waiter.wait_until('apps-destroyed', lambda: not self._list_apps(tunnel),
+                                          defaults.app_destroy_timeout)
 
         # If timed out without destroying
         if not all_destroyed:
@@ -150,15 +237,18 @@ class Environment(object):
             tunnel.close()
             return False
 
+        self._logger.debug('All apps destroyed')
+
         self._logger.info('{0} running applications successfully destroyed'.format(component_count))
         tunnel.close()
         return True
 
-    def scale_app(self, node_name, num_nodes_changed, wait_time=0):
+    @tracing.traced('scale-environment')
+    def scale_app(self, node_name, num_nodes_changed, nodes_wait_timeout=0):
         if num_nodes_changed == 0:
             return True, 'Nothing to change'
 
-        mesos_data = self._get_mesos_data(wait_time)
+        mesos_data = self._get_mesos_data(nodes_wait_timeout)
         cluster_info = self._process_mesos_data(mesos_data)
         if node_name not in cluster_info or 'num_nodes' not in cluster_info[node_name]:
             return True ,'No nodes running, apps removed'
@@ -226,41 +316,46 @@ class Environment(object):
 
         return hostname
 
-    def _get_mesos_data(self, mesos_wait_time):
+    @tracing.traced('mesos-data')
+    def _get_mesos_data(self, nodes_wait_timeout=0):
         """
-        Queries Mesos API and obtains information about cluster. Returns raw Mesos data
+        Queries Mesos API and obtains information about the cluster's nodes. If
+        nodes_wait_timeout is given, first waits up to that many seconds until Mesos
+        reports all nodes running on the cluster. Returns list of jsonstream.Slave
         """
-        time.sleep(mesos_wait_time)
-        mesos_data = None
-        with self._cluster.make_controller_tunnel(defaults.mesos_port) as tunnel:
-            r = requests.get('http://localhost:{0}/master/state.json'.format(tunnel.local_port))
-            mesos_data = r.json()
-
-        return mesos_data
+        try:
+            with self._mesos:
+                if nodes_wait_timeout:
+                    expected = self._cluster.get_node_counts()
+                    if not self._mesos.wait_for_slaves(expected, nodes_wait_timeout):
+                        self._logger.debug('Mesos does not yet report all nodes, continuing')
+                return self._mesos.slaves()
+        except (requests.exceptions.RequestException, jsonstream.JSONError) as e:
+            self._logger.debug('Mesos request failed: {0}'.format(e))
+            raise self.LaunchError('Could not obtain cluster information from Mesos')
 
     def _process_mesos_data(self, mesos_data):
         """
-        Takes raw Mesos data and transforms into usable data structure containing
+        Takes Mesos slaves and transforms into usable data structure containing
         information about all slaves and their exact resources
         """
-        # Transform cluster info
-        if not 'slaves' in mesos_data:
-            raise self.LaunchError('Could not obtain cluster information from Mesos')
-
         cluster_info = {}
 
-        for host in mesos_data['slaves']:
-            if not 'name' in host['attributes']:
-                self._logger.warning('No "name" attribute present for mesos slave: {0}'.format(host))
-            if not host['attributes']['name'] in cluster_info:
-                cluster_info[host['attributes']['name']] = { 'num_nodes': 1,
-                                                            'cpus_per_node': host['resources']['cpus'],
-                                                            'mem_per_node': host['resources']['mem'],
-                                                            'hostname': host['hostname']
-                                                            }
+        for host in mesos_data:
+            if not host.active:
+                continue
+            if host.name is None:
+                self._logger.warning('No "name" attribute present for mesos slave: {0}'.format(host.hostname))
+                continue
+            if not host.name in cluster_info:
+                cluster_info[host.name] = { 'num_nodes': 1,
+                                            'cpus_per_node': host.cpus,
+                                            'mem_per_node': host.mem,
+                                            'hostname': host.hostname
+                                            }
             else:
                 # Increment node count
-                cluster_info[host['attributes']['name']]['num_nodes'] += 1
+                cluster_info[host.name]['num_nodes'] += 1
 
         return cluster_info
 
@@ -371,15 +466,14 @@ class Environment(object):
 
         return component_resources
 
+    @tracing.traced('check-running-components')
     def _check_for_running_components(self, component_names, marathon_tunnel):
         """
         Given a list of component names and a SSHTunnel to Marathon, checks if
         any of the components are running.
         Returns list of those components found to be already running
         """
-        marathon_url = 'http://localhost:{0}'.format(marathon_tunnel.local_port)
-        client = marathon.MarathonClient(servers=marathon_url, timeout=600)
-        app_list = client.list_apps()
+        app_list = self._list_apps(marathon_tunnel)
         running_components = []
         for app_name in [ a.id.strip('/') for a in app_list ]:
             if app_name in component_names:
@@ -400,10 +494,7 @@ class Environment(object):
         else:
             tunnel = marathon_tunnel
 
-        marathon_url = 'http://localhost:{0}'.format(tunnel.local_port)
-        client = marathon.MarathonClient(servers=marathon_url, timeout=600)
-
-        app_list = client.list_apps()
+        app_list = self._list_apps(tunnel)
         node_info = {}
         for app in app_list:
             if not app.constraints:
@@ -438,21 +529,57 @@ class Environment(object):
         else:
             tunnel = marathon_tunnel
 
-        marathon_url = 'http://localhost:{0}'.format(tunnel.local_port)
-        client = marathon.MarathonClient(servers=marathon_url, timeout=600)
-        app_list = client.list_apps()
         app_counts = {}
-        for app_name in [ a.id.strip('/') for a in app_list ]:
-            if app_name not in app_counts:
-                app_counts[app_name] = 0
-            app_counts[app_name] += client.get_app(app_name).instances
+        for app in self._list_apps(tunnel):
+            app_name = app.id.strip('/')
+            app_counts[app_name] = app_counts.get(app_name, 0) + app.instances
 
         if tunnel_created:
             # If a tunnel was created here, close it before returning
             tunnel.close()
         return app_counts
 
-    def _launch_components(self, spec, component_resources, tunnel):
+    def get_component_tasks(self, component_name, marathon_tunnel=None):
+        """
+        Queries Marathon for the running instances (tasks) of a component.
+        Returns list of (host, Mesos task ID), empty if the component does not exist
+        """
+        tunnel_created = False
+        if not marathon_tunnel:
+            tunnel = self._cluster.make_controller_tunnel(defaults.marathon_port)
+            tunnel.connect()
+            tunnel_created = True
+        else:
+            tunnel = marathon_tunnel
+
+        try:
+            tasks = [ (t.host, t.id) for t in self._marathon_get(tunnel, '/v2/apps/{0}/tasks'.format(component_name),
+                                                                  jsonstream.parse_tasks) ]
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code != 404:
+                raise
+            tasks = []
+
+        if tunnel_created:
+            # If a tunnel was created here, close it before returning
+            tunnel.close()
+        return tasks
+
+    def _marathon_get(self, tunnel, path, parse):
+        """
+        Requests path from Marathon through tunnel, returns response as parsed by
+        parse (one of the jsonstream functions)
+        """
+        return jsonstream.get('http://localhost:{0}{1}'.format(tunnel.local_port, path), parse)
+
+    def _list_apps(self, tunnel):
+        """
+        Returns list of Marathon applications, as jsonstream.App records
+        """
+        return self._marathon_get(tunnel, '/v2/apps', jsonstream.parse_apps)
+
+    @tracing.traced('launch-components')
+    def _launch_components(self, spec, component_resources, tunnel, image_digests={}):
         """
         Takes processed component resources dictionary and performs final steps,
         prepares Marathon data structures and launches components.
@@ -461,6 +588,7 @@ class Environment(object):
         High level algorithm:
 
         For each component
+            apply image pull policy
             normalise cmd path
             generate ports list
             validate dependency text
@@ -476,128 +604,133 @@ class Environment(object):
         volume_mapping = [{ 'mode': 'RW',
                             'containerPath': defaults.shared_volume_path,
                             'hostPath': defaults.shared_volume_path}]
+        central_logging_ip = self._cluster.get_central_logging_ip()
         app_containers = []
-        for name, c in spec['environment']['components'].iteritems():
-            # Create ports mappings
-            port_mappings = []
-
-            if c['ports']:
-                # TODO: this validation should happen befor this point
-                if not isinstance(c['ports'], basestring):
-                    raise self.LaunchError('In component "{0}", "ports" must be a '
-                                            'string value'.format(name))
-                for p in c['ports'].split(','):
-                    port = p.strip()
-                    pair = port.split(':')
-                    container_port = host_port = 0
-                    if len(pair) == 2:
-                        host_port = int(pair[0])
-                        container_port = int(pair[1])
-                    elif len(pair) == 1:
-                        container_port = host_port = int(pair[0])
-                    else:
-                        raise self.LaunchError('In "{0}", malformed port '
-                                                'value: {1}'.format(name, pair))
-                    port_mappings.append({  'containerPort': container_port,
-                                            'hostPort': host_port,
-                                            'protocol': 'tcp'})
-
-
-            # Validate and generate dependencies
-            dependencies = []
-            constraints = []
-            if c['depends']:
-                for d in c['depends'].split(','):
-                    depend_str = d.strip()
-                    if not depend_str in spec['environment']['components']:
-                        raise self.LaunchError('Could not find dependency "{0}" as '
-                                                'specified in component "{1}"'.format(depend_str, name))
-                    dependencies.append('/{0}'.format(depend_str))
-
-            parameters = []
-            central_logging_ip = self._cluster.get_central_logging_ip()
-            if central_logging_ip:
-                parameters.append({ "key": "add-host", "value": 'central-logging:{0}'.format(central_logging_ip) })
-
-            docker = {  'image': c['image'], 'port_mappings': port_mappings,
-                        'force_pull_image': True, 'network': c['docker_network'].upper(), 'privileged': True,
-                        'parameters': parameters}
-            container = MarathonContainer(docker=docker, volumes=volume_mapping)
-
-            if c['machine']:
-                constraints = [MarathonConstraint(field='name', operator='CLUSTER', value=c['machine'])]
-
-            app_containers.append({ 'name': name,
-                                    'container': container,
-                                    'cmd': c['cmd'],
-                                    'dependencies': dependencies,
-                                    'constraints': constraints})
+        with tracing.span('prepare-components'):
+            for name, c in spec['environment']['components'].iteritems():
+                # Create ports mappings
+                port_mappings = []
+
+                if c['ports']:
+                    # TODO: this validation should happen befor this point
+                    if not isinstance(c['ports'], basestring):
+                        raise self.LaunchError('In component "{0}", "ports" must be a '
+                                                'string value'.format(name))
+                    for p in c['ports'].split(','):
+                        port = p.strip()
+                        pair = port.split(':')
+                        container_port = host_port = 0
+                        if len(pair) == 2:
+                            host_port = int(pair[0])
+                            container_port = int(pair[1])
+                        elif len(pair) == 1:
+                            container_port = host_port = int(pair[0])
+                        else:
+                            raise self.LaunchError('In "{0}", malformed port '
+                                                    'value: {1}'.format(name, pair))
+                        port_mappings.append({  'containerPort': container_port,
+                                                'hostPort': host_port,
+                                                'protocol': 'tcp'})
+
+
+                # Validate and generate dependencies
+                dependencies = []
+                constraints = []
+                if c['depends']:
+                    for d in c['depends'].split(','):
+                        depend_str = d.strip()
+                        if not depend_str in spec['environment']['components']:
+                            raise self.LaunchError('Could not find dependency "{0}" as '
+                                                    'specified in component "{1}"'.format(depend_str, name))
+                        dependencies.append('/{0}'.format(depend_str))
+
+                parameters = []
+                if central_logging_ip:
+                    parameters.append({ "key": "add-host", "value": 'central-logging:{0}'.format(central_logging_ip) })
+
+                # Images referenced by digest cannot change, so are only pulled if not on the node
+                image = c['image']
+                force_pull = c['pull_policy'] == 'always'
+                if c['pull_policy'] == 'digest-pinned':
+                    image = image_digests.get(c['image']) or image
+                    force_pull = image == c['image']
+
+                docker = {  'image': image, 'port_mappings': port_mappings,
+                            'force_pull_image': force_pull, 'network': c['docker_network'].upper(), 'privileged': True,
+                            'parameters': parameters}
+                container = MarathonContainer(docker=docker, volumes=volume_mapping)
+
+                if c['machine']:
+                    constraints = [MarathonConstraint(field='name', operator='CLUSTER', value=c['machine'])]
+
+                app_containers.append({ 'name': name,
+                                        'container': container,
+                                        'cmd': c['cmd'],
+                                        'dependencies': dependencies,
+                                        'constraints': constraints})
 
         # Launch containers
+        with tracing.span('submit-components'):
 
-        marathon_url = 'http://localhost:{0}'.format(tunnel.local_port)
-        client = marathon.MarathonClient(servers=marathon_url, timeout=600)
-        for container in app_containers:
-            # Check if app already exists
-            app_list = client.list_apps()
-            if container['name'] in [ a.id.strip('/') for a in app_list ]:
-                raise self.LaunchError('Found a running component named "{0}". '
-                                        'Is an environment is already '
-                                        'running?'.format(container['name']))
-            res = component_resources[container['name']]
-
-            in_str = 'instance' if res['instances'] == 1 else 'instances'
-            self._logger.info('Starting {0} {1} of {2}'.format(res['instances'],
-                                in_str, container['name']))
-
-            app = client.create_app(container['name'],
-                    marathon.models.MarathonApp(cmd=container['cmd'],
-                                                dependencies=container['dependencies'],
-                                                mem=res['mem'],
-                                                cpus=res['cpu'],
-                                                instances=res['instances'],
-                                                container=container['container'],
-                                                constraints=container['constraints']
-                                                ))
+            marathon_url = 'http://localhost:{0}'.format(tunnel.local_port)
+            client = marathon.MarathonClient(servers=marathon_url, timeout=600)
+            existing_apps = set( a.id.strip('/') for a in self._list_apps(tunnel) )
+            for container in app_containers:
+                # Check if app already exists
+                if container['name'] in existing_apps:
+                    raise self.LaunchError('Found a running component named "{0}". '
+                                            'Is an environment is already '
+                                            'running?'.format(container['name']))
+                res = component_resources[container['name']]
 
+                in_str = 'instance' if res['instances'] == 1 else 'instances'
+                self._logger.info('Starting {0} {1} of {2}'.format(res['instances'],
+                                    in_str, container['name']))
 
+                app = client.create_app(container['name'],
+                        marathon.models.MarathonApp(cmd=container['cmd'],
+                                                    dependencies=container['dependencies'],
+                                                    mem=res['mem'],
+                                                    cpus=res['cpu'],
+                                                    instances=res['instances'],
+                                                    container=container['container'],
+                                                    constraints=container['constraints']
+                                                    ))
 
-        # Wait for applications to start running
-        self._logger.debug('Waiting for components to start up...')
-        expected_containers = len(app_containers)
-        running_containers = []
-        start_time = time.time()
-        elapsed_time = 0
-        while (elapsed_time < defaults.app_launch_start_timeout and
-               len(running_containers) < expected_containers):
-            time.sleep(3)
-            for container in app_containers:
-                name = container['name']
-                if name in running_containers:
-                    continue
 
-                app = client.get_app(name)
 
-                # Examine Marathon tasks
-                if (app.tasks and
-                    len(app.tasks) == component_resources[name]['instances']):
-                    all_tasks_running = True
+        # Wait for applications to start running
+        with tracing.span('wait-components'):
+            self._logger.debug('Waiting for components to start up...')
+            expected_containers = len(app_containers)
+            running_containers = []
+            def all_running():
+                # Examine Marathon tasks of all components at once
+                app_tasks = {}
+                for task in self._marathon_get(tunnel, '/v2/tasks', jsonstream.parse_tasks):
+                    app_tasks.setdefault(task.app_id.strip('/'), []).append(task)
+
+                for container in app_containers:
+                    name = container['name']
+                    if name in running_containers:
+                        continue
+
+                    tasks = app_tasks.get(name, [])
                     # Ensure that all tasks (instances) are running
-                    for task in app.tasks:
-                        if not task.started_at:
-                            # If at least 1 task is not running
-                            all_tasks_running = False
-                            break
-                    if all_tasks_running:
+                    if (tasks and len(tasks) == component_resources[name]['instances'] and
+                        all( t.started for t in tasks )):
                         running_containers.append(name)
 
-            elapsed_time = time.time() - start_time
+                return len(running_containers) >= expected_containers
+
+            timed_out = not waiter.wait_until('components-running', all_running,
+                                              defaults.app_launch_start_timeout, initial=2)
 
 
         success = True
         launched = ', '.join(running_containers)
 
-        if elapsed_time >= defaults.app_launch_start_timeout:
+        if timed_out:
             self._logger.warning('Timed out waiting for components to launch')
             self._logger.warning('One or more containers are either have problems '
                                  'or are are taking very long to start')
@@ -612,6 +745,7 @@ class Environment(object):
         return success
 
 
+    @tracing.traced('expose-tunnel')
     def _expose_tunnel(self, tunnel_info, cluster_info, component_resources):
 
         tunnel_info_list = []
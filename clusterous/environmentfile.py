@@ -12,14 +12,61 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import logging
+import hashlib
+import tempfile
+import cPickle as pickle
+
 import yaml
-import os.path
 
 import helpers
 from helpers import SchemaEntry
 import defaults
 
+# Optional fields for a node group under the "cluster" section, mapped to expected type
+node_group_options = {
+                    'placement_group': bool,
+                    'ebs_optimized': bool,
+                    'warm_pool': int,
+                    'nfs_cache': bool,
+                    'role': str
+                    }
+
+# Schemas of an environment file, prepared once
+tunnel_schema = helpers.Schema({
+            'service': SchemaEntry(True, '', str, None),
+            'message': SchemaEntry(False, '', str, None)
+})
+env_schema = helpers.Schema({
+            'copy': SchemaEntry(False, [], list, None),
+            'image': SchemaEntry(False, [], list, None),
+            'build_machine': SchemaEntry(False, '', str, None),
+            'components': SchemaEntry(True, {}, dict, None),
+            # TODO: enhance validation such that expose_tunnel can be validated here
+            'expose_tunnel': SchemaEntry(False, {}, None, None)
+})
+top_schema = helpers.Schema({
+            'name': SchemaEntry(True, '', str, None),
+            'environment': SchemaEntry(False, {}, dict, env_schema),
+            'cluster': SchemaEntry(False, {}, dict, None)
+})
+component_schema = {
+            'machine': (True,),
+            'cpu': (True,),
+            'image': (True,),
+            'cmd': (False, None),
+            'attach_volume': (False, True),
+            'docker_network': (False, 'BRIDGE'),
+            'ports': (False, ''),
+            'count': (False, 1),
+            'depends': (False, ''),
+            'pull_policy': (False, defaults.default_pull_policy)
+}
+
+# Increment when the parsed form of environment files changes, to invalidate cached parses
+cache_format_version = 2
+
 class EnvironmentSpecError(Exception):
     pass
 
@@ -67,22 +114,24 @@ class DictValidator(object):
         Second element is default value.
         """
         self.schema = schema
+        self._mandatory = [ key for key, rules in schema.iteritems() if rules[0] ]
+        self._defaults = [ (key, rules[1]) for key, rules in schema.iteritems() if not rules[0] ]
 
     def validate(self, in_dict):
         """
         Runs validation on in_dict, returns a validated dict
         """
         ret = in_dict.copy()
-        for key, rules in self.schema.iteritems():
-            if rules[0] and key not in ret:
+        for key in self._mandatory:
+            if key not in ret:
                 raise ParseError('Missing mandatory key "{0}"'.format(key))
-            elif not rules[0] and key not in ret:
-                if rules[1] is not None:
-                    ret[key] = rules[1]
-                else:
-                    ret[key] = None
+        for key, default in self._defaults:
+            if key not in ret:
+                ret[key] = default
         return ret
 
+component_validator = DictValidator(component_schema)
+
 class EnvironmentFile(object):
     """
     Reads and parses an environment file
@@ -98,13 +147,11 @@ class EnvironmentFile(object):
         else:
             self._env_filename = env_file
 
-        yaml_data = self._read_yaml(self._env_filename)
-
         # Get base path
         abspath = os.path.abspath(self._env_filename)
         self.base_path = os.path.dirname(abspath)
 
-        self.spec = self._parse_environment_file(yaml_data, params)
+        self.spec = self._load_spec(self._env_filename, params)
 
     def get_full_path(self, rel_path):
         """
@@ -113,43 +160,74 @@ class EnvironmentFile(object):
         """
         return os.path.join(self.base_path, rel_path)
 
-    def _read_yaml(self, environment_file):
+    def _load_spec(self, environment_file, params):
         """
-        Loads environment file into yaml dictionary
+        Returns the parsed and validated spec of environment file. Parsed specs are
+        cached locally, keyed by the file's contents and params, so a file is only
+        parsed again when it (or params) change
         """
-
         if not os.path.isfile(environment_file):
             raise EnvironmentSpecError('Cannot open file')
 
-        stream = open(environment_file, 'r')
+        with open(environment_file, 'r') as stream:
+            contents = stream.read()
+
+        key = hashlib.sha1('{0}\0{1}\0{2}'.format(cache_format_version, sorted(params.items()), contents))
+        cache_file = os.path.join(os.path.expanduser(defaults.environment_cache_dir), key.hexdigest())
+        spec = self._read_cache(cache_file)
+        if spec is None:
+            spec = self._parse_environment_file(self._read_yaml(contents), params)
+            self._write_cache(cache_file, spec)
+        else:
+            self._logger.debug('Using cached parse of {0}'.format(environment_file))
+        return spec
 
+    def _read_yaml(self, contents):
+        """
+        Loads environment file contents into yaml dictionary
+        """
         try:
-            contents = yaml.load(stream)
+            return helpers.load_yaml(contents)
         except yaml.YAMLError as e:
             raise EnvironmentSpecError('Invalid YAML format: ' + str(e))
 
-        stream.close()
-        return contents
+    def _read_cache(self, cache_file):
+        """
+        Returns spec from cache_file, or None if it isn't cached (or is unreadable)
+        """
+        try:
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except IOError:
+            return None
+        except (EOFError, ValueError, TypeError, AttributeError, pickle.UnpicklingError) as e:
+            self._logger.debug('Ignoring corrupt cache file {0}: {1}'.format(cache_file, e))
+            return None
+
+    def _write_cache(self, cache_file, spec):
+        """
+        Writes spec to cache_file, removing the least recently written cached specs
+        beyond defaults.environment_cache_size. Failures are not errors
+        """
+        cache_dir = os.path.dirname(cache_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            # Write to a temporary file first, so that the cache never holds partial files
+            fd, temp_file = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(spec, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_file, cache_file)
+
+            cached = [ os.path.join(cache_dir, n) for n in os.listdir(cache_dir) ]
+            cached.sort(key=os.path.getmtime, reverse=True)
+            for old_file in cached[defaults.environment_cache_size:]:
+                os.remove(old_file)
+        except (IOError, OSError) as e:
+            self._logger.debug('Could not cache environment file: {0}'.format(e))
 
     def _parse_environment_file(self, data, params):
         parsed = {}
-        tunnel_schema = {
-                    'service': SchemaEntry(True, '', str, None),
-                    'message': SchemaEntry(False, '', str, None)
-        }
-        env_schema = {
-                    'copy': SchemaEntry(False, [], list, None),
-                    'image': SchemaEntry(False, [], list, None),
-                    'components': SchemaEntry(True, {}, dict, None),
-                    # TODO: enhance validation such that expose_tunnel can be validated here
-                    'expose_tunnel': SchemaEntry(False, {}, None, None)
-        }
-        top_schema = {
-                    'name': SchemaEntry(True, '', str, None),
-                    'environment': SchemaEntry(False, {}, dict, env_schema),
-                    'cluster': SchemaEntry(False, {}, dict, None)
-        }
-
         is_valid, message, validated = helpers.validate(data, top_schema)
 
         if not is_valid:
@@ -183,21 +261,9 @@ class EnvironmentFile(object):
 
     def _parse_components_section(self, comps):
         # Validate environment section using DictValidator
-        component_schema = {
-                            'machine': (True,),
-                            'cpu': (True,),
-                            'image': (True,),
-                            'cmd': (False, None),
-                            'attach_volume': (False, True),
-                            'docker_network': (False, 'BRIDGE'),
-                            'ports': (False, ''),
-                            'count': (False, 1),
-                            'depends': (False, '')
-                            }
-        validator = DictValidator(component_schema)
         new_comps = {}
         for component, fields in comps.iteritems():
-            validated_fields = validator.validate(fields)
+            validated_fields = component_validator.validate(fields)
             if (validated_fields['cpu'] != 'auto' and
                     not type(validated_fields['cpu']) in (int, float)):
                 raise ParseError('In "{0}", invalid value for "cpu": {1}'.format(component, type(validated_fields['cpu'])))
@@ -210,6 +276,8 @@ class EnvironmentFile(object):
                 raise ParseError('In "{0}", "docker_network" must be either "bridge" or "host"'.format(component))
             if validated_fields['docker_network'].upper() == 'HOST' and validated_fields['ports']:
                 raise ParseError('In "{0}", "ports" must not be specified if "docker_network" is "{1}"'.format(component, validated_fields['docker_network']))
+            if validated_fields['pull_policy'] not in defaults.pull_policies:
+                raise ParseError('In "{0}", "pull_policy" must be one of: {1}'.format(component, ', '.join(defaults.pull_policies)))
             new_comps[component] = validated_fields
 
         return new_comps
@@ -218,18 +286,39 @@ class EnvironmentFile(object):
         new_cluster = {}
         substituted_vars = []
         for machine, fields in cluster.iteritems():
-            if (len(fields) != 2 and
-                ('count' in fields and 'type' in fields)):
+            if not isinstance(fields, dict) or not ('count' in fields and 'type' in fields):
                 raise ParseError('Invalid values for machine "{0}"'.format(machine))
+            for field_name in fields:
+                if field_name not in ('count', 'type') and field_name not in node_group_options:
+                    raise ParseError('Unknown field "{0}" for machine "{1}"'.format(field_name, machine))
             new_cluster[machine] = {}
             for field_name, field_val in fields.iteritems():
+                if field_name == 'role':
+                    # A fixed name rather than a value, never substituted
+                    new_cluster[machine][field_name] = field_val
+                    continue
                 val, substituted, substituted_var = self._process_field_value(field_val, params)
                 if substituted:
                     substituted_vars.append(substituted_var)
+                if field_name in node_group_options and not isinstance(val, node_group_options[field_name]):
+                    raise ParseError('In machine "{0}", invalid value for "{1}": {2}'.format(machine, field_name, val))
                 new_cluster[machine][field_name] = val
                 if field_name == 'count' and substituted:
                     new_cluster[machine]['scalable'] = True
 
+        # A storage node (holding the shared volume instead of the controller) is a single, plain instance
+        storage = [ machine for machine, fields in new_cluster.iteritems() if 'role' in fields ]
+        for machine in storage:
+            fields = new_cluster[machine]
+            if fields['role'] != defaults.storage_role:
+                raise ParseError('In machine "{0}", unknown role "{1}"'.format(machine, fields['role']))
+            if fields['count'] != 1 or fields.get('scalable'):
+                raise ParseError('In machine "{0}", "count" must be 1 for role "{1}"'.format(machine, fields['role']))
+            if set(fields) - set(['count', 'type', 'role']):
+                raise ParseError('In machine "{0}", only "count" and "type" can be used with "role"'.format(machine))
+        if len(storage) > 1:
+            raise ParseError('Only one machine can have role "{0}"'.format(defaults.storage_role))
+
 
         # Check if params has any fields not substituted (possible user error)
         if set(substituted_vars) != set(params.keys()):
@@ -22,7 +22,8 @@ import collections
 
 from sshtunnel import SSHTunnelForwarder
 import sshtunnel
-from defaults import get_script, nat_ssh_port_forwarding
+import tracing
+from defaults import get_script
 
 
 class AnsibleHelper(object):
@@ -56,8 +57,10 @@ class AnsibleHelper(object):
                 '-c', 'ssh',
                 '--extra-vars', '@{0}'.format(vars_file), playbook_file]
         # print ' '.join(args)
-        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=run_env)
-        output, error = process.communicate()
+        with tracing.span('ansible', playbook=os.path.basename(playbook_file)):
+            tracing.count('ansible')
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=run_env)
+            output, error = process.communicate()
 
         if process.returncode != 0:
             logger.error('Ansible exited with code {0} when running {1}'.format(process.returncode, playbook_file))
@@ -73,67 +76,106 @@ class AnsibleHelper(object):
 
 SchemaEntry = collections.namedtuple('SchemaEntry', ['mandatory', 'default', 'type', 'schema'])
 
-def validate(d, schema, strict=True):
+try:
+    # libyaml based loader, much faster than the pure Python one
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+
+def load_yaml(stream):
     """
-    Runs validation on d, according to schema, returns a validated dict.
-    schema is a dictionary mapping field name (key) to a SchemaEntry.
-    If strict is True, all keys in d must be described in schema. If not,
-    d may contain keys not required by schema.
+    Parses YAML document in stream (a string or file) with the fastest available safe loader
     """
+    return yaml.load(stream, Loader=YAMLLoader)
 
-    copy = d
-
-    # First verify schema
-    for key, rules in schema.iteritems():
-        if key not in copy:
-            if rules.mandatory:
-                return False, 'Missing mandatory field "{0}"'.format(key), {}
-            elif not rules.mandatory:
-                copy[key] = rules.default
-        elif key in copy:
-            if type(copy[key]) == type(None):
-                return False, 'A valid value must be provided for field "{0}"'.format(key), {}
-            if rules.type:
-                if not rules.type == type(copy[key]):
-                    return False, 'For field "{0}", expected type "{1}", got "{2}"'.format(key, rules.type.__name__, type(copy[key]).__name__), {}
-                if rules.type == dict and rules.schema:
-                    # Recursively validate this nested dictionary
-                    success, message, validated = validate(copy[key], rules.schema, strict)
-                    if not success:
-                        return False, 'In {0}: {1}'.format(key, message), {}
-                    else:
+
+class Schema(dict):
+    """
+    Schema for validate(), prepared once so that it can validate many
+    dictionaries cheaply: nested schemas are themselves prepared in advance.
+    Behaves as the dictionary of field name to SchemaEntry it was created from
+    """
+    def __init__(self, schema):
+        super(Schema, self).__init__(schema)
+        self._entries = []
+        for key, rules in schema.iteritems():
+            nested = None
+            if rules.type == dict and rules.schema:
+                nested = rules.schema if isinstance(rules.schema, Schema) else Schema(rules.schema)
+            self._entries.append((key, rules, nested))
+
+    def validate(self, d, strict=True):
+        """
+        As validate(d, self, strict)
+        """
+        copy = d
+
+        # First verify schema
+        for key, rules, nested in self._entries:
+            if key not in copy:
+                if rules.mandatory:
+                    return False, 'Missing mandatory field "{0}"'.format(key), {}
+                # Copy list and dictionary defaults, as the schema is shared
+                default = rules.default
+                copy[key] = type(default)(default) if isinstance(default, (list, dict)) else default
+            else:
+                value = copy[key]
+                if value is None:
+                    return False, 'A valid value must be provided for field "{0}"'.format(key), {}
+                if rules.type:
+                    if not rules.type == type(value):
+                        return False, 'For field "{0}", expected type "{1}", got "{2}"'.format(key, rules.type.__name__, type(value).__name__), {}
+                    if nested is not None:
+                        # Recursively validate this nested dictionary
+                        success, message, validated = nested.validate(value, strict)
+                        if not success:
+                            return False, 'In {0}: {1}'.format(key, message), {}
                         copy[key] = validated
 
+        if strict:
+            for key in d:
+                if key not in self:
+                    return False, 'Unexpected field "{0}"'.format(key), {}
+
+        return True, '', copy
 
-    if strict:
-        for key, val in d.iteritems():
-            if key not in schema:
-                return False, 'Unexpected field "{0}"'.format(key), {}
 
-    return True, '', copy
+def validate(d, schema, strict=True):
+    """
+    Runs validation on d, according to schema, returns a validated dict.
+    schema is a dictionary mapping field name (key) to a SchemaEntry, or a
+    Schema made from one.
+    If strict is True, all keys in d must be described in schema. If not,
+    d may contain keys not required by schema.
+    """
+    if not isinstance(schema, Schema):
+        schema = Schema(schema)
+    return schema.validate(d, strict)
 
 
 class SSHTunnel(object):
     class TunnelException(Exception):
         pass
 
-    def __init__(self, host, username, key_file, remote_port, host_port=nat_ssh_port_forwarding):
+    def __init__(self, host, username, key_file, remote_port, host_port=22, proxy=None):
         """
         Returns tuple consisting of local port and sshtunnel SSHTunnelForwarder object.
-        Caller must call stop() on object when finished
+        proxy is an optional socket-like object (e.g. a channel through a bastion)
+        connected to host_port on host. Caller must call stop() on object when finished
         """
         logger = logging.getLogger('sshtunnel')
         logger.setLevel(logging.ERROR)
 
         try:
             self._server = SSHTunnelForwarder((host, host_port),
-                    ssh_username=username, ssh_private_key=key_file,
+                    ssh_username=username, ssh_private_key=key_file, ssh_proxy=proxy,
                     remote_bind_address=('127.0.0.1', remote_port), logger=logger)
         except sshtunnel.BaseSSHTunnelForwarderError as e:
             raise self.TunnelException(e)
 
 
     def connect(self):
+        tracing.count('ssh')
         self._server.start()
         self.local_port = self._server.local_bind_port
 
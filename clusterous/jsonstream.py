@@ -0,0 +1,92 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from collections import namedtuple
+
+import requests
+try:
+    # C backend (needs libyajl2), several times faster than the default pure Python one
+    import ijson.backends.yajl2_c as ijson
+except ImportError:
+    import ijson
+
+import defaults
+
+"""
+Incremental parsing of (potentially very large) Mesos and Marathon responses.
+Rather than building the whole document, items are parsed one at a time
+straight off the response stream and reduced to compact records holding only
+the fields Clusterous uses, so memory use depends on the number of records
+rather than on the size of the response
+"""
+
+# Raised for malformed or truncated JSON
+JSONError = ijson.common.JSONError
+
+Slave = namedtuple('Slave', ['hostname', 'active', 'name', 'cpus', 'mem', 'ip'])
+App = namedtuple('App', ['id', 'instances', 'constraints'])
+Constraint = namedtuple('Constraint', ['field', 'operator', 'value'])
+Task = namedtuple('Task', ['id', 'app_id', 'host', 'started'])
+
+
+def parse_slaves(stream):
+    """
+    Parses Mesos /master/slaves response, returns list of Slave
+    """
+    slaves = []
+    for s in ijson.items(stream, 'slaves.item'):
+        resources = s.get('resources', {})
+        slaves.append(Slave(s.get('hostname'), s.get('active', True), s.get('attributes', {}).get('name'),
+                            float(resources.get('cpus', 0)), float(resources.get('mem', 0)),
+                            _pid_ip(s.get('pid'))))
+    return slaves
+
+def _pid_ip(pid):
+    """
+    Returns the IP address in a libprocess PID (e.g. "slave(1)@10.0.0.5:5051"), or None
+    """
+    match = re.match(r'^[^@]*@([^:]+):\d+$', pid or '')
+    return match.group(1) if match else None
+
+def parse_apps(stream):
+    """
+    Parses Marathon /v2/apps response, returns list of App
+    """
+    apps = []
+    for a in ijson.items(stream, 'apps.item'):
+        constraints = [ Constraint(*(list(c) + [None])[:3]) for c in a.get('constraints') or [] ]
+        apps.append(App(a['id'], int(a.get('instances', 0)), constraints))
+    return apps
+
+def parse_tasks(stream):
+    """
+    Parses Marathon /v2/tasks or /v2/apps/{id}/tasks response, returns list of Task
+    """
+    return [ Task(t['id'], t.get('appId'), t.get('host'), bool(t.get('startedAt')))
+             for t in ijson.items(stream, 'tasks.item') ]
+
+def get(url, parse, session=requests, headers={}):
+    """
+    Requests url, returns the response body as parsed by parse, a function taking
+    a file-like object. Raises requests.exceptions.HTTPError on error status
+    """
+    r = session.get(url, headers=dict(headers, Accept='application/json'), stream=True,
+                    timeout=defaults.http_request_timeout)
+    try:
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return parse(r.raw)
+    finally:
+        r.close()
@@ -0,0 +1,134 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import logging
+import threading
+import collections
+
+import requests
+
+import defaults
+import jsonstream
+import waiter
+
+"""
+Client for the HTTP API of the Mesos master on the controller. Only the
+endpoints needed are requested (e.g. /master/slaves rather than the whole of
+/master/state.json, which includes the history of every task and framework),
+and responses are parsed incrementally (see jsonstream.py) into compact
+records, cached for a short time and revalidated by ETag
+"""
+
+
+class MesosClient(object):
+    """
+    Queries the Mesos master through a tunnel to the controller, opened on first
+    use and kept until close(). Cached responses outlive the tunnel
+    """
+    def __init__(self, cluster, ttl=defaults.mesos_cache_ttl):
+        self._cluster = cluster
+        self._ttl = ttl
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._tunnel = None
+        self._session = None
+        # Path to (time fetched, ETag, parsed response), shared by threads using the client
+        self._cache = {}
+
+    def _base_url(self):
+        with self._lock:
+            if self._tunnel is None:
+                tunnel = self._cluster.make_controller_tunnel(defaults.mesos_port)
+                tunnel.connect()
+                self._tunnel = tunnel
+                self._session = requests.Session()
+            return 'http://localhost:{0}'.format(self._tunnel.local_port)
+
+    def get(self, path, parse, max_age=None):
+        """
+        Returns response of the master to GET path as parsed by parse (a function
+        taking a file-like object), from the cache if it was fetched less than
+        max_age (by default the client's TTL) seconds ago
+        """
+        max_age = self._ttl if max_age is None else max_age
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached and time.time() - cached[0] < max_age:
+            return cached[2]
+
+        headers = {'Accept': 'application/json'}
+        if cached and cached[1]:
+            headers['If-None-Match'] = cached[1]
+        url = self._base_url() + path
+        r = self._session.get(url, headers=headers, stream=True, timeout=defaults.http_request_timeout)
+        try:
+            if r.status_code == 304 and cached:
+                # A 304 need not repeat the ETag
+                etag = r.headers.get('ETag') or cached[1]
+                data = cached[2]
+            else:
+                r.raise_for_status()
+                r.raw.decode_content = True
+                etag = r.headers.get('ETag')
+                data = parse(r.raw)
+        finally:
+            r.close()
+        with self._lock:
+            self._cache[path] = (time.time(), etag, data)
+        return data
+
+    def slaves(self, max_age=None):
+        """
+        Returns list of the slaves (nodes) registered with the master, as
+        jsonstream.Slave records
+        """
+        return self.get('/master/slaves', jsonstream.parse_slaves, max_age)
+
+    def slave_counts(self, max_age=None):
+        """
+        Returns dictionary of node name (the "name" attribute) to number of
+        active slaves with that name
+        """
+        counts = collections.Counter( s.name for s in self.slaves(max_age) if s.active )
+        return dict(counts)
+
+    def wait_for_slaves(self, expected, timeout):
+        """
+        Waits until the number of active slaves of each name is as in expected, a
+        dictionary of node name to count. Returns False on timeout
+        """
+        def ready():
+            try:
+                counts = self.slave_counts(max_age=0)
+            except (requests.exceptions.RequestException, jsonstream.JSONError) as e:
+                # The master may still be starting up
+                self._logger.debug('Could not get slaves from Mesos: {0}'.format(e))
+                return False
+            return all( counts.get(name, 0) == count for name, count in expected.iteritems() )
+        return bool(waiter.wait_until('mesos-slaves', ready, timeout))
+
+    def close(self):
+        with self._lock:
+            if self._tunnel is not None:
+                self._session.close()
+                self._tunnel.close()
+                self._tunnel = None
+                self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
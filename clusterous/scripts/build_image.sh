@@ -0,0 +1,40 @@
+#!/bin/sh
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Builds a Docker image on a node, as a Mesos task, from a build context on the
+# shared volume, and pushes it (and its layer cache) to the private registry.
+# Writes the build output to <output>.log and the exit status to <output>.status
+#
+# Usage: build_image.sh <context folder> <image> <cache image> <output>
+
+context=$1
+image=$2
+cache=$3
+output=$4
+
+(
+    docker pull "$cache"
+    cache_from=''
+    if docker build --help | grep -q -- --cache-from; then
+        cache_from="--cache-from=$cache"
+    fi
+    docker build -t="$image" $cache_from "$context" && docker push "$image" || exit 1
+    docker tag "$image" "$cache" && docker push "$cache"
+    exit 0
+) > "$output.log" 2>&1
+echo $? > "$output.status"
+
+# Marathon restarts tasks that exit, so wait until the build is removed
+exec sleep 86400
@@ -0,0 +1,228 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+
+import yaml
+
+import defaults
+
+"""
+Local store for the state of all clusters managed from this machine
+"""
+
+_schema = [
+    'CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE IF NOT EXISTS cluster_info (cluster_name TEXT, key TEXT, value TEXT, '
+        'PRIMARY KEY (cluster_name, key))',
+    'CREATE TABLE IF NOT EXISTS nodes (cluster_name TEXT, instance_id TEXT, node_name TEXT, '
+        'instance_type TEXT, private_ip TEXT, state TEXT, warm_pool INTEGER, updated REAL, '
+        'PRIMARY KEY (cluster_name, instance_id))',
+    'CREATE TABLE IF NOT EXISTS tunnels (cluster_name TEXT, local_port INTEGER, remote_port INTEGER, '
+        'sock_file TEXT, created REAL, PRIMARY KEY (cluster_name, local_port))',
+    'CREATE TABLE IF NOT EXISTS operations (id INTEGER PRIMARY KEY AUTOINCREMENT, cluster_name TEXT, '
+        'operation TEXT, started REAL, finished REAL, success INTEGER)'
+]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """
+    Returns the StateStore shared by the whole process, creating it if necessary
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore()
+    return _store
+
+
+class StateStore(object):
+    """
+    Transactional store for cluster info, node inventory, tunnels and operation
+    history, backed by SQLite in WAL mode. Cluster info and settings are read
+    from disk once, and subsequently served from memory
+    """
+    def __init__(self, db_file=None):
+        self._logger = logging.getLogger(__name__)
+        self._db_file = os.path.expanduser(db_file if db_file else defaults.state_db_file)
+        self._lock = threading.RLock()
+
+        db_dir = os.path.dirname(self._db_file)
+        if not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        self._conn = sqlite3.connect(self._db_file, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            for statement in _schema:
+                self._conn.execute(statement)
+            # Node inventories written before the warm pool was recorded
+            if 'warm_pool' not in [ c[1] for c in self._conn.execute('PRAGMA table_info(nodes)') ]:
+                self._conn.execute('ALTER TABLE nodes ADD COLUMN warm_pool INTEGER')
+
+        self._settings = dict(self._conn.execute('SELECT key, value FROM settings'))
+        self._cluster_info = {}
+        for cluster_name, key, value in self._conn.execute('SELECT cluster_name, key, value FROM cluster_info'):
+            self._cluster_info.setdefault(cluster_name, {})[key] = yaml.safe_load(value)
+
+        self._import_cluster_info_file()
+        self._migrate_local_files()
+
+    def _import_cluster_info_file(self):
+        """
+        Imports the YAML cluster info file used by older versions, if present
+        """
+        info_file = os.path.expanduser(defaults.cluster_info_file)
+        if not os.path.isfile(info_file):
+            return
+
+        with open(info_file, 'r') as stream:
+            info = yaml.load(stream) or {}
+
+        if info.get('cluster_name'):
+            self._logger.debug('Importing {0}'.format(info_file))
+            self.update_cluster_info(info['cluster_name'], info)
+            self.set_working_cluster(info['cluster_name'])
+        os.remove(info_file)
+
+    def _migrate_local_files(self):
+        """
+        Moves the environment cache that older versions kept directly in the local
+        config dir into the working cluster's local dir. The controller inventory
+        kept there is removed, as it is written again when needed
+        """
+        config_dir = os.path.expanduser(defaults.local_config_dir)
+        old_inventory = os.path.join(config_dir, defaults.current_nat_ip_file)
+        old_environment = os.path.join(config_dir, defaults.local_environment_dir)
+        cluster_name = self.get_working_cluster()
+
+        if os.path.isdir(old_environment) and cluster_name:
+            cluster_dir = os.path.expanduser(defaults.local_cluster_dir_format.format(cluster_name))
+            new_environment = os.path.join(cluster_dir, defaults.local_environment_dir)
+            if not os.path.exists(new_environment):
+                self._logger.debug('Moving {0} to {1}'.format(old_environment, new_environment))
+                if not os.path.isdir(cluster_dir):
+                    os.makedirs(cluster_dir)
+                shutil.move(old_environment, new_environment)
+        if os.path.isfile(old_inventory):
+            os.remove(old_inventory)
+
+    def get_working_cluster(self):
+        return self._settings.get('working_cluster')
+
+    def set_working_cluster(self, cluster_name):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)',
+                               ('working_cluster', cluster_name))
+            self._settings['working_cluster'] = cluster_name
+
+    def get_cluster_names(self):
+        return sorted(self._cluster_info.keys())
+
+    def get_cluster_info(self, cluster_name):
+        """
+        Returns a copy of the info dictionary of cluster_name, empty if unknown
+        """
+        return dict(self._cluster_info.get(cluster_name, {}))
+
+    def update_cluster_info(self, cluster_name, info):
+        """
+        Adds or updates values in the info of cluster_name, in a single transaction.
+        Existing values not in info are left untouched
+        """
+        rows = [ (cluster_name, k, yaml.safe_dump(v)) for k, v in info.iteritems() ]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO cluster_info (cluster_name, key, value) '
+                                   'VALUES (?, ?, ?)', rows)
+            self._cluster_info.setdefault(cluster_name, {}).update(info)
+
+    def delete_cluster(self, cluster_name):
+        """
+        Removes all info, nodes and tunnels of cluster_name. Operation history is kept
+        """
+        with self._lock, self._conn:
+            for table in ('cluster_info', 'nodes', 'tunnels'):
+                self._conn.execute('DELETE FROM {0} WHERE cluster_name = ?'.format(table), (cluster_name,))
+            if self._settings.get('working_cluster') == cluster_name:
+                self._conn.execute('DELETE FROM settings WHERE key = ?', ('working_cluster',))
+                del self._settings['working_cluster']
+            self._cluster_info.pop(cluster_name, None)
+
+    def set_nodes(self, cluster_name, nodes):
+        """
+        Replaces the node inventory of cluster_name. nodes is a list of dictionaries
+        with instance_id, node_name, instance_type, private_ip, state and whether
+        the node is in the warm_pool
+        """
+        now = time.time()
+        rows = [ (cluster_name, n['instance_id'], n['node_name'], n['instance_type'],
+                  n['private_ip'], n['state'], 1 if n['warm_pool'] else 0, now) for n in nodes ]
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM nodes WHERE cluster_name = ?', (cluster_name,))
+            self._conn.executemany('INSERT INTO nodes (cluster_name, instance_id, node_name, instance_type, '
+                                   'private_ip, state, warm_pool, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def get_nodes(self, cluster_name):
+        """
+        Returns the node inventory of cluster_name, as given to set_nodes
+        """
+        with self._lock:
+            cursor = self._conn.execute('SELECT instance_id, node_name, instance_type, private_ip, state, '
+                                        'warm_pool FROM nodes WHERE cluster_name = ?', (cluster_name,))
+            return [ dict(zip(('instance_id', 'node_name', 'instance_type', 'private_ip', 'state'), r[:5]),
+                          warm_pool=bool(r[5])) for r in cursor ]
+
+    def add_tunnel(self, cluster_name, local_port, remote_port, sock_file):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO tunnels (cluster_name, local_port, remote_port, '
+                               'sock_file, created) VALUES (?, ?, ?, ?, ?)',
+                               (cluster_name, int(local_port), int(remote_port), sock_file, time.time()))
+
+    def get_tunnels(self, cluster_name):
+        with self._lock:
+            cursor = self._conn.execute('SELECT local_port, remote_port, sock_file FROM tunnels '
+                                        'WHERE cluster_name = ?', (cluster_name,))
+            return [ dict(zip(('local_port', 'remote_port', 'sock_file'), r)) for r in cursor ]
+
+    def delete_tunnel(self, cluster_name, local_port):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM tunnels WHERE cluster_name = ? AND local_port = ?',
+                               (cluster_name, int(local_port)))
+
+    def start_operation(self, cluster_name, operation):
+        """
+        Records the start of an operation on cluster_name, returns its id
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute('INSERT INTO operations (cluster_name, operation, started) '
+                                        'VALUES (?, ?, ?)', (cluster_name, operation, time.time()))
+            return cursor.lastrowid
+
+    def finish_operation(self, operation_id, success):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE operations SET finished = ?, success = ? WHERE id = ?',
+                               (time.time(), 1 if success else 0, operation_id))
+
+    def get_operations(self, cluster_name, limit=20):
+        with self._lock:
+            cursor = self._conn.execute('SELECT operation, started, finished, success FROM operations '
+                                        'WHERE cluster_name = ? ORDER BY id DESC LIMIT ?', (cluster_name, limit))
+            return [ dict(zip(('operation', 'started', 'finished', 'success'), r)) for r in cursor ]
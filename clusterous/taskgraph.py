@@ -0,0 +1,136 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import logging
+import collections
+
+from concurrent import futures
+
+import defaults
+import tracing
+import waiter
+
+"""
+Runs the steps of an operation (AWS calls, SSH sessions, HTTP requests,
+Ansible runs) as a graph of tasks, so that steps that do not depend on each
+other overlap. Tasks run in a thread pool; each runs once all the tasks it
+requires have completed, in its own trace span and within the deadline of the
+graph. The caller blocks until the whole graph has run
+"""
+
+
+class Task(object):
+    def __init__(self, name, func, requires):
+        self.name = name
+        self.func = func
+        self.requires = requires
+        self.done = False
+        self.result = None
+
+
+class TaskGraph(object):
+    """
+    Tasks, each a function taking no arguments, and the tasks they require.
+    Tasks must be added after the tasks they require, so the graph is acyclic
+    """
+    def __init__(self, max_workers=defaults.task_graph_max_workers):
+        self._logger = logging.getLogger(__name__)
+        self._max_workers = max_workers
+        self._tasks = collections.OrderedDict()
+
+    def add(self, name, func, requires=()):
+        if name in self._tasks:
+            raise ValueError('Task "{0}" already added'.format(name))
+        for r in requires:
+            if r not in self._tasks:
+                raise ValueError('Task "{0}" requires unknown task "{1}"'.format(name, r))
+        self._tasks[name] = Task(name, func, tuple(requires))
+        return name
+
+    def result(self, name):
+        """
+        Returns the value returned by a completed task
+        """
+        task = self._tasks[name]
+        if not task.done:
+            raise ValueError('Task "{0}" has not completed'.format(name))
+        return task.result
+
+    def run(self, timeout=None):
+        """
+        Runs all tasks, for up to timeout seconds of waiting. Returns dictionary of
+        task name to result.
+
+        If a task raises an exception, no more tasks are started and waits in
+        running tasks are cancelled. Once running tasks have finished, the
+        exception of the first task to fail is raised
+        """
+        pending = collections.OrderedDict(self._tasks)
+        running = {}
+        failure = None
+        trace_context = tracing.context()
+        with waiter.deadline(timeout) as limit:
+            executor = futures.ThreadPoolExecutor(max_workers=min(self._max_workers, len(pending) or 1))
+            try:
+                while pending or running:
+                    if failure is None:
+                        for name, task in pending.items():
+                            if all( self._tasks[r].done for r in task.requires ):
+                                del pending[name]
+                                running[executor.submit(self._run_task, task, trace_context, limit)] = task
+                    if not running:
+                        break
+                    # Wait with a timeout, so that KeyboardInterrupt is still delivered
+                    done, not_done = futures.wait(running.keys(), timeout=defaults.wait_cancel_check_interval,
+                                                  return_when=futures.FIRST_COMPLETED)
+                    for f in done:
+                        task = running.pop(f)
+                        exc_info = f.result()
+                        if exc_info is None:
+                            task.done = True
+                        elif failure is None:
+                            self._logger.debug('Task "{0}" failed, cancelling remaining tasks'.format(task.name))
+                            failure = exc_info
+                            limit.cancel()
+            except BaseException:
+                limit.cancel()
+                raise
+            finally:
+                executor.shutdown(wait=True)
+
+        if failure is not None:
+            raise failure[0], failure[1], failure[2]
+        return dict( (name, task.result) for name, task in self._tasks.iteritems() )
+
+    def _run_task(self, task, trace_context, limit):
+        """
+        Runs task in a worker thread, returns exc_info if it raised an exception
+        """
+        try:
+            with tracing.attach(trace_context), waiter.deadline(parent=limit), tracing.span(task.name):
+                task.result = task.func()
+            return None
+        except Exception:
+            return sys.exc_info()
+
+
+def run_all(tasks, timeout=None, max_workers=defaults.task_graph_max_workers):
+    """
+    Runs (name, func) pairs concurrently, returns dictionary of name to result
+    """
+    graph = TaskGraph(max_workers)
+    for name, func in tasks:
+        graph.add(name, func)
+    return graph.run(timeout)
@@ -0,0 +1,268 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import functools
+import itertools
+import threading
+import contextlib
+import collections
+
+import defaults
+
+"""
+Tracing of Clusterous operations as nested, timed spans. Tracing is off unless
+enabled (e.g. by the --trace command line option), in which case spans are
+recorded along with the number of AWS, SSH, Ansible and HTTP calls made within
+them, and can be saved as JSON or in Chrome trace format along with any other
+metrics (see add_metrics)
+"""
+
+trace_formats = ('json', 'chrome')
+
+
+class Span(object):
+    """
+    A timed phase of an operation. counts includes calls made in nested spans
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, name, parent, tags):
+        self.id = next(self._ids)
+        self.name = name
+        self.parent_id = parent.id if parent else None
+        self.depth = parent.depth + 1 if parent else 0
+        self.thread_id = threading.current_thread().ident
+        self.tags = tags
+        self.counts = collections.Counter()
+        self.start = time.time()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def as_dict(self):
+        return {'id': self.id, 'parent_id': self.parent_id, 'name': self.name,
+                'thread_id': self.thread_id, 'start': self.start, 'end': self.end,
+                'duration': self.duration, 'tags': self.tags, 'counts': dict(self.counts)}
+
+
+class Tracer(object):
+    """
+    Records spans. Spans started in a thread nest within the span that thread
+    currently has open, if any
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans = []
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, **tags):
+        stack = self._stack()
+        s = Span(name, stack[-1] if stack else None, tags)
+        with self._lock:
+            self.spans.append(s)
+        stack.append(s)
+        try:
+            yield s
+        except BaseException as e:
+            s.tags['error'] = type(e).__name__
+            raise
+        finally:
+            s.end = time.time()
+            stack.pop()
+
+    def count(self, name, n=1):
+        """
+        Adds n calls of type name to all spans open in this thread
+        """
+        # Spans may be shared with threads running tasks within them
+        with self._lock:
+            for s in self._stack():
+                s.counts[name] += n
+
+    def context(self):
+        """
+        Returns the spans open in this thread, for use with attach in another thread
+        """
+        return list(self._stack())
+
+    @contextlib.contextmanager
+    def attach(self, context):
+        """
+        Nests spans started in this thread within context, the spans open in
+        another thread, and counts calls in them
+        """
+        previous = self._stack()
+        self._local.stack = list(context)
+        try:
+            yield
+        finally:
+            self._local.stack = previous
+
+    def to_json(self):
+        with self._lock:
+            spans = [ s.as_dict() for s in self.spans ]
+        return {'spans': spans, 'metrics': dict( (name, func()) for name, func in _metrics.items() )}
+
+    def to_chrome_trace(self):
+        """
+        Returns spans as complete ("X") events of the Chrome trace event format,
+        viewable in chrome://tracing
+        """
+        pid = os.getpid()
+        events = []
+        with self._lock:
+            for s in self.spans:
+                args = dict(s.tags)
+                args.update(s.counts)
+                events.append({'name': s.name, 'cat': 'clusterous', 'ph': 'X', 'pid': pid,
+                               'tid': s.thread_id, 'ts': int(s.start * 1e6),
+                               'dur': int(s.duration * 1e6), 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': dict( (name, func()) for name, func in _metrics.items() )}
+
+    def save(self, trace_format='json', directory=defaults.local_session_data_dir):
+        """
+        Writes trace to a new file in directory, returns its path
+        """
+        if trace_format not in trace_formats:
+            raise ValueError('Unknown trace format "{0}"'.format(trace_format))
+        directory = os.path.expanduser(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, 'trace-{0}-{1}.json'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+        data = self.to_json() if trace_format == 'json' else self.to_chrome_trace()
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+        return path
+
+    def report(self, max_depth=2):
+        """
+        Returns list of (name, duration, percentage of root span, counts) for
+        spans up to max_depth, in the order they started
+        """
+        with self._lock:
+            spans = [ s for s in self.spans if s.depth <= max_depth ]
+        by_id = dict( (s.id, s) for s in spans )
+        rows = []
+        for s in spans:
+            root = s
+            while root.parent_id is not None:
+                root = by_id[root.parent_id]
+            total = root.duration
+            rows.append(('  ' * s.depth + s.name, s.duration,
+                         100.0 * s.duration / total if total else 100.0, dict(s.counts)))
+        return rows
+
+
+_tracer = None
+_instrumented = False
+_metrics = {}
+
+def enable():
+    """
+    Starts recording spans for the rest of this process, returns the Tracer
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+        _instrument()
+    return _tracer
+
+def get_tracer():
+    """
+    Returns the Tracer, or None if tracing is not enabled
+    """
+    return _tracer
+
+def span(name, **tags):
+    """
+    Context manager timing a phase named name. Does nothing if tracing is not enabled
+    """
+    if _tracer is None:
+        return _null_span()
+    return _tracer.span(name, **tags)
+
+def count(name, n=1):
+    """
+    Records n calls of type name (e.g. 'ssh') in the current spans
+    """
+    if _tracer is not None:
+        _tracer.count(name, n)
+
+def context():
+    """
+    Returns the spans open in this thread (see Tracer.context)
+    """
+    if _tracer is None:
+        return []
+    return _tracer.context()
+
+def attach(context):
+    """
+    Context manager nesting spans in this thread within context (see Tracer.attach)
+    """
+    if _tracer is None:
+        return _null_span()
+    return _tracer.attach(context)
+
+def add_metrics(name, func):
+    """
+    Includes the result of func, a JSON serialisable dictionary, in saved traces
+    """
+    _metrics[name] = func
+
+def traced(name):
+    """
+    Decorator running the function in a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextlib.contextmanager
+def _null_span():
+    yield None
+
+def _instrument():
+    """
+    Counts requests made through requests (used by the Marathon client). AWS
+    calls are counted by awsmiddleware
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    _instrumented = True
+
+    import requests.sessions
+
+    request = requests.sessions.Session.request
+    def counted_request(session, method, url, *args, **kwargs):
+        count('http')
+        return request(session, method, url, *args, **kwargs)
+    requests.sessions.Session.request = counted_request
@@ -0,0 +1,214 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import random
+import logging
+import threading
+import contextlib
+
+import defaults
+import tracing
+
+"""
+Waiting for conditions (instances running, volumes attached, applications
+started, etc.) by polling with jittered exponential backoff. Waits are bounded
+by deadlines, which nest: a wait inside "with deadline(...)" ends no later than
+the enclosing deadline, and stops early if the deadline is cancelled (e.g. by
+another thread working on the same operation)
+"""
+
+
+class Deadline(object):
+    """
+    Point in time by which waits must finish, within any parent deadline. A
+    timeout of None means no limit of its own. Cancelling a deadline also
+    cancels all deadlines nested within it
+    """
+    def __init__(self, timeout=None, parent=None):
+        self.parent = parent
+        self._expires = time.time() + timeout if timeout is not None else None
+        self._cancelled = threading.Event()
+
+    def remaining(self):
+        """
+        Returns seconds left (possibly 0), or None if there is no limit
+        """
+        remaining = None
+        if self._expires is not None:
+            remaining = max(0.0, self._expires - time.time())
+        if self.parent is not None:
+            parent_remaining = self.parent.remaining()
+            if remaining is None or (parent_remaining is not None and parent_remaining < remaining):
+                remaining = parent_remaining
+        return remaining
+
+    def expired(self):
+        return self.remaining() == 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+
+class WaitStats(object):
+    """
+    Totals of waits, polls, timeouts and time spent waiting, by name of wait
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waits = {}
+
+    def record(self, name, polls, waited, outcome):
+        with self._lock:
+            if name not in self._waits:
+                self._waits[name] = {'waits': 0, 'polls': 0, 'waited': 0.0,
+                                     'timeouts': 0, 'cancelled': 0}
+            w = self._waits[name]
+            w['waits'] += 1
+            w['polls'] += polls
+            w['waited'] += waited
+            if outcome in ('timeouts', 'cancelled'):
+                w[outcome] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict( (name, dict(w)) for name, w in self._waits.iteritems() )
+
+
+class Waiter(object):
+    """
+    Polls a condition, waiting initial seconds after the first poll and
+    multiplying the interval by multiplier after each one, up to max_interval.
+    Each interval is randomly shortened by up to the jitter fraction, so that
+    concurrent waits do not poll in lockstep
+    """
+    def __init__(self, name, initial=defaults.wait_initial_interval, max_interval=defaults.wait_max_interval,
+                 multiplier=defaults.wait_backoff_multiplier, jitter=defaults.wait_jitter):
+        self.name = name
+        self.initial = initial
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+
+    def intervals(self):
+        """
+        Generates the (jittered) intervals between polls
+        """
+        interval = self.initial
+        while True:
+            yield interval * (1 - random.uniform(0, self.jitter))
+            interval = min(self.max_interval, interval * self.multiplier)
+
+    def wait(self, condition, timeout=None, max_polls=None):
+        """
+        Calls condition until it returns a true value, for up to timeout seconds
+        (and within the current deadline, if any), at most max_polls times.
+
+        Returns the true value returned by condition, or None on timeout or
+        cancellation. Exceptions raised by condition are not caught
+        """
+        logger = logging.getLogger(__name__)
+        polls = 0
+        start = time.time()
+        outcome = 'timeouts'
+        result = None
+        with tracing.span('wait', wait=self.name) as span, deadline(timeout) as limit:
+            intervals = self.intervals()
+            while True:
+                polls += 1
+                tracing.count('polls')
+                result = condition()
+                if result:
+                    outcome = 'done'
+                    break
+                if max_polls is not None and polls >= max_polls:
+                    break
+                if not _sleep(next(intervals), limit):
+                    outcome = 'cancelled' if limit.cancelled else 'timeouts'
+                    break
+            if span is not None:
+                span.tags.update({'polls': polls, 'outcome': outcome})
+
+        waited = time.time() - start
+        _stats.record(self.name, polls, waited, outcome)
+        if outcome != 'done':
+            logger.debug('Wait for {0} ended after {1} polls ({2:.1f} seconds): {3}'.format(
+                         self.name, polls, waited, outcome))
+            return None
+        return result
+
+
+_local = threading.local()
+_stats = WaitStats()
+tracing.add_metrics('waits', _stats.as_dict)
+
+def current_deadline():
+    """
+    Returns the innermost deadline in effect in this thread, or None
+    """
+    return getattr(_local, 'deadline', None)
+
+@contextlib.contextmanager
+def deadline(timeout=None, parent=None):
+    """
+    Context manager bounding all waits in this thread to timeout seconds, within
+    parent (by default the current deadline). Yields the Deadline, which may be
+    passed to other threads as their parent, or cancelled
+    """
+    previous = current_deadline()
+    d = Deadline(timeout, parent if parent is not None else previous)
+    _local.deadline = d
+    try:
+        yield d
+    finally:
+        _local.deadline = previous
+
+def _sleep(seconds, limit):
+    """
+    Sleeps for up to seconds, in slices so that cancellation is noticed.
+    Returns False if the deadline has passed or been cancelled
+    """
+    end = time.time() + seconds
+    while not limit.cancelled:
+        remaining = limit.remaining()
+        if remaining == 0:
+            return False
+        now = time.time()
+        if now >= end:
+            return True
+        time.sleep(min([ t for t in (end - now, remaining, defaults.wait_cancel_check_interval) if t is not None ]))
+    return False
+
+def wait_until(name, condition, timeout=None, max_polls=None, **kwargs):
+    """
+    Waits until condition returns a true value, polling with backoff. kwargs
+    are passed to Waiter. Returns the value, or None on timeout or cancellation
+    """
+    return Waiter(name, **kwargs).wait(condition, timeout, max_polls)
+
+def sleep(name, seconds):
+    """
+    Sleeps for seconds, or until the current deadline passes or is cancelled.
+    Returns False in the latter case
+    """
+    start = time.time()
+    with tracing.span('wait', wait=name), deadline() as limit:
+        completed = _sleep(seconds, limit)
+    outcome = 'done' if completed else ('cancelled' if limit.cancelled else 'timeouts')
+    _stats.record(name, 0, time.time() - start, outcome)
+    return completed
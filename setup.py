@@ -31,6 +31,7 @@ setup(name='clusterous',
       package_data={'clusterous': [
                         'scripts/ansible/*.yml',
                         'scripts/ansible/hosts',
+                        'scripts/ansible/*.j2',
                         'scripts/ansible/remote/*',
                         'scripts/*.sh',
                         'scripts/*.yml'
@@ -38,6 +39,6 @@ setup(name='clusterous',
       install_requires=['pyyaml', 'pytest', 'mock', 'paramiko', 'ecdsa', 'futures', 
                         'botocore', 'boto', 'boto3', 'ansible', 'requests',
                         'marathon', 'sshtunnel', 'python-dateutil',
-                        'tabulate', 'netaddr'],
+                        'tabulate', 'netaddr', 'ijson'],
       **extra
       )
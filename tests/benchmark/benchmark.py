@@ -0,0 +1,241 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline benchmark of Clusterous commands against local stand-ins for AWS
+(moto), Mesos, Marathon and SSH. Reports API calls, wall time and peak memory
+of each command at several cluster sizes
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import traceback
+import subprocess
+import collections
+
+import yaml
+import tabulate
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(benchmark_dir)))
+
+region = 'ap-southeast-2'
+cluster_name = 'benchmark'
+special_node_types = ('nat', 'controller', 'central-logging', 'storage')
+categories = ('aws', 'ssh', 'http', 'exec')
+
+
+def _measure(name, func, recorder, clock, memory, log_file, tracer, aws_stats):
+    """
+    Runs func as a single command, returns its measurements
+    """
+    from simulation import read_exec_log
+
+    before = recorder.snapshot()
+    aws_before = aws_stats.totals()
+    first_span = len(tracer.spans)
+    slept = clock.slept
+    memory.reset()
+    success = True
+    error = ''
+    start = time.time()
+    try:
+        result = func()
+        if isinstance(result, tuple):
+            success = bool(result[0])
+        elif result is False:
+            success = False
+    except Exception as e:
+        success = False
+        # boto errors carry the whole response body, the message will do
+        error = '{0}: {1}'.format(type(e).__name__, getattr(e, 'error_message', None) or e)
+        logging.getLogger(__name__).debug(traceback.format_exc())
+    wall_time = time.time() - start
+    read_exec_log(log_file, recorder)
+
+    calls = recorder.snapshot()
+    calls.subtract(before)
+    breakdown = dict( ('{0} {1}'.format(c, n), v) for (c, n), v in calls.items() if v )
+    totals = dict( (c, sum(v for (cat, n), v in calls.items() if cat == c)) for c in categories )
+    aws_after = aws_stats.totals()
+
+    return {'command': name, 'success': success, 'error': error,
+            'wall_time': wall_time, 'simulated_wait': clock.slept - slept,
+            'peak_rss': memory.peak(), 'calls': totals, 'breakdown': breakdown,
+            'aws_retries': aws_after['retries'] - aws_before['retries'],
+            'spans': [ s.as_dict() for s in tracer.spans[first_span:] ]}
+
+
+def run_scale(num_nodes, latency_args, aws_throttle=0.0, subnet_prefixlen=24):
+    """
+    Creates, uses and destroys a cluster of num_nodes workers against the
+    stand-ins, in this process, with subnets the size of a /subnet_prefixlen
+    network. Returns list of measurements, one per command
+    """
+    work_dir = tempfile.mkdtemp(prefix='clusterous-benchmark-')
+    log_file = os.path.join(work_dir, 'exec.log')
+    os.environ['HOME'] = work_dir
+    os.environ['PATH'] = os.path.join(benchmark_dir, 'fakebin') + os.pathsep + os.environ.get('PATH', '')
+    os.environ['CLUSTEROUS_BENCHMARK_LOG'] = log_file
+    os.environ['CLUSTEROUS_BENCHMARK_EXEC_LATENCY'] = str(latency_args['exec_'])
+
+    import paramiko
+    from simulation import Recorder, Latency, VirtualClock, MemorySampler, SSHRedirect
+    from fake_aws import FakeAWS, running_instances
+    from fake_mesos import FakeMesos, FakeMarathon
+    from fake_ssh import StubSSHServer
+    from clusterous import clusterousmain, defaults, tracing, awsmiddleware, waiter
+    import boto.connection
+
+    recorder = Recorder()
+    latency = Latency(**latency_args)
+    clock = VirtualClock()
+    memory = MemorySampler()
+    tracer = tracing.enable()
+
+    # Polling loops, fixed waits, rate limiting and retry backoff run on virtual time
+    waiter.time = clock
+    awsmiddleware.time = clock
+    boto.connection.time = clock
+    aws_stats = awsmiddleware.get_middleware().stats
+
+    key_file = os.path.join(work_dir, 'benchmark.pem')
+    paramiko.RSAKey.generate(1024).write_private_key_file(key_file)
+    os.chmod(key_file, stat.S_IRUSR | stat.S_IWUSR)
+    config = {'access_key_id': 'AKIDBENCHMARK', 'secret_access_key': 'benchmark',
+              'key_pair': 'benchmark', 'key_file': key_file,
+              'clusterous_s3_bucket': 'clusterous-benchmark', 'region': region}
+
+    profile_file = os.path.join(work_dir, 'profile.yml')
+    with open(profile_file, 'w') as f:
+        yaml.dump({'cluster_name': cluster_name,
+                   'parameters': {'master_instance_type': 't2.medium',
+                                  'worker_instance_type': 't2.micro',
+                                  'worker_count': num_nodes}}, f, default_flow_style=False)
+    env_file = os.path.join(benchmark_dir, 'data', 'environment.yml')
+
+    def get_nodes():
+        return [ (tags[defaults.instance_node_type_tag_key], instance.private_ip)
+                 for instance, tags in running_instances(region)
+                 if tags.get(defaults.instance_tag_key) == cluster_name and
+                 tags.get(defaults.instance_node_type_tag_key) not in special_node_types and
+                 defaults.warm_pool_tag_key not in tags ]
+
+    mesos = FakeMesos(recorder, latency, get_nodes)
+    marathon = FakeMarathon(recorder, latency)
+    ssh = StubSSHServer(recorder, latency, os.path.join(work_dir, 'controller'),
+                        forwards={defaults.mesos_port: mesos.port, defaults.marathon_port: marathon.port})
+    for server in (mesos, marathon, ssh, memory):
+        server.start()
+
+    app = clusterousmain.Clusterous(config, 'AWS')
+    commands = [('create', lambda: app.create_cluster(profile_file)),
+                ('run', lambda: app.run_environment(env_file)),
+                ('status', lambda: app.cluster_status()),
+                ('add-nodes', lambda: app.scale_nodes('add', max(1, num_nodes / 10), None)),
+                ('destroy', lambda: app.destroy_cluster(False, False))]
+
+    results = []
+    try:
+        with FakeAWS(recorder, latency, aws_throttle, subnet_prefixlen), SSHRedirect(ssh.port, [22]):
+            for name, func in commands:
+                results.append(_measure(name, func, recorder, clock, memory, log_file, tracer, aws_stats))
+    finally:
+        for server in (mesos, marathon, ssh, memory):
+            server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def _print_report(all_results):
+    headers = ['Nodes', 'Command', 'OK', 'Wall (s)', 'Simulated wait (s)',
+               'AWS', 'AWS retries', 'SSH', 'HTTP', 'Exec', 'Peak RSS (MB)']
+    table = []
+    for num_nodes, results in all_results:
+        for r in results:
+            table.append([num_nodes, r['command'], 'yes' if r['success'] else 'NO',
+                          '{0:.2f}'.format(r['wall_time']), '{0:.0f}'.format(r['simulated_wait']),
+                          r['calls']['aws'], r['aws_retries'], r['calls']['ssh'], r['calls']['http'], r['calls']['exec'],
+                          '{0:.1f}'.format(r['peak_rss'] / 1024.0 / 1024.0)])
+    print tabulate.tabulate(table, headers=headers)
+
+    errors = [ (n, r) for n, results in all_results for r in results if r['error'] ]
+    for num_nodes, r in errors:
+        print >> sys.stderr, '{0} nodes, {1}: {2}'.format(num_nodes, r['command'], r['error'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Clusterous commands against local stand-ins '
+                                                 'for AWS, Mesos, Marathon and SSH')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Cluster sizes (number of worker nodes) to benchmark')
+    parser.add_argument('--aws-latency', type=float, default=0.0, help='Seconds added to each AWS API call')
+    parser.add_argument('--ssh-latency', type=float, default=0.0,
+                        help='Seconds added to each SSH connection and command')
+    parser.add_argument('--http-latency', type=float, default=0.0,
+                        help='Seconds added to each Mesos and Marathon request')
+    parser.add_argument('--exec-latency', type=float, default=0.0,
+                        help='Seconds each ansible-playbook or ssh process takes')
+    parser.add_argument('--aws-throttle', type=float, default=0.0,
+                        help='Fraction of EC2 calls rejected with RequestLimitExceeded')
+    parser.add_argument('--subnet-prefixlen', type=int, default=20,
+                        help='Simulate subnets with as many addresses as a network with this '
+                        'prefix length (Clusterous creates /24 subnets, use 24 to fail as EC2 does)')
+    parser.add_argument('--json', dest='json_file', help='Also write full results, including '
+                        'a breakdown of calls and traced phases, to this file')
+    parser.add_argument('--verbose', '-v', action='store_true', help='Show Clusterous log output')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.CRITICAL)
+
+    latency_args = {'aws': args.aws_latency, 'ssh': args.ssh_latency,
+                    'http': args.http_latency, 'exec_': args.exec_latency}
+
+    if args.single:
+        # Run one cluster size, writing results to stdout for the parent process
+        json.dump(run_scale(args.single, latency_args, args.aws_throttle, args.subnet_prefixlen), sys.stdout)
+        return 0
+
+    # Each cluster size runs in a separate process, isolating simulated state and memory usage
+    all_results = []
+    for num_nodes in args.nodes:
+        cmd = [sys.executable, os.path.abspath(__file__), '--single', str(num_nodes),
+               '--aws-latency', str(args.aws_latency), '--ssh-latency', str(args.ssh_latency),
+               '--http-latency', str(args.http_latency), '--exec-latency', str(args.exec_latency),
+               '--aws-throttle', str(args.aws_throttle), '--subnet-prefixlen', str(args.subnet_prefixlen)]
+        if args.verbose:
+            cmd.append('--verbose')
+        output = subprocess.check_output(cmd)
+        all_results.append((num_nodes, json.loads(output)))
+
+    _print_report(all_results)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            json.dump([ {'nodes': n, 'results': r} for n, r in all_results ], f, indent=2)
+
+    return 1 if any( not r['success'] for n, results in all_results for r in results ) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
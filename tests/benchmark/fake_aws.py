@@ -0,0 +1,214 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import urlparse
+
+import ipaddress
+import boto.connection
+from moto.server import create_backend_app
+from moto.ec2 import models as ec2_models
+from moto.ec2.models import ec2_backends
+from moto.ec2.exceptions import EC2ClientError
+from moto.ec2.utils import EC2_PREFIX_TO_RESOURCE, get_prefix
+
+"""
+Runs boto (2) requests against moto's EC2 and S3 backends in-process. Requests
+still go through boto's own signing, retry and response parsing; only the
+HTTP connection is replaced
+"""
+
+class FakeResponse(object):
+    """
+    Minimal httplib.HTTPResponse equivalent, as used by boto
+    """
+    def __init__(self, status, reason, body, headers):
+        self.status = status
+        self.reason = reason
+        self._body = body
+        self._headers = [ (k.lower(), v) for k, v in headers ]
+        self.msg = dict(self._headers)
+        self.length = len(body)
+        self.chunked = 0
+
+    def read(self, amt=None):
+        if amt is None:
+            data, self._body = self._body, ''
+        else:
+            data, self._body = self._body[:amt], self._body[amt:]
+        return data
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name.lower(), default)
+
+    def getheaders(self):
+        return list(self._headers)
+
+    def close(self):
+        pass
+
+
+_throttled_body = ('<?xml version="1.0" encoding="UTF-8"?>\n<Response><Errors><Error>'
+                   '<Code>RequestLimitExceeded</Code><Message>Request limit exceeded.</Message>'
+                   '</Error></Errors><RequestID>benchmark</RequestID></Response>')
+
+class FakeConnection(object):
+    """
+    Stands in for the httplib connection that boto sends requests through,
+    dispatching them to a moto backend app instead. A fraction (throttle) of
+    EC2 requests are rejected with RequestLimitExceeded, as EC2 does under load
+    """
+    def __init__(self, service, client, host, recorder, latency, throttle=0.0, rand=random):
+        self._service = service
+        self._client = client
+        self._host = host
+        self._recorder = recorder
+        self._latency = latency
+        self._throttle = throttle
+        self._rand = rand
+        self._response = None
+
+    def _operation(self, method, path, body):
+        if self._service == 'ec2':
+            params = urlparse.parse_qs(body or urlparse.urlparse(path).query)
+            return params.get('Action', ['Unknown'])[0]
+        return method
+
+    def request(self, method, path, body=None, headers={}):
+        name = '{0}:{1}'.format(self._service, self._operation(method, path, body))
+        self._latency.wait('aws')
+        if self._service == 'ec2' and self._throttle and self._rand.random() < self._throttle:
+            self._recorder.record('aws', name + ' (throttled)')
+            self._response = FakeResponse(503, 'Service Unavailable', _throttled_body, [])
+            return
+        self._recorder.record('aws', name)
+
+        headers = dict( (k, v) for k, v in headers.items() if k.lower() != 'content-length' )
+        headers.setdefault('Host', self._host)
+        resp = self._client.open(path, method=method, data=body or '', headers=headers,
+                                 base_url='https://{0}'.format(self._host))
+        self._response = FakeResponse(resp.status_code, resp.status.split(' ', 1)[-1],
+                                      resp.get_data(), resp.headers.items())
+
+    def getresponse(self):
+        return self._response
+
+    def set_debuglevel(self, level):
+        pass
+
+    def close(self):
+        pass
+
+
+def _get_tags(resource, *args, **kwargs):
+    """
+    Replaces moto's TaggedEC2Resource.get_tags, which scans every tag in the
+    region and would otherwise dominate timings of large clusters
+    """
+    resource_type = EC2_PREFIX_TO_RESOURCE[get_prefix(resource.id)]
+    return [ {'resource_id': resource.id, 'key': k, 'value': v, 'resource_type': resource_type}
+             for k, v in resource.ec2_backend.tags.get(resource.id, {}).items() ]
+
+def _delete_subnet(backend, subnet_id):
+    """
+    Replaces moto's SubnetBackend.delete_subnet. Like EC2 (and unlike moto),
+    deleting a subnet removes its route table associations
+    """
+    subnet = _moto_delete_subnet(backend, subnet_id)
+    for route_table in backend.route_tables.values():
+        for association_id, associated in route_table.associations.items():
+            if associated == subnet_id:
+                del route_table.associations[association_id]
+    return subnet
+
+def _get_available_subnet_ip(subnet, instance, extra_ips, subnet_prefixlen):
+    """
+    Replaces moto's Subnet.get_available_subnet_ip, failing with EC2's error
+    rather than StopIteration when the subnet has run out of addresses. Subnets
+    have as many addresses as a /subnet_prefixlen network: once those in its
+    CIDR block have run out, addresses are taken from extra_ips (an iterator)
+    """
+    try:
+        return _moto_get_available_subnet_ip(subnet, instance)
+    except StopIteration:
+        pass
+    num_extra = getattr(subnet, 'benchmark_num_extra', 0)
+    if num_extra < 2 ** (32 - subnet_prefixlen) - subnet.cidr.num_addresses:
+        ip = str(next(extra_ips))
+        subnet.benchmark_num_extra = num_extra + 1
+        subnet._subnet_ips[ip] = instance
+        return ip
+    raise EC2ClientError('InsufficientFreeAddressesInSubnet',
+                         'There are not enough free addresses in subnet \'{0}\' '
+                         'to satisfy the requested number of instances.'.format(subnet.id))
+
+_moto_get_tags = ec2_models.TaggedEC2Resource.get_tags
+_moto_delete_subnet = ec2_models.SubnetBackend.delete_subnet
+_moto_get_available_subnet_ip = ec2_models.Subnet.get_available_subnet_ip
+
+
+class FakeAWS(object):
+    """
+    Patches boto so that all EC2/VPC and S3 connections use moto. Subnets have
+    as many addresses as a /subnet_prefixlen network, whatever their CIDR block,
+    so that clusters larger than EC2 allows in one subnet can be simulated
+    """
+    def __init__(self, recorder, latency, throttle=0.0, subnet_prefixlen=24):
+        self._recorder = recorder
+        self._latency = latency
+        self._throttle = throttle
+        self._subnet_prefixlen = subnet_prefixlen
+        # Outside the VPC CIDR blocks Clusterous uses, so distinct from any subnet's own addresses
+        self._extra_ips = ipaddress.ip_network(u'100.64.0.0/10').hosts()
+        # Fixed seed, so that the same calls are throttled in each run
+        self._random = random.Random(0)
+        self._clients = {'ec2': create_backend_app('ec2').test_client(),
+                         's3': create_backend_app('s3').test_client()}
+        self._get_http_connection = boto.connection.AWSAuthConnection.get_http_connection
+        self._put_http_connection = boto.connection.AWSAuthConnection.put_http_connection
+
+    def _make_connection(self, conn, host, port, is_secure):
+        service = 's3' if 's3' in conn._required_auth_capability() else 'ec2'
+        return FakeConnection(service, self._clients[service], host, self._recorder, self._latency,
+                              self._throttle, self._random)
+
+    def __enter__(self):
+        fake = self
+        boto.connection.AWSAuthConnection.get_http_connection = \
+            lambda conn, host, port, is_secure: fake._make_connection(conn, host, port, is_secure)
+        boto.connection.AWSAuthConnection.put_http_connection = \
+            lambda conn, host, port, is_secure, connection: None
+        ec2_models.TaggedEC2Resource.get_tags = _get_tags
+        ec2_models.SubnetBackend.delete_subnet = _delete_subnet
+        ec2_models.Subnet.get_available_subnet_ip = lambda subnet, instance: \
+            _get_available_subnet_ip(subnet, instance, fake._extra_ips, fake._subnet_prefixlen)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        boto.connection.AWSAuthConnection.get_http_connection = self._get_http_connection
+        boto.connection.AWSAuthConnection.put_http_connection = self._put_http_connection
+        ec2_models.TaggedEC2Resource.get_tags = _moto_get_tags
+        ec2_models.SubnetBackend.delete_subnet = _moto_delete_subnet
+        ec2_models.Subnet.get_available_subnet_ip = _moto_get_available_subnet_ip
+
+
+def running_instances(region):
+    """
+    Returns (instance, tags) of all running instances in moto's EC2 backend for
+    region, without going through the API (so not counted as calls)
+    """
+    backend = ec2_backends[region]
+    return [ (instance, dict(backend.tags.get(instance.id, {})))
+             for reservation in backend.reservations.values()
+             for instance in reservation.instances if instance.state == 'running' ]
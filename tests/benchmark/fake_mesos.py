@@ -0,0 +1,204 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import json
+import time
+import uuid
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+"""
+Fake Mesos master and Marathon servers, reachable through SSH tunnels to the
+stub controller
+"""
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        fake = self.server.fake
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else ''
+
+        fake.latency.wait('http')
+        status, data, label = fake.handle(method, url.path, urlparse.parse_qs(url.query), body)
+        fake.recorder.record('http', '{0}:{1} {2}'.format(fake.name, method, label))
+
+        payload = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeHTTPService(object):
+    name = ''
+
+    def __init__(self, recorder, latency):
+        self.recorder = recorder
+        self.latency = latency
+        self._server = _ThreadedHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method, path, query, body):
+        """
+        Returns (HTTP status, JSON data, label for recording)
+        """
+        raise NotImplementedError()
+
+
+class FakeMesos(FakeHTTPService):
+    """
+    Mesos master whose slaves are the running node instances, as reported by
+    get_nodes(), a callable returning a list of (node name, private IP)
+    """
+    name = 'mesos'
+    cpus_per_slave = 2.0
+    mem_per_slave = 3768.0
+
+    def __init__(self, recorder, latency, get_nodes):
+        super(FakeMesos, self).__init__(recorder, latency)
+        self._get_nodes = get_nodes
+
+    def _slaves(self):
+        slaves = []
+        for i, (node_name, ip) in enumerate(self._get_nodes()):
+            slaves.append({
+                    'id': 'slave-{0}'.format(i),
+                    'pid': 'slave(1)@{0}:5051'.format(ip),
+                    'hostname': ip,
+                    'active': True,
+                    'attributes': {'name': node_name},
+                    'resources': {'cpus': self.cpus_per_slave, 'mem': self.mem_per_slave,
+                                  'disk': 20000.0, 'ports': '[31000-32000]'},
+                    'used_resources': {'cpus': 0.0, 'mem': 0.0, 'disk': 0.0},
+                    'registered_time': time.time()
+                    })
+        return slaves
+
+    def handle(self, method, path, query, body):
+        if path in ('/master/state.json', '/state.json', '/master/state'):
+            return 200, {'version': '0.22.1', 'slaves': self._slaves(), 'frameworks': []}, path
+        if path in ('/master/slaves', '/slaves'):
+            return 200, {'slaves': self._slaves()}, path
+        if path in ('/master/state-summary', '/state-summary'):
+            return 200, {'slaves': self._slaves(), 'frameworks': []}, path
+        return 404, {}, path
+
+
+class FakeMarathon(FakeHTTPService):
+    """
+    Marathon REST API (v2) in which all tasks start immediately
+    """
+    name = 'marathon'
+
+    def __init__(self, recorder, latency):
+        super(FakeMarathon, self).__init__(recorder, latency)
+        self._lock = threading.Lock()
+        self._apps = {}
+
+    def _tasks(self, app):
+        return [ {'id': '{0}.{1}'.format(app['id'].strip('/'), i),
+                  'appId': app['id'],
+                  'host': '10.2.1.{0}'.format(i % 250 + 1),
+                  'ports': [31000 + i % 1000],
+                  'startedAt': '2016-01-01T00:00:00.000Z',
+                  'stagedAt': '2016-01-01T00:00:00.000Z',
+                  'version': app['version']} for i in range(app.get('instances', 1)) ]
+
+    def _app_json(self, app, embed_tasks):
+        data = dict(app)
+        data['tasksRunning'] = app.get('instances', 1)
+        data['tasksStaged'] = 0
+        if embed_tasks:
+            data['tasks'] = self._tasks(app)
+        return data
+
+    def _deployment(self):
+        return {'deploymentId': str(uuid.uuid4()), 'version': time.strftime('%Y-%m-%dT%H:%M:%S.000Z')}
+
+    def handle(self, method, path, query, body):
+        m = re.match('^/v2/apps/?(.*)$', path)
+        if path == '/ping':
+            return 200, 'pong', path
+        if path == '/v2/tasks' and method == 'GET':
+            with self._lock:
+                tasks = [ t for a in self._apps.values() for t in self._tasks(a) ]
+            return 200, {'tasks': tasks}, path
+        if not m:
+            return 404, {'message': 'Not found'}, path
+
+        app_id = '/' + m.group(1).strip('/') if m.group(1) else ''
+        label = '/v2/apps/{id}' if app_id else '/v2/apps'
+        if app_id.endswith('/tasks') and method == 'GET':
+            app_id = app_id[:-len('/tasks')]
+            with self._lock:
+                if app_id not in self._apps:
+                    return 404, {'message': 'App \'{0}\' does not exist'.format(app_id)}, label + '/tasks'
+                return 200, {'tasks': self._tasks(self._apps[app_id])}, label + '/tasks'
+        with self._lock:
+            if not app_id and method == 'GET':
+                embed = 'apps.tasks' in query.get('embed', [])
+                return 200, {'apps': [ self._app_json(a, embed) for a in self._apps.values() ]}, label
+            if not app_id and method == 'POST':
+                app = json.loads(body)
+                app['id'] = '/' + app['id'].strip('/')
+                app['version'] = self._deployment()['version']
+                self._apps[app['id']] = app
+                return 201, self._app_json(app, False), label
+            if app_id not in self._apps:
+                return 404, {'message': 'App \'{0}\' does not exist'.format(app_id)}, label
+            if method == 'GET':
+                return 200, {'app': self._app_json(self._apps[app_id], True)}, label
+            if method == 'PUT':
+                self._apps[app_id].update(json.loads(body))
+                return 200, self._deployment(), label
+            if method == 'DELETE':
+                del self._apps[app_id]
+                return 200, self._deployment(), label
+        return 405, {}, label
@@ -0,0 +1,283 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import select
+import socket
+import logging
+import threading
+
+import paramiko
+from paramiko.common import cMSG_CHANNEL_SUCCESS
+
+"""
+Stub SSH server standing in for the NAT and controller. Supports exec
+requests (answered from canned command handlers), SFTP (backed by a local
+directory) and direct-tcpip forwarding (for SSH tunnels) to local ports.
+Forwarding to port 22 of any host, as through the NAT acting as a bastion,
+reaches the stub server itself
+"""
+
+def default_commands():
+    """
+    Returns list of (regex, handler) for commands Clusterous runs over SSH.
+    handler is called with the match object and returns (stdout, stderr, exit status)
+    """
+    return [
+        (r'^df -h \| grep', lambda m: ('/dev/xvdf        20G  1.1G   18G   6% /home/data\n', '', 0)),
+        (r'^curl -s -H .+ registry:5000/v2/.+/manifests/',
+            lambda m: ('{"schemaVersion": 2, "config": {"digest": "sha256:a1b2c3d4e5f6"}, "layers": []}', '', 0)),
+        (r'^curl -s registry:5000/v2/.+/blobs/',
+            lambda m: ('{"author": "", "created": "2016-01-01T00:00:00.000000000Z"}', '', 0)),
+        (r'^ls ', lambda m: ('', '', 0)),
+        (r'', lambda m: ('', '', 0))
+    ]
+
+
+class _StubSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+
+class _StubSFTPServer(paramiko.SFTPServerInterface):
+    def __init__(self, server, root, *args, **kwargs):
+        super(_StubSFTPServer, self).__init__(server, *args, **kwargs)
+        self._root = root
+
+    def _local(self, path):
+        return os.path.join(self._root, self.canonicalize(path).lstrip('/'))
+
+    def list_folder(self, path):
+        try:
+            local = self._local(path)
+            return [ paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, f)), f)
+                     for f in os.listdir(local) ]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        try:
+            parent = os.path.dirname(local)
+            if flags & os.O_CREAT and not os.path.isdir(parent):
+                os.makedirs(parent)
+            fd = os.open(local, flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = _StubSFTPHandle(flags)
+        f = os.fdopen(fd, mode)
+        handle.filename = local
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.makedirs(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, stub):
+        self._stub = stub
+        self.forwards = {}
+        self.commands = {}
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        port = self._stub.forwards.get(destination[1])
+        if port is None:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        self._stub.recorder.record('ssh', 'tunnel:{0}'.format(destination[1]))
+        self.forwards[chanid] = port
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        self._stub.recorder.record('ssh', 'exec:{0}'.format(command.split(' ', 1)[0]))
+        # Run once the request has been acknowledged, see StubSSHServer._send_message
+        self.commands[channel.remote_chanid] = (channel, command)
+        return True
+
+
+class StubSSHServer(object):
+    """
+    SSH server on localhost accepting any public key. forwards maps remote
+    ports (as requested through tunnels) to local ports
+    """
+    def __init__(self, recorder, latency, sftp_root, forwards={}, commands=None):
+        self.recorder = recorder
+        self.latency = latency
+        self.forwards = dict(forwards)
+        self._sftp_root = sftp_root
+        self._commands = [ (re.compile(r), h) for r, h in (commands or default_commands()) ]
+        self._host_key = paramiko.RSAKey.generate(1024)
+        self._stop = threading.Event()
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(128)
+        self.port = self._sock.getsockname()[1]
+        self.forwards.setdefault(22, self.port)
+        self._thread = threading.Thread(target=self._accept_loop)
+        self._thread.daemon = True
+
+        logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sock.close()
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                client, addr = self._sock.accept()
+            except socket.error:
+                break
+            t = threading.Thread(target=self._serve, args=(client,))
+            t.daemon = True
+            t.start()
+
+    def _serve(self, client):
+        self.recorder.record('ssh', 'connect')
+        self.latency.wait('ssh')
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self._host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _StubSFTPServer, self._sftp_root)
+        server = _ServerInterface(self)
+        send_message = transport._send_user_message
+        transport._send_user_message = lambda m: self._send_message(send_message, server, m)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, socket.error):
+            return
+
+        while transport.is_active() and not self._stop.is_set():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            port = server.forwards.pop(channel.get_id(), None)
+            if port is not None:
+                t = threading.Thread(target=self._forward, args=(channel, port))
+                t.daemon = True
+                t.start()
+
+    def _send_message(self, send_message, server, m):
+        """
+        Sends message m and, if it acknowledges an exec request, starts the
+        command. Replying to the command any earlier would race with the
+        acknowledgement, so the client could see the channel closed first
+        """
+        send_message(m)
+        data = m.asbytes()
+        if data[:1] == cMSG_CHANNEL_SUCCESS:
+            pending = server.commands.pop(paramiko.Message(data[1:]).get_int(), None)
+            if pending is not None:
+                t = threading.Thread(target=self.run_command, args=pending)
+                t.daemon = True
+                t.start()
+
+    def run_command(self, channel, command):
+        self.latency.wait('ssh')
+        for regex, handler in self._commands:
+            m = regex.search(command)
+            if m:
+                stdout, stderr, status = handler(m)
+                break
+        try:
+            if stdout:
+                channel.sendall(stdout)
+            if stderr:
+                channel.sendall_stderr(stderr)
+            channel.send_exit_status(status)
+        finally:
+            channel.close()
+
+    def _forward(self, channel, port):
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+        except socket.error:
+            channel.close()
+            return
+        try:
+            while True:
+                r, w, x = select.select([sock, channel], [], [])
+                if sock in r:
+                    data = sock.recv(32768)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                if channel in r:
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    sock.sendall(data)
+        except (socket.error, EOFError):
+            pass
+        finally:
+            channel.close()
+            sock.close()
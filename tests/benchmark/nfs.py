@@ -0,0 +1,114 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of shared volume I/O, to compare NFS profiles. Run on a cluster node
+(or in a container) against one or more directories on NFS mounts of the
+shared volume, e.g. /home/data, or the shared volume mounted a second time
+with different options. Measures creating, reading and deleting many small
+files, and sequential write and read of a large file
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import tabulate
+
+block_size = 1024 * 1024
+
+
+def _small_files(work_dir, count, size):
+    """
+    Returns (create, read, delete) rates of count files of size bytes, in files per second
+    """
+    data = os.urandom(size)
+    names = [ os.path.join(work_dir, 'small-{0}'.format(i)) for i in range(count) ]
+    rates = []
+
+    start = time.time()
+    for name in names:
+        with open(name, 'wb') as f:
+            f.write(data)
+    rates.append(count / (time.time() - start))
+
+    start = time.time()
+    for name in names:
+        with open(name, 'rb') as f:
+            f.read()
+    rates.append(count / (time.time() - start))
+
+    start = time.time()
+    for name in names:
+        os.remove(name)
+    rates.append(count / (time.time() - start))
+    return rates
+
+def _large_file(work_dir, size_mb):
+    """
+    Returns (write, read) throughput of a file of size_mb MiB, in MiB per second.
+    The write includes flushing to the server, and the read is of data not in
+    the client's cache only if the file is bigger than its memory
+    """
+    name = os.path.join(work_dir, 'large')
+    data = os.urandom(block_size)
+    rates = []
+
+    start = time.time()
+    with open(name, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    rates.append(size_mb / (time.time() - start))
+
+    start = time.time()
+    with open(name, 'rb') as f:
+        while f.read(block_size):
+            pass
+    rates.append(size_mb / (time.time() - start))
+
+    os.remove(name)
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark shared volume I/O')
+    parser.add_argument('paths', nargs='+', help='Directories to benchmark, e.g. /home/data')
+    parser.add_argument('--files', type=int, default=2000, help='Number of small files')
+    parser.add_argument('--file-size', type=int, default=4096, help='Size of small files in bytes')
+    parser.add_argument('--large-mb', type=int, default=1024, help='Size of large file in MiB')
+    args = parser.parse_args(argv)
+
+    table = []
+    for path in args.paths:
+        work_dir = tempfile.mkdtemp(prefix='clusterous-nfs-', dir=path)
+        try:
+            row = [path]
+            row.extend([ '{0:.0f}'.format(r) for r in _small_files(work_dir, args.files, args.file_size) ])
+            row.extend([ '{0:.1f}'.format(r) for r in _large_file(work_dir, args.large_mb) ])
+            table.append(row)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print tabulate.tabulate(table, headers=['Path', 'Create (files/s)', 'Read (files/s)', 'Delete (files/s)',
+                                            'Write (MiB/s)', 'Read (MiB/s)'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of parsing large Mesos and Marathon responses: peak memory and time
+taken by loading the whole document with json, as clients of these APIs do,
+against the incremental parsers in clusterous.jsonstream. Responses are
+synthetic, with the fields (and sizes) of real ones
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import tabulate
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(benchmark_dir)))
+
+
+def _slave(i):
+    return {'id': '20160101-000000-0000-5050-{0}-S{1}'.format(i % 7, i),
+            'pid': 'slave(1)@10.2.{0}.{1}:5051'.format(i / 250, i % 250 + 1),
+            'hostname': 'ip-10-2-{0}-{1}.ec2.internal'.format(i / 250, i % 250 + 1),
+            'registered_time': 1451606400.0 + i, 'active': True, 'version': '0.28.1',
+            'attributes': {'name': 'worker', 'rack': 'rack-{0}'.format(i % 16)},
+            'resources': {'cpus': 4.0, 'mem': 15038.0, 'disk': 35164.0, 'ports': '[31000-32000]'},
+            'used_resources': {'cpus': 2.0, 'mem': 4096.0, 'disk': 0.0, 'ports': '[31000-31010]'},
+            'offered_resources': {'cpus': 0.0, 'mem': 0.0, 'disk': 0.0},
+            'reserved_resources': {}, 'unreserved_resources': {'cpus': 4.0, 'mem': 15038.0, 'disk': 35164.0}}
+
+def _app(i):
+    return {'id': '/app-{0}'.format(i), 'cmd': 'python run.py --worker {0}'.format(i), 'args': None,
+            'instances': i % 5 + 1, 'cpus': 0.5, 'mem': 512.0, 'disk': 0.0,
+            'constraints': [['name', 'CLUSTER', 'worker']],
+            'env': dict( ('VARIABLE_{0}'.format(n), 'value-{0}-{1}'.format(i, n) * 4) for n in range(20) ),
+            'labels': dict( ('label-{0}'.format(n), 'x' * 32) for n in range(10) ),
+            'container': {'type': 'DOCKER', 'volumes': [{'containerPath': '/home/data/', 'hostPath': '/home/data/',
+                                                         'mode': 'RW'}],
+                          'docker': {'image': 'registry:5000/app-{0}'.format(i), 'network': 'BRIDGE',
+                                     'portMappings': [{'containerPort': 8888, 'hostPort': 0, 'protocol': 'tcp'}],
+                                     'privileged': True, 'forcePullImage': True,
+                                     'parameters': [{'key': 'add-host', 'value': 'central-logging:10.2.0.10'}]}},
+            'healthChecks': [], 'dependencies': [], 'upgradeStrategy': {'minimumHealthCapacity': 1.0},
+            'version': '2016-01-01T00:00:00.000Z', 'tasksStaged': 0, 'tasksRunning': i % 5 + 1,
+            'tasksHealthy': 0, 'tasksUnhealthy': 0, 'deployments': []}
+
+def _task(i):
+    return {'id': 'app-{0}.{1}'.format(i % 2000, '0' * 24 + str(i)), 'appId': '/app-{0}'.format(i % 2000),
+            'host': 'ip-10-2-{0}-{1}.ec2.internal'.format(i % 20, i % 250 + 1),
+            'slaveId': '20160101-000000-0000-5050-{0}-S{1}'.format(i % 7, i % 5000),
+            'ports': [31000 + i % 1000], 'servicePorts': [10000 + i % 1000],
+            'ipAddresses': [{'ipAddress': '172.17.0.{0}'.format(i % 250 + 1), 'protocol': 'IPv4'}],
+            'stagedAt': '2016-01-01T00:00:00.000Z', 'startedAt': '2016-01-01T00:00:01.000Z',
+            'version': '2016-01-01T00:00:00.000Z', 'healthCheckResults': []}
+
+payloads = {'slaves': ('/master/slaves', 'slaves', _slave, 'parse_slaves'),
+            'apps': ('/v2/apps', 'apps', _app, 'parse_apps'),
+            'tasks': ('/v2/tasks', 'tasks', _task, 'parse_tasks')}
+
+
+def _write_payload(file_name, key, make_item, count):
+    """
+    Writes a response of count items, one at a time
+    """
+    with open(file_name, 'w') as f:
+        f.write('{{"{0}": ['.format(key))
+        for i in range(count):
+            if i:
+                f.write(', ')
+            json.dump(make_item(i), f)
+        f.write(']}')
+
+
+def _measure(kind, method, file_name):
+    """
+    Parses file_name in this process, returns (records, seconds, peak memory
+    above the baseline in bytes)
+    """
+    from simulation import MemorySampler
+    from clusterous import jsonstream
+
+    memory = MemorySampler(interval=0.005)
+    memory.start()
+    memory.reset()
+    baseline = memory.current()
+    start = time.time()
+    with open(file_name, 'rb') as f:
+        if method == 'json':
+            records = len(json.load(f)[payloads[kind][1]])
+        else:
+            records = len(getattr(jsonstream, payloads[kind][3])(f))
+    seconds = time.time() - start
+    peak = memory.peak()
+    memory.stop()
+    return records, seconds, peak - baseline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark parsing of large Mesos and Marathon responses')
+    parser.add_argument('--slaves', type=int, default=5000, help='Number of slaves in /master/slaves')
+    parser.add_argument('--apps', type=int, default=2000, help='Number of applications in /v2/apps')
+    parser.add_argument('--tasks', type=int, default=50000, help='Number of tasks in /v2/tasks')
+    parser.add_argument('--single', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        # Measure one parse, writing results to stdout for the parent process
+        json.dump(_measure(*args.single), sys.stdout)
+        return 0
+
+    # Each parse runs in a separate process, so that peak memory is not shared
+    work_dir = tempfile.mkdtemp(prefix='clusterous-parsing-')
+    table = []
+    try:
+        for kind in ('slaves', 'apps', 'tasks'):
+            count = getattr(args, kind)
+            path, key, make_item, parse = payloads[kind]
+            file_name = os.path.join(work_dir, kind + '.json')
+            _write_payload(file_name, key, make_item, count)
+            row = [path, count, '{0:.1f}'.format(os.path.getsize(file_name) / 1024.0 / 1024.0)]
+            for method in ('json', 'jsonstream'):
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                  '--single', kind, method, file_name])
+                records, seconds, peak = json.loads(output)
+                row.extend(['{0:.2f}'.format(seconds), '{0:.1f}'.format(peak / 1024.0 / 1024.0)])
+            table.append(row)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print tabulate.tabulate(table, headers=['Response', 'Items', 'Size (MB)', 'json (s)', 'json peak (MB)',
+                                            'jsonstream (s)', 'jsonstream peak (MB)'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+import socket
+import resource
+import threading
+import collections
+
+"""
+Shared plumbing for the benchmark stand-ins: call recording, latency
+injection, a virtual clock for polling loops, memory sampling and redirection
+of SSH connections to the stub SSH server
+"""
+
+class Recorder(object):
+    """
+    Thread-safe counter of calls made to the stand-ins, keyed by
+    (category, name), e.g. ('aws', 'ec2:RunInstances')
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+
+    def record(self, category, name):
+        with self._lock:
+            self._counts[(category, name)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return collections.Counter(self._counts)
+
+
+class Latency(object):
+    """
+    Injects a fixed delay (in seconds) per call to a category of stand-in
+    """
+    def __init__(self, aws=0.0, ssh=0.0, http=0.0, exec_=0.0):
+        self.delays = {'aws': aws, 'ssh': ssh, 'http': http, 'exec': exec_}
+
+    def wait(self, category):
+        delay = self.delays.get(category, 0.0)
+        if delay > 0:
+            _real_sleep(delay)
+
+
+_real_sleep = time.sleep
+
+class VirtualClock(object):
+    """
+    Stands in for the time module in Clusterous modules, so that fixed sleeps
+    and polling intervals are accounted for rather than actually waited on.
+    time() advances by the total amount slept, so timeouts still expire
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.slept = 0.0
+
+    def sleep(self, secs):
+        with self._lock:
+            self.slept += secs
+
+    def time(self):
+        return time.time() + self.slept
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class MemorySampler(object):
+    """
+    Samples resident memory of this process in the background, tracking the
+    peak since the last reset()
+    """
+    def __init__(self, interval=0.01):
+        self._interval = interval
+        self._page_size = resource.getpagesize()
+        self._lock = threading.Lock()
+        self._peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def current(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        except IOError:
+            # No procfs, fall back to the high water mark (in KB on Linux)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self.current()
+            with self._lock:
+                self._peak = max(self._peak, rss)
+            self._stop.wait(self._interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def reset(self):
+        with self._lock:
+            self._peak = self.current()
+
+    def peak(self):
+        with self._lock:
+            return max(self._peak, self.current())
+
+
+class SSHRedirect(object):
+    """
+    Makes SSH connections to any simulated host (i.e. anything but localhost)
+    go to the stub SSH server, by wrapping socket connect
+    """
+    def __init__(self, ssh_port, ports):
+        self._ssh_port = ssh_port
+        self._ports = set(ports)
+        self._connect = socket.socket.connect
+        self._connect_ex = socket.socket.connect_ex
+
+    def _address(self, address):
+        if (isinstance(address, tuple) and address[1] in self._ports and
+                address[0] not in ('localhost', '127.0.0.1')):
+            return ('127.0.0.1', self._ssh_port)
+        return address
+
+    def __enter__(self):
+        redirect = self
+        socket.socket.connect = lambda sock, address: redirect._connect(sock, redirect._address(address))
+        socket.socket.connect_ex = lambda sock, address: redirect._connect_ex(sock, redirect._address(address))
+        return self
+
+    def __exit__(self, type, value, traceback):
+        socket.socket.connect = self._connect
+        socket.socket.connect_ex = self._connect_ex
+
+
+def read_exec_log(log_file, recorder):
+    """
+    Adds calls logged by the fake executables in fakebin/ to recorder, and
+    truncates the log
+    """
+    if not os.path.isfile(log_file):
+        return
+    with open(log_file, 'r+') as f:
+        for line in f:
+            if line.strip():
+                recorder.record('exec', line.strip())
+        f.seek(0)
+        f.truncate()
@@ -23,7 +23,9 @@ from mock import MagicMock
 import pytest
 
 from clusterous.cli import main
+from clusterous import bastion
 from clusterous import defaults
+from clusterous import statestore
 from sshtunnel import SSHTunnelForwarder
 
 import marathon
@@ -67,12 +69,11 @@ class TestClusterousE2ETest:
         return conn
 
     def _get_cluster_info(self):
-        cluster_info_file = os.path.expanduser(defaults.cluster_info_file)
-        if not os.path.isfile(cluster_info_file):
+        store = statestore.get_store()
+        cluster_name = store.get_working_cluster()
+        if not cluster_name:
             return {}
-        f = open(os.path.expanduser(cluster_info_file), 'r')
-        cluster_info = yaml.load(f)
-        return cluster_info
+        return store.get_cluster_info(cluster_name)
 
     def test_cluster_create(self):
         # Destroy if cluster present
@@ -132,10 +133,12 @@ class TestClusterousE2ETest:
    
         # Check number of running components
         components = {}
-        with SSHTunnelForwarder((self._get_cluster_info().get('nat_ip'),
-                                 defaults.nat_ssh_port_forwarding), 
+        controller_ip = self._get_cluster_info().get('controller_ip')
+        nat = bastion.get_bastion(self._get_cluster_info().get('nat_ip'), AWS_CONFIG['key_file'])
+        with SSHTunnelForwarder((controller_ip, 22),
                                 ssh_username=defaults.cluster_username, 
                                 ssh_private_key=os.path.expanduser(AWS_CONFIG['key_file']), 
+                                ssh_proxy=nat.open_channel(controller_ip, 22),
                                 remote_bind_address=('127.0.0.1', defaults.marathon_port)) as tunnel:
             marathon_url = 'http://localhost:{0}'.format(tunnel.local_bind_port)
             client = marathon.MarathonClient(servers=marathon_url, timeout=600)
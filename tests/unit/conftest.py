@@ -0,0 +1,90 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import threading
+import BaseHTTPServer
+
+import pytest
+
+from clusterous import tracing
+
+"""
+Fixtures shared by the unit tests: a local HTTP server standing in for the
+Mesos master and Marathon, and counting of HTTP requests in traces
+"""
+
+slaves = {'slaves': [{'hostname': 'node-1', 'active': True, 'attributes': {'name': 'worker'},
+                      'pid': 'slave(1)@10.0.0.5:5051', 'resources': {'cpus': 2, 'mem': 1024}}]}
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves slaves on any path, with ETag "1". Responds 304 when revalidated
+    with that ETag, without repeating it unless send_etag_on_304 is set.
+    Response statuses are appended to statuses
+    """
+    send_etag_on_304 = False
+    statuses = []
+
+    def send_response(self, code, message=None):
+        self.statuses.append(code)
+        BaseHTTPServer.BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == '"1"':
+            self.send_response(304)
+            if self.send_etag_on_304:
+                self.send_header('ETag', '"1"')
+            self.end_headers()
+            return
+        body = json.dumps(slaves)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """
+    Starts a local HTTP server, returns its port
+    """
+    del _Handler.statuses[:]
+    httpd = BaseHTTPServer.HTTPServer(('localhost', 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture
+def http_count():
+    """
+    Returns function running a function in a span, returning its result and
+    the number of HTTP requests counted
+    """
+    tracer = tracing.enable()
+    def run(func):
+        with tracer.span('test') as span:
+            result = func()
+        return result, span.counts['http']
+    return run
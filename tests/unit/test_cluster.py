@@ -0,0 +1,62 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import boto.connection
+import pytest
+from moto import mock_ec2_deprecated
+
+from clusterous import cluster
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """
+    Returns list of the parameters of the boto requests made
+    """
+    sent = []
+    mexe = boto.connection.AWSAuthConnection._mexe
+    def recording_mexe(conn, request, *args, **kwargs):
+        sent.append(dict(request.params))
+        return mexe(conn, request, *args, **kwargs)
+    monkeypatch.setattr(boto.connection.AWSAuthConnection, '_mexe', recording_mexe)
+    return sent
+
+@pytest.fixture
+def aws_cluster():
+    with mock_ec2_deprecated():
+        c = cluster.AWSCluster.__new__(cluster.AWSCluster)
+        c._config = {'access_key_id': 'AKIDTEST', 'secret_access_key': 'test', 'region': 'ap-southeast-2'}
+        yield c
+
+
+def test_create_gp3_volume_with_current_api(aws_cluster, sent):
+    conn = cluster.get_ec2_connection('ap-southeast-2', 'AKIDTEST', 'test')
+    volume = aws_cluster._create_volume(conn, 100, 'ap-southeast-2a', 'gp3', iops=3000, throughput=250)
+    assert volume.update() == 'available'
+    assert volume.size == 100
+
+    create = [ p for p in sent if p['Action'] == 'CreateVolume' ]
+    assert len(create) == 1
+    assert create[0]['Version'] == cluster.CurrentEC2Connection.APIVersion
+    assert create[0]['VolumeType'] == 'gp3'
+    assert create[0]['Iops'] == '3000'
+    assert create[0]['Throughput'] == '250'
+
+def test_current_api_connection_shared():
+    current = cluster.get_ec2_connection('ap-southeast-2', 'AKIDTEST', 'test', current_api=True)
+    assert isinstance(current, cluster.CurrentEC2Connection)
+    assert current is cluster.get_ec2_connection('ap-southeast-2', 'AKIDTEST', 'test', current_api=True)
+    assert current is not cluster.get_ec2_connection('ap-southeast-2', 'AKIDTEST', 'test')
+    assert cluster.get_ec2_connection('nowhere-1', 'AKIDTEST', 'test', current_api=True) is None
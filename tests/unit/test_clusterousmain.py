@@ -0,0 +1,47 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+
+import pytest
+
+from clusterous import clusterousmain
+from clusterous import cluster
+
+
+class _Store(object):
+    def get_cluster_names(self):
+        return ['good', 'unreachable', 'broken']
+
+
+@pytest.fixture
+def app(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    monkeypatch.setattr(clusterousmain.statestore, 'get_store', lambda: _Store())
+    return clusterousmain.Clusterous({}, 'AWS')
+
+
+def test_status_all_reports_every_cluster(app, monkeypatch):
+    def cluster_status(cluster_name=None):
+        if cluster_name == 'unreachable':
+            raise socket.error('Connection refused')
+        if cluster_name == 'broken':
+            raise cluster.ClusterException('No controller')
+        return True, {'cluster_name': cluster_name}
+    monkeypatch.setattr(app, 'cluster_status', cluster_status)
+
+    assert app.cluster_status_all() == [('good', True, {'cluster_name': 'good'}),
+                                        ('unreachable', False, 'Connection refused'),
+                                        ('broken', False, 'No controller')]
@@ -0,0 +1,96 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+
+import pytest
+
+from clusterous import dockerignore
+
+
+def _make_context(root, files, patterns):
+    for path in files:
+        full = os.path.join(str(root), *path.split('/'))
+        if not os.path.isdir(os.path.dirname(full)):
+            os.makedirs(os.path.dirname(full))
+        open(full, 'w').close()
+    with open(os.path.join(str(root), '.dockerignore'), 'w') as f:
+        f.write('\n'.join(patterns) + '\n')
+    return str(root)
+
+def _excluded(root, path, patterns):
+    context = _make_context(root, [], patterns)
+    return dockerignore.is_excluded(path, dockerignore.read_patterns(context))
+
+
+@pytest.mark.parametrize('pattern, path, excluded', [
+    ('*.pyc', 'a.pyc', True),
+    ('*.pyc', 'src/a.pyc', False),
+    ('**/*.pyc', 'a.pyc', True),
+    ('**/*.pyc', 'src/deep/a.pyc', True),
+    ('src/**', 'src/deep/a.py', True),
+    ('src/**/test', 'src/test', True),
+    ('src/**/test', 'src/a/b/test', True),
+    ('src/**/test', 'src/a/b/test2', False),
+    ('?.txt', 'a.txt', True),
+    ('?.txt', 'ab.txt', False),
+    ('[!a]*', 'b', True),
+    ('[!a]*', 'a', False),
+])
+def test_pattern_matching(tmpdir, pattern, path, excluded):
+    assert _excluded(tmpdir, path, [pattern]) == excluded
+
+def test_parent_directory_excludes_contents(tmpdir):
+    assert _excluded(tmpdir, 'build/lib/a.so', ['build'])
+    assert _excluded(tmpdir, 'data/raw/big.csv', ['data/raw'])
+    assert not _excluded(tmpdir, 'src/build.py', ['build'])
+
+def test_last_matching_pattern_wins(tmpdir):
+    assert not _excluded(tmpdir, 'logs/keep.log', ['logs', '!logs/keep.log'])
+    assert _excluded(tmpdir, 'logs/other.log', ['logs', '!logs/keep.log'])
+    assert _excluded(tmpdir, 'logs/keep.log', ['!logs/keep.log', 'logs'])
+
+def test_comments_blank_lines_and_leading_slash(tmpdir):
+    context = _make_context(tmpdir, ['a.txt', 'b.txt'], ['# a.txt', '', '/b.txt'])
+    patterns = dockerignore.read_patterns(context)
+    assert len(patterns) == 1
+    assert dockerignore.context_paths(context) == ['.dockerignore', 'a.txt']
+
+def test_context_paths(tmpdir):
+    context = _make_context(tmpdir, ['Dockerfile', 'app.py', 'app.pyc', 'lib/util.py', 'lib/util.pyc',
+                                     'data/raw/big.csv', 'data/raw/keep.csv', 'data/other.csv'],
+                            ['**/*.pyc', 'data', '!data/raw/keep.csv', 'Dockerfile', '.dockerignore'])
+    assert dockerignore.context_paths(context) == [
+        '.dockerignore', 'Dockerfile', 'app.py', 'data', 'data/raw', 'data/raw/keep.csv', 'lib', 'lib/util.py']
+
+def test_excluded_directory_not_walked(tmpdir, monkeypatch):
+    context = _make_context(tmpdir, ['app.py', 'node_modules/x/index.js'], ['node_modules'])
+    walked = []
+    walk = os.walk
+    def recording_walk(top):
+        for root, dirs, files in walk(top):
+            walked.append(os.path.relpath(root, context))
+            yield root, dirs, files
+    monkeypatch.setattr(dockerignore.os, 'walk', recording_walk)
+    assert dockerignore.context_paths(context) == ['.dockerignore', 'app.py']
+    assert walked == ['.']
+
+def test_rsync_filter(tmpdir):
+    context = _make_context(tmpdir.join('image'), ['Dockerfile', 'app.py', 'app.pyc'], ['*.pyc'])
+    filter_file = tmpdir.join('filter')
+    with open(str(filter_file), 'w') as f:
+        assert dockerignore.write_rsync_filter(context, f) == 3
+    assert filter_file.read().splitlines() == [
+        '+ /image/', '+ /image/.dockerignore', '+ /image/Dockerfile', '+ /image/app.py', '- *']
@@ -0,0 +1,52 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from clusterous import defaults
+from clusterous.environment import Environment
+from clusterous.jsonstream import Slave
+
+
+class _Cluster(object):
+    def __init__(self, mirrors):
+        self._mirrors = mirrors
+
+    def get_registry_mirrors(self):
+        return list(self._mirrors)
+
+
+def _slave(hostname, ip, name='worker', active=True):
+    return Slave(hostname, active, name, float(defaults.build_cpus), float(defaults.build_mem), ip)
+
+slaves = [_slave('node-a.example.com', '10.0.0.5'),
+          _slave('10.0.0.6', '10.0.0.6'),
+          _slave('ip-10-0-0-7.ec2.internal', '10.0.0.7', name='gpu'),
+          _slave('node-b.example.com', '10.0.0.8', active=False),
+          Slave('small', True, 'worker', 0.1, 1.0, '10.0.0.9')]
+
+
+def test_build_hosts_without_mirrors():
+    env = Environment(_Cluster([]))
+    assert env._build_hosts(slaves, None) == ['node-a.example.com', '10.0.0.6', 'ip-10-0-0-7.ec2.internal']
+    assert env._build_hosts(slaves, 'gpu') == ['ip-10-0-0-7.ec2.internal']
+    assert env._build_hosts(slaves, 'controller') == []
+
+def test_build_hosts_matches_mirrors_by_ip():
+    env = Environment(_Cluster(['10.0.0.5', '10.0.0.7', '10.0.0.8']))
+    assert env._build_hosts(slaves, None) == ['node-a.example.com', 'ip-10-0-0-7.ec2.internal']
+    assert env._build_hosts(slaves, 'gpu') == ['ip-10-0-0-7.ec2.internal']
+
+def test_build_hosts_with_no_capable_mirror():
+    env = Environment(_Cluster(['10.0.0.9']))
+    assert env._build_hosts(slaves, None) == []
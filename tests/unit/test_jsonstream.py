@@ -0,0 +1,60 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import json
+
+import pytest
+
+from clusterous import jsonstream
+
+
+def _stream(document):
+    return io.BytesIO(json.dumps(document))
+
+
+def test_parse_slaves():
+    slaves = jsonstream.parse_slaves(_stream({'slaves': [
+        {'hostname': 'node-1', 'active': False, 'attributes': {'name': 'worker'},
+         'pid': 'slave(1)@10.0.0.5:5051', 'resources': {'cpus': 2, 'mem': 1024, 'disk': 100}, 'unused': {'big': [1, 2, 3]}},
+        {'hostname': 'node-2'}]}))
+    assert slaves[0] == jsonstream.Slave('node-1', False, 'worker', 2.0, 1024.0, '10.0.0.5')
+    assert slaves[1] == jsonstream.Slave('node-2', True, None, 0.0, 0.0, None)
+
+def test_parse_apps():
+    apps = jsonstream.parse_apps(_stream({'apps': [
+        {'id': '/web', 'instances': 2, 'constraints': [['name', 'CLUSTER', 'worker'], ['hostname', 'UNIQUE']]},
+        {'id': '/idle'}]}))
+    assert apps[0].id == '/web'
+    assert apps[0].instances == 2
+    assert apps[0].constraints == [jsonstream.Constraint('name', 'CLUSTER', 'worker'),
+                                   jsonstream.Constraint('hostname', 'UNIQUE', None)]
+    assert apps[1] == jsonstream.App('/idle', 0, [])
+
+def test_parse_tasks():
+    tasks = jsonstream.parse_tasks(_stream({'tasks': [
+        {'id': 't1', 'appId': '/web', 'host': 'node-1', 'startedAt': '2016-01-01T00:00:00Z'},
+        {'id': 't2', 'appId': '/web', 'host': 'node-2'}]}))
+    assert [ t.started for t in tasks ] == [True, False]
+
+def test_truncated_response():
+    with pytest.raises(jsonstream.JSONError):
+        jsonstream.parse_slaves(io.BytesIO('{"slaves": [{"hostname": "node-1"'))
+
+def test_get_counted_once(server, http_count):
+    url = 'http://localhost:{0}/master/slaves'.format(server)
+    result, count = http_count(lambda: jsonstream.get(url, jsonstream.parse_slaves))
+    assert [ s.hostname for s in result ] == ['node-1']
+    assert count == 1
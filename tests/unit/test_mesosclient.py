@@ -0,0 +1,80 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+
+import pytest
+
+from clusterous import mesosclient
+
+from conftest import _Handler
+
+
+class _Tunnel(object):
+    def __init__(self, port):
+        self.local_port = port
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Cluster(object):
+    def __init__(self, port):
+        self._port = port
+
+    def make_controller_tunnel(self, remote_port):
+        return _Tunnel(self._port)
+
+
+def test_get_counted_once(server, http_count):
+    with mesosclient.MesosClient(_Cluster(server)) as client:
+        result, count = http_count(lambda: client.slave_counts(max_age=0))
+        assert result == {'worker': 1}
+        assert count == 1
+
+def test_cached_and_revalidated(server, http_count):
+    with mesosclient.MesosClient(_Cluster(server)) as client:
+        client.slaves()
+
+        # Cached responses make no request, revalidated ones make one
+        _, count = http_count(lambda: client.slaves())
+        assert count == 0
+        result, count = http_count(lambda: client.slaves(max_age=0))
+        assert [ s.name for s in result ] == ['worker']
+        assert count == 1
+
+@pytest.mark.parametrize('send_etag', [False, True])
+def test_etag_kept_after_not_modified(server, monkeypatch, send_etag):
+    monkeypatch.setattr(_Handler, 'send_etag_on_304', send_etag)
+    with mesosclient.MesosClient(_Cluster(server)) as client:
+        for _ in range(3):
+            assert [ s.hostname for s in client.slaves(max_age=0) ] == ['node-1']
+    assert _Handler.statuses == [200, 304, 304]
+
+def test_concurrent_use(server):
+    with mesosclient.MesosClient(_Cluster(server)) as client:
+        results = []
+        def work():
+            for _ in range(5):
+                results.append(client.slave_counts(max_age=0))
+        threads = [ threading.Thread(target=work) for _ in range(4) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert results == [{'worker': 1}] * 20
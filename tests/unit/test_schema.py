@@ -0,0 +1,80 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from clusterous import helpers
+from clusterous.helpers import SchemaEntry
+
+
+schema = helpers.Schema({
+    'name': SchemaEntry(True, None, str, None),
+    'tags': SchemaEntry(False, [], list, None),
+    'options': SchemaEntry(False, {'retries': 1}, dict, None),
+    'limits': SchemaEntry(False, {}, dict, {
+        'cpu': SchemaEntry(False, 1.0, float, None),
+        'ports': SchemaEntry(False, [], list, None),
+    }),
+})
+
+
+def test_list_and_dict_defaults_are_copied():
+    success, message, first = schema.validate({'name': 'a'})
+    assert success, message
+    first['tags'].append('changed')
+    first['options']['retries'] = 5
+
+    success, message, second = schema.validate({'name': 'b'})
+    assert success, message
+    assert second['tags'] == []
+    assert second['options'] == {'retries': 1}
+    assert schema['tags'].default == []
+    assert schema['options'].default == {'retries': 1}
+
+def test_nested_defaults_are_copied():
+    success, message, first = schema.validate({'name': 'a', 'limits': {}})
+    assert success, message
+    assert first['limits'] == {'cpu': 1.0, 'ports': []}
+    first['limits']['ports'].append(80)
+
+    success, message, second = schema.validate({'name': 'b', 'limits': {}})
+    assert second['limits']['ports'] == []
+
+def test_missing_mandatory_field():
+    success, message, validated = schema.validate({})
+    assert not success
+    assert message == 'Missing mandatory field "name"'
+    assert validated == {}
+
+def test_wrong_type():
+    success, message, _ = schema.validate({'name': 'a', 'tags': 'x'})
+    assert not success
+    assert message == 'For field "tags", expected type "list", got "str"'
+
+def test_nested_error_names_field():
+    success, message, _ = schema.validate({'name': 'a', 'limits': {'cpu': 'x'}})
+    assert not success
+    assert message.startswith('In limits: ')
+
+def test_strict():
+    success, message, _ = schema.validate({'name': 'a', 'extra': 1})
+    assert not success
+    assert message == 'Unexpected field "extra"'
+    success, message, validated = schema.validate({'name': 'a', 'extra': 1}, strict=False)
+    assert success, message
+    assert validated['extra'] == 1
+
+def test_validate_accepts_plain_dictionary():
+    success, message, validated = helpers.validate({'name': 'a'}, dict(schema))
+    assert success, message
+    assert validated['tags'] == []
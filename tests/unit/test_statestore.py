@@ -0,0 +1,85 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sqlite3
+
+import pytest
+
+from clusterous import statestore
+
+
+@pytest.fixture
+def store(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    return statestore.StateStore(str(tmpdir.join('state.db')))
+
+
+def _node(instance_id, warm_pool=False):
+    return {'instance_id': instance_id, 'node_name': 'worker', 'instance_type': 't2.micro',
+            'private_ip': '10.0.0.5', 'state': 'running', 'warm_pool': warm_pool}
+
+
+def test_cluster_info(store):
+    store.update_cluster_info('a', {'running': True, 'nat_ip': '1.2.3.4'})
+    store.update_cluster_info('a', {'running': False})
+    store.update_cluster_info('b', {})
+    assert store.get_cluster_info('a') == {'running': False, 'nat_ip': '1.2.3.4'}
+    assert store.get_cluster_names() == ['a', 'b']
+    assert store.get_cluster_info('unknown') == {}
+
+def test_cluster_info_persists(store, tmpdir):
+    store.update_cluster_info('a', {'spec': {'worker': {'count': 2}}})
+    store.set_working_cluster('a')
+    reopened = statestore.StateStore(str(tmpdir.join('state.db')))
+    assert reopened.get_cluster_info('a') == {'spec': {'worker': {'count': 2}}}
+    assert reopened.get_working_cluster() == 'a'
+
+def test_node_inventory_replaced(store):
+    store.set_nodes('a', [_node('i-1'), _node('i-2', warm_pool=True)])
+    assert store.get_nodes('a') == [_node('i-1'), _node('i-2', warm_pool=True)]
+    store.set_nodes('a', [_node('i-3')])
+    assert store.get_nodes('a') == [_node('i-3')]
+    assert store.get_nodes('b') == []
+
+def test_tunnels(store):
+    store.add_tunnel('a', 8080, 80, '/tmp/a.sock')
+    store.add_tunnel('a', '8081', 81, '/tmp/b.sock')
+    store.delete_tunnel('a', '8080')
+    assert store.get_tunnels('a') == [{'local_port': 8081, 'remote_port': 81, 'sock_file': '/tmp/b.sock'}]
+
+def test_delete_cluster(store):
+    store.update_cluster_info('a', {'running': True})
+    store.set_working_cluster('a')
+    store.set_nodes('a', [_node('i-1')])
+    store.add_tunnel('a', 8080, 80, '/tmp/a.sock')
+    store.delete_cluster('a')
+    assert store.get_cluster_names() == []
+    assert store.get_working_cluster() is None
+    assert store.get_nodes('a') == []
+    assert store.get_tunnels('a') == []
+
+def test_node_inventory_without_warm_pool_column(tmpdir, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmpdir))
+    db_file = str(tmpdir.join('state.db'))
+    conn = sqlite3.connect(db_file)
+    conn.execute('CREATE TABLE nodes (cluster_name TEXT, instance_id TEXT, node_name TEXT, '
+                 'instance_type TEXT, private_ip TEXT, state TEXT, updated REAL, '
+                 'PRIMARY KEY (cluster_name, instance_id))')
+    conn.commit()
+    conn.close()
+
+    store = statestore.StateStore(db_file)
+    store.set_nodes('a', [_node('i-1', warm_pool=True)])
+    assert store.get_nodes('a') == [_node('i-1', warm_pool=True)]
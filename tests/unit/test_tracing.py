@@ -0,0 +1,84 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+
+import requests
+
+from clusterous import tracing
+
+
+def test_counts_reach_enclosing_spans():
+    tracer = tracing.Tracer()
+    with tracer.span('outer') as outer:
+        tracer.count('aws')
+        with tracer.span('inner', phase=1) as inner:
+            tracer.count('aws', 2)
+            tracer.count('ssh')
+    assert dict(inner.counts) == {'aws': 2, 'ssh': 1}
+    assert dict(outer.counts) == {'aws': 3, 'ssh': 1}
+    assert inner.parent_id == outer.id
+    assert inner.depth == 1
+    assert inner.tags == {'phase': 1}
+    assert outer.end is not None
+
+def test_error_is_tagged():
+    tracer = tracing.Tracer()
+    try:
+        with tracer.span('failing') as span:
+            raise ValueError()
+    except ValueError:
+        pass
+    assert span.tags['error'] == 'ValueError'
+    assert span.end is not None
+
+def test_attach_nests_spans_of_other_thread():
+    tracer = tracing.Tracer()
+    with tracer.span('outer') as outer:
+        context = tracer.context()
+        def work():
+            with tracer.attach(context):
+                with tracer.span('task'):
+                    tracer.count('ssh')
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    task = [ s for s in tracer.spans if s.name == 'task' ][0]
+    assert task.parent_id == outer.id
+    assert outer.counts['ssh'] == 1
+
+def test_report_percentages():
+    tracer = tracing.Tracer()
+    with tracer.span('root'):
+        with tracer.span('child'):
+            pass
+    rows = tracer.report()
+    assert [ r[0] for r in rows ] == ['root', '  child']
+    assert rows[0][2] == 100.0
+
+def test_disabled_tracing_does_nothing():
+    if tracing.get_tracer() is None:
+        with tracing.span('nothing') as span:
+            tracing.count('aws')
+        assert span is None
+
+def test_requests_counted_once(server, http_count):
+    url = 'http://localhost:{0}/'.format(server)
+    _, count = http_count(lambda: requests.get(url).close())
+    assert count == 1
+    session = requests.Session()
+    _, count = http_count(lambda: [ session.get(url).close() for _ in range(3) ])
+    session.close()
+    assert count == 3
@@ -0,0 +1,87 @@
+# Copyright 2015 Nicta
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import threading
+
+import pytest
+
+from clusterous import waiter
+
+
+@pytest.fixture(autouse=True)
+def fast_cancel_checks(monkeypatch):
+    monkeypatch.setattr(waiter.defaults, 'wait_cancel_check_interval', 0.01)
+
+def _never():
+    return False
+
+def test_returns_value_of_condition():
+    polls = []
+    def condition():
+        polls.append(None)
+        return len(polls) == 3 and 'ready'
+    assert waiter.wait_until('test', condition, timeout=5, initial=0.01) == 'ready'
+    assert len(polls) == 3
+
+def test_timeout():
+    start = time.time()
+    assert waiter.wait_until('test', _never, timeout=0.2, initial=0.05) is None
+    assert 0.2 <= time.time() - start < 1
+
+def test_max_polls():
+    polls = []
+    def condition():
+        polls.append(None)
+    assert waiter.wait_until('test', condition, max_polls=2, initial=0.01) is None
+    assert len(polls) == 2
+
+def test_backoff_intervals():
+    w = waiter.Waiter('test', initial=1, max_interval=5, multiplier=2, jitter=0)
+    intervals = w.intervals()
+    assert [ next(intervals) for _ in range(5) ] == [1, 2, 4, 5, 5]
+
+def test_enclosing_deadline_limits_timeout():
+    start = time.time()
+    with waiter.deadline(0.2):
+        assert waiter.wait_until('test', _never, timeout=10, initial=0.05) is None
+    assert time.time() - start < 1
+
+def test_nested_deadline_cannot_extend_parent():
+    with waiter.deadline(0.5) as outer:
+        with waiter.deadline(10) as inner:
+            assert inner.remaining() <= 0.5
+        assert waiter.current_deadline() is outer
+    assert waiter.current_deadline() is None
+
+def test_no_deadline_has_no_limit():
+    with waiter.deadline() as d:
+        assert d.remaining() is None
+        assert not d.expired()
+
+def test_cancel_ends_wait_in_other_thread():
+    with waiter.deadline() as d:
+        threading.Timer(0.1, d.cancel).start()
+        start = time.time()
+        assert waiter.wait_until('test', _never, timeout=10, initial=0.05) is None
+        assert time.time() - start < 1
+
+def test_cancel_propagates_to_nested_deadlines():
+    parent = waiter.Deadline()
+    child = waiter.Deadline(10, parent)
+    parent.cancel()
+    assert child.cancelled
+    with waiter.deadline(parent=parent):
+        assert waiter.sleep('test', 10) is False